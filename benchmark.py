@@ -0,0 +1,522 @@
+"""
+Benchmark dei metodi più usati di DatabaseManager su un PostgreSQL locale.
+
+Avvia un cluster temporaneo (initdb in una cartella temporanea), lo popola con
+genera_dati.py alla scala scelta e misura latenza (p50/p95/p99) e throughput
+di ogni scenario. Il risultato è un report JSON che registra anche il commit.
+
+Uso:
+    python benchmark.py esegui --scala 1 --output base.json
+    git checkout <altro commit>
+    python benchmark.py esegui --scala 1 --output nuovo.json
+    python benchmark.py confronta base.json nuovo.json
+
+Il comando memoria non usa il database: confronta memoria e tempo di
+costruzione delle rappresentazioni in memoria del catalogo su righe sintetiche.
+    python benchmark.py memoria --righe 1000000
+"""
+
+import argparse
+import itertools
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from decimal import Decimal
+
+import psycopg2
+
+import genera_dati
+from database import DatabaseManager
+from cache_catalogo import CacheCatalogo
+from models import Libro, CatalogoColonnare
+from strumentazione import strumentazione
+
+
+# Iterazioni predefinite per scenario (load_libri legge tutto il catalogo: ne bastano poche)
+ITERAZIONI = 200
+ITERAZIONI_SCENARIO = {'load_libri': 5}
+RISCALDAMENTO = 3
+
+# Variazione oltre la quale il confronto segnala una regressione
+SOGLIA_REGRESSIONE = 0.10
+# Differenze di latenza sotto questa soglia (ms) sono rumore di misura
+MINIMO_SIGNIFICATIVO_MS = 0.2
+
+
+class ClusterTemporaneo:
+    """Cluster PostgreSQL usa e getta, raggiungibile solo tramite socket locale"""
+
+    def __init__(self, bin_dir=None):
+        self.bin_dir = bin_dir or self._trova_bin_dir()
+        self.cartella = None
+        self.porta = None
+
+    def _trova_bin_dir(self):
+        if shutil.which('initdb'):
+            return os.path.dirname(shutil.which('initdb'))
+        try:
+            return subprocess.check_output(['pg_config', '--bindir'], text=True).strip()
+        except (OSError, subprocess.CalledProcessError):
+            raise RuntimeError("initdb non trovato: installare PostgreSQL o usare --dsn")
+
+    def _comando(self, nome, *argomenti):
+        subprocess.run([os.path.join(self.bin_dir, nome), *argomenti], check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+    def avvia(self):
+        self.cartella = tempfile.mkdtemp(prefix='biblioteca_bench_')
+        dati = os.path.join(self.cartella, 'dati')
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            self.porta = s.getsockname()[1]
+
+        self._comando('initdb', '-D', dati, '-U', 'postgres', '-A', 'trust', '-E', 'UTF8', '--no-sync')
+        self._comando('pg_ctl', '-D', dati, '-w', '-l', os.path.join(self.cartella, 'postgres.log'),
+                      '-o', f"-p {self.porta} -k {self.cartella} -c listen_addresses=''", 'start')
+
+        conn = psycopg2.connect(host=self.cartella, port=self.porta, user='postgres', dbname='postgres')
+        conn.autocommit = True
+        cursor = conn.cursor()
+        cursor.execute("CREATE DATABASE biblioteca")
+        cursor.close()
+        conn.close()
+        return f"host={self.cartella} port={self.porta} user=postgres dbname=biblioteca"
+
+    def ferma(self):
+        if self.cartella:
+            try:
+                self._comando('pg_ctl', '-D', os.path.join(self.cartella, 'dati'), '-m', 'fast', 'stop')
+            finally:
+                shutil.rmtree(self.cartella, ignore_errors=True)
+                self.cartella = None
+
+    def __enter__(self):
+        return self.avvia()
+
+    def __exit__(self, *exc):
+        self.ferma()
+
+
+def campioni(conn, seme, quanti=1000):
+    """Parametri realistici per gli scenari, letti una volta prima delle misure"""
+    cursor = conn.cursor()
+    cursor.execute("SELECT setseed(%s)", (random.Random(seme).random(),))
+    cursor.execute('''SELECT u.id, u.email, i.id, m.id FROM utenti u
+                      JOIN indirizzi_utente i ON i.utente_id = u.id
+                      JOIN metodi_pagamento m ON m.utente_id = u.id
+                      WHERE u.email LIKE 'utente%%@esempio.it'
+                      ORDER BY random() LIMIT %s''', (quanti,))
+    utenti = cursor.fetchall()
+    cursor.execute('''SELECT l.id, l.titolo FROM libri l ORDER BY random() LIMIT %s''', (quanti,))
+    libri = cursor.fetchall()
+    # Per prenota_libro e aggiungi_lista_attesa, che cercano il libro per titolo:
+    # solo titoli che portano a quel libro, disponibili o già prestati
+    disponibilita = {}
+    for chiave, tabella in (('libri_disponibili', 'libri_disponibili'), ('libri_prestati', 'libri_prestati')):
+        cursor.execute(f'''SELECT l.titolo FROM libri l JOIN {tabella} t ON t.libro_id = l.id
+                           WHERE NOT EXISTS (SELECT 1 FROM libri a WHERE a.titolo = l.titolo AND a.id < l.id)
+                           ORDER BY random() LIMIT %s''', (quanti,))
+        disponibilita[chiave] = [row[0] for row in cursor.fetchall()]
+    cursor.execute('''SELECT inv.libreria_id, inv.libro_id, l.prezzo_nuovo FROM inventario_librerie inv
+                      JOIN libri l ON l.id = inv.libro_id
+                      WHERE inv.copie_nuove > 0
+                      ORDER BY random() LIMIT %s''', (quanti,))
+    giacenze = cursor.fetchall()
+    conn.rollback()
+    cursor.close()
+    if not utenti or not libri or not giacenze:
+        raise RuntimeError("Database senza dati generati: eseguire prima genera_dati.py")
+    return {'utenti': utenti, 'libri': libri, 'giacenze': giacenze, **disponibilita}
+
+
+def _parole_ricerca():
+    parole = [p for frase in genera_dati.SOGGETTI + genera_dati.COMPLEMENTI for p in frase.split() if len(p) > 3]
+    return parole + genera_dati.COGNOMI
+
+
+def scenari(dati):
+    """Scenari misurati: nome -> funzione(db, rng) che esegue una chiamata"""
+    parole = _parole_ricerca()
+
+    def utente(rng):
+        return rng.choice(dati['utenti'])
+
+    def libro(rng):
+        return rng.choice(dati['libri'])
+
+    # prenota_libro e aggiungi_lista_attesa modificano lo stato del libro: ogni
+    # chiamata usa un titolo nuovo, così si misura sempre il percorso di scrittura
+    # e non i controlli iniziali ("non disponibile", "già prenotato")
+    da_prenotare = list(dati['libri_disponibili'])
+    in_attesa = list(dati['libri_prestati'])
+
+    def titolo_nuovo(titoli):
+        try:
+            return titoli.pop()
+        except IndexError:
+            raise RuntimeError("Campioni esauriti: ridurre --iterazioni") from None
+
+    def crea_acquisto(db, rng):
+        utente_id, _, indirizzo_id, metodo_id = utente(rng)
+        libreria_id, libro_id, prezzo = rng.choice(dati['giacenze'])
+        carrello = [{'libro_id': libro_id, 'quantita': 1, 'condizione': 'nuovo', 'prezzo_unitario': prezzo}]
+        return db.crea_acquisto(utente_id, libreria_id, indirizzo_id, metodo_id, carrello, 'casa')
+
+    return {
+        'login': lambda db, rng: db.login(utente(rng)[1], 'password123'),
+        'load_libri': lambda db, rng: db.load_libri(),
+        'itera_libri (prima pagina)': lambda db, rng: list(itertools.islice(db.itera_libri(itersize=50), 50)),
+        'cerca_libri (testo)': lambda db, rng: db.cerca_libri(rng.choice(parole)),
+        'cerca_libri (fulltext)': lambda db, rng: db.cerca_libri(rng.choice(parole), modalita='fulltext'),
+        'cerca_libri (fuzzy)': lambda db, rng: db.cerca_libri(rng.choice(parole)[:-1], modalita='fuzzy'),
+        'cerca_libri (prefisso)': lambda db, rng: db.cerca_libri(rng.choice(parole)[:4], modalita='prefisso'),
+        'cerca_libri_faccette': lambda db, rng: db.cerca_libri_faccette(rng.choice(parole), modalita='fulltext'),
+        'prenota_libro': lambda db, rng: db.prenota_libro(utente(rng)[0], titolo_nuovo(da_prenotare)),
+        'aggiungi_lista_attesa': lambda db, rng: db.aggiungi_lista_attesa(utente(rng)[0], titolo_nuovo(in_attesa)),
+        'crea_acquisto': crea_acquisto,
+        'get_acquisti_utente': lambda db, rng: db.get_acquisti_utente(utente(rng)[0]),
+        'get_feedback_libro': lambda db, rng: db.get_feedback_libro(libro(rng)[0]),
+        'mostra_notifiche': lambda db, rng: db.mostra_notifiche(utente(rng)[0]),
+    }
+
+
+def percentile(valori_ordinati, p):
+    """Percentile con il metodo nearest-rank"""
+    indice = max(0, math.ceil(p / 100 * len(valori_ordinati)) - 1)
+    return valori_ordinati[indice]
+
+
+def misura(db, funzione, iterazioni, concorrenza, seme):
+    """Esegue lo scenario e restituisce le statistiche di latenza (ms) e throughput (operazioni/s)"""
+    latenze = []
+    blocco = threading.Lock()
+
+    def esegui(indice_thread, quante):
+        rng = random.Random(f"{seme}:{indice_thread}")
+        for _ in range(RISCALDAMENTO):
+            funzione(db, rng)
+        locali = []
+        for _ in range(quante):
+            inizio = time.perf_counter()
+            funzione(db, rng)
+            locali.append((time.perf_counter() - inizio) * 1000)
+        with blocco:
+            latenze.extend(locali)
+
+    per_thread = max(1, iterazioni // concorrenza)
+    inizio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concorrenza) as esecutore:
+        for futuro in [esecutore.submit(esegui, i, per_thread) for i in range(concorrenza)]:
+            futuro.result()
+    # Il riscaldamento è incluso nel tempo totale ma è trascurabile rispetto alle iterazioni
+    durata = time.perf_counter() - inizio
+
+    latenze.sort()
+    return {
+        'iterazioni': len(latenze),
+        'p50_ms': round(percentile(latenze, 50), 3),
+        'p95_ms': round(percentile(latenze, 95), 3),
+        'p99_ms': round(percentile(latenze, 99), 3),
+        'media_ms': round(sum(latenze) / len(latenze), 3),
+        'throughput_ops': round(len(latenze) / durata, 1),
+    }
+
+
+def commit_corrente():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def esegui_benchmark(dsn, args):
+    """Misura tutti gli scenari (o quelli richiesti) e restituisce il report"""
+    # Senza cache delle ricerche: si misurano le query
+    db = DatabaseManager(dsn=dsn, pool_max=args.concorrenza if args.concorrenza > 1 else None, cache_ricerche=False)
+    with db.connessione() as conn:
+        # Un titolo nuovo per ogni chiamata degli scenari che cambiano la disponibilità
+        dati = campioni(conn, args.seme, max(1000, args.iterazioni + RISCALDAMENTO * args.concorrenza))
+        cursor = conn.cursor()
+        cursor.execute("SHOW server_version")
+        versione_server = cursor.fetchone()[0]
+        cursor.close()
+
+    risultati = {}
+    round_trip = {}
+    for nome, funzione in scenari(dati).items():
+        if args.scenari and nome not in args.scenari:
+            continue
+        iterazioni = ITERAZIONI_SCENARIO.get(nome, args.iterazioni)
+        if args.strumenta:
+            strumentazione.azzera()
+            strumentazione.abilita()
+        risultati[nome] = misura(db, funzione, iterazioni, args.concorrenza, args.seme)
+        if args.strumenta:
+            strumentazione.disabilita()
+            # Round trip medi per chiamata di ogni metodo coinvolto nello scenario
+            round_trip[nome] = {metodo: round(s['round_trip'] / s['chiamate'], 2)
+                                for metodo, s in strumentazione.statistiche()['metodi'].items()}
+        r = risultati[nome]
+        print(f"{nome:<26} p50 {r['p50_ms']:>9.2f} ms  p95 {r['p95_ms']:>9.2f} ms  "
+              f"p99 {r['p99_ms']:>9.2f} ms  {r['throughput_ops']:>9.1f} op/s", file=sys.stderr)
+
+    return {
+        'meta': {
+            'commit': commit_corrente(),
+            'data': datetime.now().isoformat(timespec='seconds'),
+            'scala': args.scala,
+            'seme': args.seme,
+            'concorrenza': args.concorrenza,
+            'postgres': versione_server,
+            'python': platform.python_version(),
+        },
+        'scenari': risultati,
+        'round_trip': round_trip,
+    }
+
+
+def confronta(base, nuovo, soglia=SOGLIA_REGRESSIONE):
+    """Confronta due report e restituisce le regressioni come lista di stringhe"""
+    regressioni = []
+    for nome, dopo in nuovo['scenari'].items():
+        prima = base['scenari'].get(nome)
+        if prima is None:
+            continue
+        for chiave in ('p50_ms', 'p95_ms', 'p99_ms'):
+            if dopo[chiave] - prima[chiave] > MINIMO_SIGNIFICATIVO_MS and dopo[chiave] > prima[chiave] * (1 + soglia):
+                regressioni.append(f"{nome}: {chiave} {prima[chiave]:.2f} -> {dopo[chiave]:.2f}")
+        if dopo['throughput_ops'] < prima['throughput_ops'] * (1 - soglia):
+            regressioni.append(f"{nome}: throughput {prima['throughput_ops']:.1f} -> {dopo['throughput_ops']:.1f} op/s")
+    return regressioni
+
+
+def comando_esegui(args):
+    if args.dsn:
+        if not args.salta_caricamento:
+            genera_dati.genera(args.dsn, args.scala, args.seme, args.processi)
+        report = esegui_benchmark(args.dsn, args)
+    else:
+        with ClusterTemporaneo(args.bin_dir) as dsn:
+            genera_dati.genera(dsn, args.scala, args.seme, args.processi)
+            report = esegui_benchmark(dsn, args)
+
+    testo = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(testo + "\n")
+    else:
+        print(testo)
+    return 0
+
+
+def comando_confronta(args):
+    with open(args.base, encoding='utf-8') as f:
+        base = json.load(f)
+    with open(args.nuovo, encoding='utf-8') as f:
+        nuovo = json.load(f)
+
+    print(f"Confronto {base['meta'].get('commit')} -> {nuovo['meta'].get('commit')}")
+    for nome, dopo in nuovo['scenari'].items():
+        prima = base['scenari'].get(nome)
+        if prima:
+            variazione = (dopo['p95_ms'] / prima['p95_ms'] - 1) * 100 if prima['p95_ms'] else 0
+            print(f"{nome:<26} p95 {prima['p95_ms']:>9.2f} -> {dopo['p95_ms']:>9.2f} ms ({variazione:+.1f}%)")
+
+    regressioni = confronta(base, nuovo, args.soglia)
+    if regressioni:
+        print("\n✗ Regressioni:")
+        for riga in regressioni:
+            print(f"  {riga}")
+        return 1
+    print("\n✓ Nessuna regressione")
+    return 0
+
+
+def righe_sintetiche(quante, seme):
+    """Righe nel formato di DatabaseManager._libro_da_riga. Ogni stringa è un oggetto
+    nuovo, come quelle restituite da psycopg2, anche quando il testo si ripete"""
+    rng = random.Random(seme)
+    autori = max(quante // 20, 1)
+    for libro_id in range(1, quante + 1):
+        prezzo = Decimal(rng.randrange(500, 6000)) / 100
+        yield (libro_id, f"Titolo {libro_id}", f"Autore {rng.randrange(autori)}", f"Genere {rng.randrange(30)}",
+               rng.randrange(1900, 2025), rng.randrange(80, 900), prezzo, prezzo,
+               prezzo * Decimal('0.6') if rng.random() < 0.3 else None,
+               f"Descrizione del libro {libro_id}", f"978{libro_id:010d}", rng.random() < 0.8)
+
+
+# Libro com'era prima di __slots__: stesso costruttore, attributi in un __dict__ per istanza
+LibroConDizionario = type('LibroConDizionario', (), {'__init__': Libro.__init__})
+
+# Ricerche e libri modificati per misurare le letture e l'applicazione di un delta
+RICERCHE_MEMORIA = 1000
+DELTA_MEMORIA = 1000
+
+
+class CatalogoOggetti:
+    """Libri come oggetti con gli indici per id, titolo e autore che CacheCatalogo
+    teneva prima di CatalogoColonnare; stessa interfaccia di CacheCatalogo"""
+
+    def __init__(self, classe, righe):
+        self._libri = {}
+        self._per_titolo = {}
+        self._per_autore = {}
+        for row in righe:
+            libro = classe(row[1], row[2], row[3], row[4], row[5], row[6], row[7], row[8], row[9], row[10])
+            libro.id = row[0]
+            libro.disponibile = bool(row[11])
+            self._aggiungi(libro)
+
+    def _aggiungi(self, libro):
+        vecchio = self._libri.get(libro.id)
+        if vecchio is not None:
+            self._per_titolo[vecchio.titolo].discard(libro.id)
+            self._per_autore[vecchio.autore].discard(libro.id)
+        self._libri[libro.id] = libro
+        self._per_titolo.setdefault(libro.titolo, set()).add(libro.id)
+        self._per_autore.setdefault(libro.autore, set()).add(libro.id)
+
+    def applica_delta(self, delta):
+        for libro in delta[1]:
+            self._aggiungi(libro)
+        return True
+
+    def cerca_titolo(self, titolo):
+        ids = self._per_titolo.get(titolo)
+        return self._libri[min(ids)] if ids else None
+
+    def libri_autore(self, autore):
+        return [self._libri[libro_id] for libro_id in sorted(self._per_autore.get(autore, ()))]
+
+
+def _cache_colonnare(righe):
+    cache = CacheCatalogo()
+    cache.carica((CatalogoColonnare.da_righe(righe), 0, []))
+    return cache
+
+
+RAPPRESENTAZIONI = {
+    'oggetti_dizionario': lambda righe: CatalogoOggetti(LibroConDizionario, righe),
+    'oggetti_slots': lambda righe: CatalogoOggetti(Libro, righe),
+    'colonnare': _cache_colonnare,
+}
+
+
+def _tempo_medio(funzione, argomenti):
+    inizio = time.perf_counter()
+    for argomento in argomenti:
+        funzione(argomento)
+    return (time.perf_counter() - inizio) / len(argomenti)
+
+
+def misura_memoria(quante, seme):
+    """Byte trattenuti, costruzione, ricerche e delta di ogni rappresentazione.
+
+    Per la memoria le righe sono prodotte una alla volta durante la
+    costruzione, come da un cursore: restano solo le stringhe che la
+    rappresentazione conserva. I tempi si misurano su righe già generate e
+    senza tracemalloc, che rallenta le allocazioni. Il delta riscrive
+    DELTA_MEMORIA libri esistenti cambiandone titolo e autore.
+    """
+    righe = list(righe_sintetiche(quante, seme))
+    rng = random.Random(seme)
+    campione = [rng.choice(righe) for _ in range(RICERCHE_MEMORIA)]
+    titoli = [row[1] for row in campione]
+    autori = [row[2] for row in campione]
+    modificati = []
+    for row in rng.sample(righe, min(DELTA_MEMORIA, quante)):
+        libro = Libro(f"{row[1]} (nuova edizione)", rng.choice(autori), *row[3:11])
+        libro.id = row[0]
+        modificati.append(libro)
+
+    risultati = {}
+    for nome, costruisci in RAPPRESENTAZIONI.items():
+        inizio = time.perf_counter()
+        struttura = costruisci(righe)
+        secondi = time.perf_counter() - inizio
+        ricerca_titolo = _tempo_medio(struttura.cerca_titolo, titoli)
+        ricerca_autore = _tempo_medio(struttura.libri_autore, autori)
+        inizio = time.perf_counter()
+        struttura.applica_delta(([1], modificati, []))
+        delta = time.perf_counter() - inizio
+        del struttura
+
+        tracemalloc.start()
+        struttura = costruisci(righe_sintetiche(quante, seme))
+        byte, picco = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del struttura
+        risultati[nome] = {
+            'byte': byte,
+            'byte_per_libro': round(byte / quante, 1),
+            'picco_byte': picco,
+            'costruzione_s': round(secondi, 3),
+            'ricerca_titolo_us': round(ricerca_titolo * 1e6, 1),
+            'ricerca_autore_us': round(ricerca_autore * 1e6, 1),
+            'delta_ms': round(delta * 1000, 1),
+        }
+    return risultati
+
+
+def comando_memoria(args):
+    risultati = misura_memoria(args.righe, args.seme)
+    base = risultati['oggetti_dizionario']
+    print(f"{'rappresentazione':<20} {'MB':>7} {'byte/libro':>11} {'picco MB':>9} {'costruzione':>12} "
+          f"{'titolo':>10} {'autore':>10} {f'delta {DELTA_MEMORIA}':>11}")
+    for nome, r in risultati.items():
+        print(f"{nome:<20} {r['byte'] / 2**20:>7.1f} {r['byte_per_libro']:>11.1f} "
+              f"{r['picco_byte'] / 2**20:>9.1f} {r['costruzione_s']:>10.3f} s "
+              f"{r['ricerca_titolo_us']:>7.1f} µs {r['ricerca_autore_us']:>7.1f} µs {r['delta_ms']:>8.1f} ms "
+              f"({(r['byte'] / base['byte'] - 1) * 100:+.0f}% memoria)")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark di DatabaseManager")
+    comandi = parser.add_subparsers(dest='comando', required=True)
+
+    esegui = comandi.add_parser('esegui', help="esegue il benchmark e scrive il report JSON")
+    esegui.add_argument('--scala', type=float, default=1)
+    esegui.add_argument('--seme', type=int, default=42)
+    esegui.add_argument('--processi', type=int, default=None, help="processi per la generazione dei dati")
+    esegui.add_argument('--iterazioni', type=int, default=ITERAZIONI)
+    esegui.add_argument('--concorrenza', type=int, default=1, help="thread che eseguono le chiamate in parallelo")
+    esegui.add_argument('--scenari', nargs='*', help="limita il benchmark a questi scenari")
+    esegui.add_argument('--strumenta', action='store_true',
+                        help="registra anche i round trip per metodo (con un piccolo costo sulle misure)")
+    esegui.add_argument('--output', help="file JSON di destinazione (default: stdout)")
+    esegui.add_argument('--bin-dir', help="cartella con initdb e pg_ctl")
+    esegui.add_argument('--dsn', help="usa un database esistente invece di un cluster temporaneo")
+    esegui.add_argument('--salta-caricamento', action='store_true', help="con --dsn, non genera i dati")
+    esegui.set_defaults(funzione=comando_esegui)
+
+    confronto = comandi.add_parser('confronta', help="confronta due report e segnala le regressioni")
+    confronto.add_argument('base')
+    confronto.add_argument('nuovo')
+    confronto.add_argument('--soglia', type=float, default=SOGLIA_REGRESSIONE)
+    confronto.set_defaults(funzione=comando_confronta)
+
+    memoria = comandi.add_parser('memoria', help="confronta memoria e costruzione delle rappresentazioni del catalogo")
+    memoria.add_argument('--righe', type=int, default=200000)
+    memoria.add_argument('--seme', type=int, default=42)
+    memoria.set_defaults(funzione=comando_memoria)
+
+    args = parser.parse_args()
+    return args.funzione(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,101 @@
+"""
+Copia locale del catalogo, tenuta allineata con i delta di
+DatabaseManager.carica_catalogo_delta invece di rileggerla per intero.
+
+I trigger su libri, libri_disponibili, libri_prestati e inventario_librerie
+registrano ogni modifica con un numero di versione crescente e inviano una
+NOTIFY: i client in ascolto chiedono solo le modifiche successive alla loro
+versione, cioè lo stato attuale dei libri toccati.
+
+Il numero di versione viene assegnato quando la modifica avviene, non quando
+la transazione termina: una transazione lenta può rendere visibile la
+versione 10 dopo che il client ha già letto la 11. I numeri mancanti sotto
+l'ultima versione letta restano quindi "buchi" richiesti di nuovo ai delta
+successivi, finché compaiono o finché sono passati abbastanza aggiornamenti da
+considerarli transazioni annullate.
+
+I libri sono conservati in un CatalogoColonnare: con un catalogo grande
+non si tiene in memoria un oggetto Libro per riga. Un delta riscrive solo le
+righe dei libri toccati, senza spostare le altre.
+"""
+
+from models import CatalogoColonnare
+
+
+# Aggiornamenti dopo cui un numero di versione mancante si considera annullato
+AGGIORNAMENTI_BUCHI = 20
+
+
+class CacheCatalogo:
+    """Libri del catalogo, consultabili per id, titolo e autore.
+
+    Va modificata solo dal thread dell'interfaccia: le query si eseguono in
+    background e i risultati si passano a carica() e applica_delta().
+    """
+
+    def __init__(self):
+        self.versione = None
+        self.catalogo = CatalogoColonnare()
+        self._buchi = {}  # versione mancante -> aggiornamenti trascorsi
+
+    @property
+    def pronta(self):
+        """Indica se il catalogo è stato caricato e può rispondere alle ricerche"""
+        return self.versione is not None
+
+    def __len__(self):
+        return len(self.catalogo)
+
+    def carica(self, istantanea):
+        """Sostituisce il contenuto con il risultato di DatabaseManager.carica_catalogo"""
+        catalogo, versione, buchi = istantanea
+        self.catalogo = catalogo
+        self.versione = versione
+        self._buchi = dict.fromkeys(buchi, 0)
+
+    def buchi(self):
+        """Numeri di versione da richiedere di nuovo al prossimo delta"""
+        return sorted(self._buchi)
+
+    def applica_delta(self, delta):
+        """Applica il risultato di carica_catalogo_delta.
+
+        Restituisce False se il delta è None: il catalogo va ricaricato con
+        carica() e fino ad allora la cache non risponde alle ricerche.
+        """
+        if delta is None:
+            self.versione = None
+            return False
+
+        versioni, libri, rimossi = delta
+        for libro_id in rimossi:
+            self.catalogo.rimuovi(libro_id)
+        for libro in libri:
+            self.catalogo.aggiorna(libro)
+
+        viste = set(versioni)
+        for versione in list(self._buchi):
+            if versione in viste or self._buchi[versione] >= AGGIORNAMENTI_BUCHI:
+                del self._buchi[versione]
+            else:
+                self._buchi[versione] += 1
+        ultima = max(viste, default=self.versione)
+        if ultima > self.versione:
+            for versione in range(self.versione + 1, ultima):
+                if versione not in viste:
+                    self._buchi[versione] = 0
+            self.versione = ultima
+        return True
+
+    def libro(self, libro_id):
+        riga = self.catalogo.riga_di(libro_id)
+        return None if riga is None else self.catalogo.libro(riga)
+
+    def cerca_titolo(self, titolo):
+        """Libro con il titolo esatto (il primo per id), come DatabaseManager.cerca_titolo"""
+        riga = self.catalogo.cerca_titolo(titolo)
+        return None if riga is None else self.catalogo.libro(riga)
+
+    def libri_autore(self, autore):
+        """Libri dell'autore in ordine di id, come DatabaseManager.cerca_libri_autore"""
+        return [self.catalogo.libro(riga) for riga in self.catalogo.righe_autore(autore)]
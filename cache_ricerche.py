@@ -0,0 +1,184 @@
+"""
+Cache delle pagine di risultati della ricerca nel catalogo.
+
+Le ricerche più frequenti ("Camilleri", "Fantasy") si ripetono da tutte le
+sedi: le pagine già calcolate vengono conservate in un LRU limitato per
+numero di voci, per dimensione stimata in byte e per durata (TTL).
+
+Le modifiche ai libri non svuotano tutta la cache. Una voce viene scartata
+se la sua pagina contiene un libro modificato, oppure se la sua ricerca
+potrebbe trovare quel libro nella stessa struttura, cioè se il libro
+potrebbe entrare o uscire dai risultati. Il secondo controllo sul testo è
+prudente: quando la modalità non permette di escludere la corrispondenza
+(stemming, ricerca tollerante agli errori), la voce si scarta.
+"""
+
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from suggerimenti import normalizza
+
+
+# Limiti predefiniti: voci, byte stimati e secondi di validità di una pagina
+MAX_VOCI = 2000
+MAX_BYTE = 32 * 1024 * 1024
+TTL_SECONDI = 300
+
+# Invalidazione che riguarda le ricerche di tutte le strutture (es. disponibilità)
+OGNI_STRUTTURA = 'ogni_struttura'
+
+# Stima della memoria occupata da un Libro oltre ai suoi testi
+BYTE_PER_LIBRO = 500
+
+# Lettere iniziali di una parola confrontate con il testo del libro per la
+# ricerca per parole: lo stemming italiano conserva quasi sempre l'inizio
+LUNGHEZZA_RADICE = 4
+
+
+def chiave_ricerca(*parti, query, filtri=None):
+    """Chiave di una pagina: query senza spazi agli estremi, filtri in forma ordinata e le
+    altre parti (metodo, modalità, struttura, pagina...) così come sono.
+
+    La query si normalizza solo come fa DatabaseManager._componi_ricerca: due
+    testi con la stessa chiave devono produrre la stessa query SQL (in modalità
+    'testo' "a  b" e "a b" sono pattern ILIKE diversi).
+    """
+    filtri_ordinati = tuple(sorted((nome, tuple(valore) if isinstance(valore, (list, tuple)) else valore)
+                                   for nome, valore in (filtri or {}).items()))
+    return parti + (query.strip(), filtri_ordinati)
+
+
+def stima_byte(libri, faccette=None):
+    """Dimensione approssimativa di una pagina di risultati"""
+    totale = 0
+    for libro in libri:
+        totale += BYTE_PER_LIBRO + sum(len(testo or '') for testo in
+                                       (libro.titolo, libro.autore, libro.genere, libro.descrizione, libro.isbn))
+    if faccette:
+        totale += 100 * sum(len(valori) for valori in faccette.values() if isinstance(valori, list))
+    return totale
+
+
+def testo_libro(libro):
+    """Testo su cui può corrispondere una ricerca, per CacheRicerche.invalida"""
+    return ' '.join(str(getattr(libro, campo, '') or '') for campo in ('titolo', 'autore', 'genere', 'descrizione'))
+
+
+class _Voce:
+    __slots__ = ('valore', 'ids', 'modalita', 'query', 'struttura', 'scade', 'byte')
+
+    def __init__(self, valore, ids, modalita, query, struttura, scade, byte):
+        self.valore = valore
+        self.ids = ids
+        self.modalita = modalita
+        self.query = query
+        self.struttura = struttura
+        self.scade = scade
+        self.byte = byte
+
+    def potrebbe_contenere(self, testo):
+        """Indica se la ricerca potrebbe trovare un libro con questo testo"""
+        testo = normalizza(testo)
+        query = normalizza(self.query)
+        if self.modalita == 'testo':
+            return query in testo
+        if self.modalita in ('fulltext', 'prefisso'):
+            parole = re.findall(r"\w+", query)
+            return not parole or any(parola[:LUNGHEZZA_RADICE] in testo for parola in parole)
+        return True
+
+
+class CacheRicerche:
+    """LRU con TTL delle pagine di risultati, condivisa tra i thread.
+
+    Per evitare di salvare una pagina letta prima di una modifica ma arrivata
+    dopo la sua invalidazione, salva() riceve l'epoca letta prima della query
+    e scarta la pagina se nel frattempo c'è stata un'invalidazione.
+    """
+
+    def __init__(self, max_voci=MAX_VOCI, max_byte=MAX_BYTE, ttl=TTL_SECONDI):
+        self.max_voci = max_voci
+        self.max_byte = max_byte
+        self.ttl = ttl
+        self._voci = OrderedDict()
+        self._byte = 0
+        self._lock = threading.Lock()
+        self.epoca = 0
+        self.hit = 0
+        self.miss = 0
+        self.evizioni = 0
+        self.invalidazioni = 0
+
+    def leggi(self, chiave):
+        """Valore salvato per la chiave, o None se manca o è scaduto"""
+        with self._lock:
+            voce = self._voci.get(chiave)
+            if voce is not None and voce.scade <= time.monotonic():
+                self._scarta(chiave)
+                self.evizioni += 1
+                voce = None
+            if voce is None:
+                self.miss += 1
+                return None
+            self._voci.move_to_end(chiave)
+            self.hit += 1
+            return voce.valore
+
+    def salva(self, chiave, valore, libri, modalita, query, struttura, epoca, faccette=None):
+        """Conserva la pagina se non ci sono state invalidazioni dall'epoca indicata"""
+        byte = stima_byte(libri, faccette)
+        if byte > self.max_byte:
+            return
+        voce = _Voce(valore, frozenset(libro.id for libro in libri), modalita, query, struttura,
+                     time.monotonic() + self.ttl, byte)
+        with self._lock:
+            if epoca != self.epoca:
+                return
+            if chiave in self._voci:
+                self._scarta(chiave)
+            self._voci[chiave] = voce
+            self._byte += byte
+            while len(self._voci) > self.max_voci or self._byte > self.max_byte:
+                self._scarta(next(iter(self._voci)))
+                self.evizioni += 1
+
+    def invalida(self, libri, struttura=OGNI_STRUTTURA):
+        """Scarta le pagine che contengono i libri o che potrebbero includerli.
+
+        libri sono coppie (id, testo); struttura è (tipo, id) delle ricerche
+        in cui il libro può essere comparso o sparito, (None, None) per la
+        ricerca globale, OGNI_STRUTTURA se la modifica vale ovunque.
+        """
+        ids = {libro_id for libro_id, _ in libri}
+        testi = [testo for _, testo in libri]
+        with self._lock:
+            self.epoca += 1
+            for chiave, voce in list(self._voci.items()):
+                stessa_struttura = struttura == OGNI_STRUTTURA or voce.struttura == struttura
+                if voce.ids & ids or (stessa_struttura and any(voce.potrebbe_contenere(t) for t in testi)):
+                    self._scarta(chiave)
+                    self.invalidazioni += 1
+
+    def svuota(self):
+        with self._lock:
+            self.epoca += 1
+            self.invalidazioni += len(self._voci)
+            self._voci.clear()
+            self._byte = 0
+
+    def _scarta(self, chiave):
+        self._byte -= self._voci.pop(chiave).byte
+
+    def statistiche(self):
+        """Contatori di hit, miss, evizioni (LRU, dimensione, TTL) e invalidazioni"""
+        with self._lock:
+            return {
+                'voci': len(self._voci),
+                'byte': self._byte,
+                'hit': self.hit,
+                'miss': self.miss,
+                'evizioni': self.evizioni,
+                'invalidazioni': self.invalidazioni,
+            }
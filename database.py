@@ -2,482 +2,561 @@
 Modulo per la gestione del database PostgreSQL
 """
 
+import os
+import io
+import re
+import csv
+import functools
+import itertools
+import threading
+import time
 import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
 import hashlib
+from contextlib import contextmanager, nullcontext
 from datetime import datetime, timedelta
-from models import Libro
+from models import Libro, CatalogoColonnare
+from cache_ricerche import CacheRicerche, OGNI_STRUTTURA, chiave_ricerca, testo_libro
+from migrazioni import applica_migrazioni, popola_dati_esempio
+from strumentazione import strumentazione, ConnessioneStrumentata
+
+# Soglia di similarità (0-1) predefinita per la ricerca tollerante agli errori
+SOGLIA_SIMILARITA = 0.4
+
+# Connessione predefinita, sovrascrivibile con la variabile d'ambiente BIBLIOTECA_DSN
+DSN_PREDEFINITO = "dbname=biblioteca user=postgres password=a host=localhost port=5432"
+
+# Fasce di prezzo della ricerca per faccette: limiti in euro ed etichette
+# (width_bucket restituisce 0 sotto il primo limite, 1 tra il primo e il secondo, ...)
+LIMITI_FASCE_PREZZO = [10, 20, 35]
+FASCE_PREZZO = ['Fino a €10', '€10–20', '€20–35', 'Oltre €35']
+
+# Prezzo su cui si calcola la fascia: il più basso tra nuovo e usato, altrimenti il prezzo base
+PREZZO_FACCETTA = "COALESCE(LEAST(l.prezzo_nuovo, l.prezzo_usato), l.prezzo)"
+
+# Canale NOTIFY su cui i trigger segnalano le modifiche al catalogo
+CANALE_CATALOGO = 'catalogo'
+
+# Canale NOTIFY su cui i trigger segnalano le modifiche a città, strutture e ruoli
+CANALE_RIFERIMENTO = 'riferimento'
+
+# Secondi dopo cui i dati di riferimento vengono riletti anche senza notifiche
+TTL_RIFERIMENTO = 600
+
+# Numeri di versione, sotto quella caricata, controllati alla prima lettura del catalogo
+FINESTRA_VERSIONI = 100
+
+# Il registro modifiche_catalogo conserva almeno le ultime versioni e gli ultimi giorni
+VERSIONI_CONSERVATE = 10000
+GIORNI_MODIFICHE_CONSERVATE = 7
+# Advisory lock che evita potature del registro contemporanee da più client
+LOCK_POTATURA_CATALOGO = 7400118
+
+# Righe chieste al server a ogni giro dai cursori con nome di itera_libri
+ITERSIZE_LIBRI = 2000
+
+# Colonne per cui si può ordinare il catalogo, con l'espressione SQL corrispondente
+COLONNE_CATALOGO = {
+    'titolo': "l.titolo",
+    'autore': "a.nome",
+    'genere': "g.nome",
+    'anno_pubblicazione': "l.anno_pubblicazione",
+    'numero_pagine': "l.numero_pagine",
+    'prezzo': "l.prezzo",
+    'disponibile': "(ld.libro_id IS NOT NULL)",
+}
+
+
+class PoolEsaurito(Exception):
+    """Nessuna connessione del pool si è liberata entro il timeout"""
+
+
+class TransazioneAnnullata(Exception):
+    """Un'operazione annidata è fallita e la transazione esterna è stata annullata"""
+
+
+class QueryAnnullata(Exception):
+    """La query è stata interrotta con Annullamento.annulla()"""
+
+
+class Annullamento:
+    """Permette di interrompere da un altro thread la query di un'operazione.
+
+    Il metodo che lo riceve esegue le sue query dentro esecuzione(conn); finché
+    una query è in corso annulla() la interrompe sul server con conn.cancel(),
+    dopo di che ogni nuova esecuzione fallisce subito con QueryAnnullata.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._conn = None
+        self.annullato = False
+
+    @contextmanager
+    def esecuzione(self, conn):
+        with self._lock:
+            if self.annullato:
+                raise QueryAnnullata("Operazione annullata")
+            self._conn = conn
+        try:
+            yield
+        except psycopg2.extensions.QueryCanceledError as e:
+            if self.annullato:
+                raise QueryAnnullata("Operazione annullata") from e
+            raise
+        finally:
+            # Da qui la connessione può passare ad altre operazioni: non va più interrotta
+            with self._lock:
+                self._conn = None
+
+    def annulla(self):
+        with self._lock:
+            self.annullato = True
+            if self._conn is not None:
+                self._conn.cancel()
+
+
+def _operazione(metodo):
+    """Esegue il metodo con la connessione assegnata al thread chiamante.
+
+    Le chiamate annidate (un metodo che ne invoca un altro) riusano la stessa
+    connessione e la stessa transazione: solo l'operazione più esterna esegue
+    davvero commit, poi la connessione torna al pool.
+    """
+    @functools.wraps(metodo)
+    def wrapper(self, *args, **kwargs):
+        with self.connessione(), strumentazione.operazione(metodo.__name__):
+            locale = self._locale
+            locale.livello += 1
+            # Dentro transazione(commit_ogni=...) ogni operazione è isolata da un
+            # savepoint, così un errore annulla solo lei e non tutto il gruppo
+            savepoint = bool(locale.commit_ogni) and locale.livello == locale.livello_gruppo + 1
+            try:
+                if savepoint:
+                    self._esegui_savepoint("SAVEPOINT operazione")
+                    locale.savepoint = True
+                    locale.invalidazioni_savepoint = len(locale.invalidazioni)
+                return metodo(self, *args, **kwargs)
+            except Exception:
+                if savepoint and locale.savepoint:
+                    self._rollback()
+                elif locale.livello == 1 and not self.conn.closed:
+                    # L'operazione più esterna non lascia lavoro a metà sulla
+                    # connessione, che altrimenti finirebbe nel commit successivo
+                    self._rollback()
+                raise
+            finally:
+                if savepoint and locale.savepoint:
+                    self._esegui_savepoint("RELEASE SAVEPOINT operazione")
+                    locale.savepoint = False
+                locale.livello -= 1
+    return wrapper
+
+
+def copia_righe(cursor, tabella, colonne, righe, blocco=100000):
+    """Carica righe (tuple) in una tabella con COPY FROM STDIN, a blocchi per limitare la memoria"""
+    righe = iter(righe)
+    totale = 0
+    while True:
+        parte = list(itertools.islice(righe, blocco))
+        if not parte:
+            return totale
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(parte)
+        buffer.seek(0)
+        cursor.copy_expert(f"COPY {tabella} ({', '.join(colonne)}) FROM STDIN WITH (FORMAT csv)", buffer)
+        totale += len(parte)
+
+
+class CursoreCatalogo:
+    """Cursore lato server sul catalogo ordinato e filtrato, letto a blocchi.
+
+    Usa una connessione dedicata in sola lettura, aperta finché il cursore non
+    viene chiuso, così non occupa il pool né la connessione condivisa: le righe
+    lasciano il server solo quando vengono richieste con leggi().
+    """
+
+    def __init__(self, db, ordina='titolo', discendente=False, filtro=None):
+        if ordina not in COLONNE_CATALOGO:
+            raise ValueError(f"Colonna di ordinamento non valida: {ordina}")
+        self._db = db
+        self.finito = False
+        direzione = "DESC" if discendente else "ASC"
+        condizione, params = "TRUE", []
+        if filtro and filtro.strip():
+            pattern = f"%{db._escape_like(filtro.strip())}%"
+            condizione = "(l.titolo ILIKE %s OR a.nome ILIKE %s OR g.nome ILIKE %s)"
+            params = [pattern, pattern, pattern]
+
+        self._conn = psycopg2.connect(db.dsn, connection_factory=ConnessioneStrumentata)
+        try:
+            self._conn.set_session(readonly=True)
+            # Un cursore con nome è un DECLARE: il planner privilegia i piani che
+            # restituiscono subito le prime righe (es. scansione dell'indice sul titolo)
+            self._cursor = self._conn.cursor(name='catalogo')
+            self._cursor.execute(f'''SELECT l.id, l.titolo, a.nome, g.nome, l.anno_pubblicazione, l.numero_pagine, l.prezzo,
+                                           l.prezzo_nuovo, l.prezzo_usato, l.descrizione, l.isbn,
+                                           ld.libro_id IS NOT NULL as disponibile
+                                    FROM libri l
+                                    JOIN autori a ON l.autore_id = a.id
+                                    JOIN generi g ON l.genere_id = g.id
+                                    LEFT JOIN libri_disponibili ld ON l.id = ld.libro_id
+                                    WHERE {condizione}
+                                    ORDER BY {COLONNE_CATALOGO[ordina]} {direzione}, l.id {direzione}''', params)
+        except Exception:
+            self._conn.close()
+            raise
+
+    def leggi(self, quanti):
+        """Restituisce i successivi quanti libri (meno alla fine del catalogo)"""
+        righe = self._cursor.fetchmany(quanti)
+        if len(righe) < quanti:
+            self.finito = True
+        return [self._db._libro_da_riga(row) for row in righe]
+
+    def chiudi(self):
+        if not self._conn.closed:
+            self._conn.close()
+
+
+class DatiRiferimento:
+    """Città, strutture per città e ruoli letti insieme da DatabaseManager.
+
+    Non viene mai modificato dopo la costruzione: quando i dati cambiano se ne
+    crea uno nuovo, quindi i thread possono leggerlo senza lock.
+    """
+
+    def __init__(self, righe=(), caricati_il=None):
+        self.caricati_il = caricati_il  # time.monotonic() della lettura, None se vuoto
+        self.citta = []  # (id, nome, regione) ordinate per nome
+        self.biblioteche = []  # (id, nome) ordinate per nome
+        self.librerie = []
+        self.biblioteche_per_citta = {}  # citta_id -> [(id, nome)]
+        self.librerie_per_citta = {}
+        self.ruoli = {}  # nome -> id
+        for tipo, id_riga, nome, regione, citta_id in righe:
+            if tipo == 'citta':
+                self.citta.append((id_riga, nome, regione))
+            elif tipo == 'biblioteca':
+                self.biblioteche.append((id_riga, nome))
+                self.biblioteche_per_citta.setdefault(citta_id, []).append((id_riga, nome))
+            elif tipo == 'libreria':
+                self.librerie.append((id_riga, nome))
+                self.librerie_per_citta.setdefault(citta_id, []).append((id_riga, nome))
+            else:
+                self.ruoli[nome] = id_riga
 
 
 class DatabaseManager:
     """Classe per gestire le operazioni del database"""
 
-    def __init__(self):
-        """Inizializza la connessione al database"""
+    def __init__(self, dsn=None, pool_min=None, pool_max=None, timeout=30, cache_ricerche=True):
+        """Inizializza la connessione al database.
+
+        Senza pool_max tutte le operazioni condividono una sola connessione e
+        vengono eseguite una alla volta. Con pool_max ogni operazione prende in
+        prestito una connessione da un pool di pool_min..pool_max connessioni,
+        attendendo al massimo timeout secondi che se ne liberi una.
+        Con cache_ricerche=False le ricerche interrogano sempre il database
+        (per i benchmark, che misurano le query).
+        """
+        self.dsn = dsn or os.environ.get('BIBLIOTECA_DSN', DSN_PREDEFINITO)
+        self.timeout = timeout
+        self._locale = threading.local()
+        self._pool = None
+        self._conn_condivisa = None
+        self._riferimento = DatiRiferimento()
+        self.cache_ricerche = CacheRicerche() if cache_ricerche else None
+        self._lock_riferimento = threading.Lock()
+        self._conn_lettura = None  # Connessione per itera_libri senza pool
+        self._lock_lettura = threading.Lock()
         try:
-            self.conn = psycopg2.connect(
-                dbname='biblioteca',
-                user='postgres',
-                password='a',  # Password corretta fornita dall'utente
-                host='localhost',
-                port='5432'
-            )
-            self.conn.autocommit = False
+            if pool_max:
+                self._pool = psycopg2.pool.ThreadedConnectionPool(pool_min or 1, pool_max, self.dsn,
+                                                                  connection_factory=ConnessioneStrumentata)
+                self._slot = threading.BoundedSemaphore(pool_max)
+            else:
+                self._conn_condivisa = psycopg2.connect(self.dsn, connection_factory=ConnessioneStrumentata)
+                self._conn_condivisa.autocommit = False
+                self._lock = threading.RLock()
             self.create_tables()
+            self.ricarica_riferimento()
         except Exception as e:
             print(f"Errore di connessione al database: {e}")
             print("Assicurati che il database 'biblioteca' esista su PostgreSQL.")
             raise
 
-    def create_tables(self):
-        """Crea le tabelle del database se non esistono"""
-        cursor = self.conn.cursor()
-
+    @property
+    def conn(self):
+        """Connessione dell'operazione in corso nel thread chiamante"""
+        conn = getattr(self._locale, 'conn', None)
+        if conn is not None:
+            return conn
+        if self._pool is None:
+            return self._conn_condivisa
+        raise RuntimeError("Con il pool attivo usare 'with db.connessione() as conn'")
+
+    @contextmanager
+    def connessione(self):
+        """Assegna una connessione al thread per la durata del blocco with"""
+        locale = self._locale
+        if getattr(locale, 'conn', None) is not None:
+            # Operazione annidata: riusa la connessione già assegnata
+            yield locale.conn
+            return
+
+        conn = self._acquisisci()
+        locale.conn = conn
+        locale.livello = 0
+        locale.solo_rollback = False
+        locale.commit_ogni = None
+        locale.livello_gruppo = 0
+        locale.in_sospeso = 0
+        locale.savepoint = False
+        locale.invalidazioni = []  # In attesa del commit
+        locale.invalidazioni_savepoint = 0
+        locale.confermate = []  # Già confermate da un commit
         try:
-            # Tabelle esistenti per l'autenticazione
-            cursor.execute('''CREATE TABLE IF NOT EXISTS ruoli (
-                id SERIAL PRIMARY KEY,
-                nome VARCHAR(50) UNIQUE NOT NULL
-            )''')
-
-            # Nuova tabella per le città
-            cursor.execute('''CREATE TABLE IF NOT EXISTS citta (
-                id SERIAL PRIMARY KEY,
-                nome VARCHAR(255) UNIQUE NOT NULL,
-                regione VARCHAR(255)
-            )''')
-
-            cursor.execute('''CREATE TABLE IF NOT EXISTS biblioteche (
-                id SERIAL PRIMARY KEY,
-                nome VARCHAR(255) NOT NULL,
-                indirizzo VARCHAR(255),
-                citta_id INTEGER REFERENCES citta(id)
-            )''')
-
-            cursor.execute('''CREATE TABLE IF NOT EXISTS librerie (
-                id SERIAL PRIMARY KEY,
-                nome VARCHAR(255) NOT NULL,
-                indirizzo VARCHAR(255),
-                citta_id INTEGER REFERENCES citta(id)
-            )''')
-
-            cursor.execute('''CREATE TABLE IF NOT EXISTS utenti (
-                id SERIAL PRIMARY KEY,
-                email VARCHAR(255) UNIQUE NOT NULL,
-                nome_utente VARCHAR(100) UNIQUE NOT NULL,
-                nome VARCHAR(100) NOT NULL,
-                cognome VARCHAR(100) NOT NULL,
-                password_hash VARCHAR(255) NOT NULL,
-                ruolo_id INTEGER REFERENCES ruoli(id),
-                biblioteca_id INTEGER REFERENCES biblioteche(id),
-                libreria_id INTEGER REFERENCES librerie(id),
-                data_registrazione TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )''')
-
-            # Tabelle per i libri
-            cursor.execute('''CREATE TABLE IF NOT EXISTS autori (
-                id SERIAL PRIMARY KEY,
-                nome VARCHAR(255) UNIQUE NOT NULL
-            )''')
-
-            cursor.execute('''CREATE TABLE IF NOT EXISTS generi (
-                id SERIAL PRIMARY KEY,
-                nome VARCHAR(255) UNIQUE NOT NULL
-            )''')
-
-            cursor.execute('''CREATE TABLE IF NOT EXISTS libri (
-                id SERIAL PRIMARY KEY,
-                titolo VARCHAR(255) NOT NULL,
-                autore_id INTEGER REFERENCES autori(id),
-                genere_id INTEGER REFERENCES generi(id),
-                anno_pubblicazione INTEGER,
-                numero_pagine INTEGER,
-                prezzo_nuovo DECIMAL(10,2),
-                prezzo_usato DECIMAL(10,2),
-                descrizione TEXT,
-                isbn VARCHAR(20) UNIQUE
-            )''')
-
-            cursor.execute('''CREATE TABLE IF NOT EXISTS libri_disponibili (
-                id SERIAL PRIMARY KEY,
-                libro_id INTEGER REFERENCES libri(id) UNIQUE
-            )''')
-
-            cursor.execute('''CREATE TABLE IF NOT EXISTS libri_prestati (
-                id SERIAL PRIMARY KEY,
-                libro_id INTEGER REFERENCES libri(id) UNIQUE
-            )''')
-
-            # Nuove tabelle per il sistema di acquisti
-            cursor.execute('''CREATE TABLE IF NOT EXISTS inventario_librerie (
-                id SERIAL PRIMARY KEY,
-                libreria_id INTEGER REFERENCES librerie(id),
-                libro_id INTEGER REFERENCES libri(id),
-                copie_nuove INTEGER DEFAULT 0,
-                copie_usate INTEGER DEFAULT 0,
-                copie_vendute INTEGER DEFAULT 0,
-                UNIQUE(libreria_id, libro_id)
-            )''')
-
-            cursor.execute('''CREATE TABLE IF NOT EXISTS indirizzi_utente (
-                id SERIAL PRIMARY KEY,
-                utente_id INTEGER REFERENCES utenti(id),
-                nome VARCHAR(100) NOT NULL,
-                cognome VARCHAR(100) NOT NULL,
-                indirizzo VARCHAR(255) NOT NULL,
-                citta VARCHAR(100) NOT NULL,
-                cap VARCHAR(10) NOT NULL,
-                provincia VARCHAR(50) NOT NULL,
-                telefono VARCHAR(20),
-                is_default BOOLEAN DEFAULT FALSE,
-                data_creazione TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )''')
-
-            cursor.execute('''CREATE TABLE IF NOT EXISTS metodi_pagamento (
-                id SERIAL PRIMARY KEY,
-                utente_id INTEGER REFERENCES utenti(id),
-                tipo VARCHAR(20) NOT NULL CHECK (tipo IN ('carta_credito', 'carta_debito', 'paypal')),
-                numero_carta VARCHAR(255), -- criptato
-                scadenza DATE,
-                titolare VARCHAR(100),
-                is_default BOOLEAN DEFAULT FALSE,
-                data_creazione TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )''')
-
-            cursor.execute('''CREATE TABLE IF NOT EXISTS acquisti (
-                id SERIAL PRIMARY KEY,
-                utente_id INTEGER REFERENCES utenti(id),
-                libreria_id INTEGER REFERENCES librerie(id),
-                indirizzo_consegna_id INTEGER REFERENCES indirizzi_utente(id),
-                metodo_pagamento_id INTEGER REFERENCES metodi_pagamento(id),
-                totale DECIMAL(10,2) NOT NULL,
-                tasse DECIMAL(10,2) DEFAULT 0,
-                sconto DECIMAL(10,2) DEFAULT 0,
-                stato VARCHAR(30) DEFAULT 'in_attesa' CHECK (stato IN ('in_attesa', 'confermato', 'in_preparazione', 'spedito', 'consegnato', 'cancellato')),
-                tipo_consegna VARCHAR(20) DEFAULT 'negozio' CHECK (tipo_consegna IN ('negozio', 'casa')),
-                note TEXT,
-                data_acquisto TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                data_consegna_prevista TIMESTAMP,
-                data_consegna_effettiva TIMESTAMP
-            )''')
-
-            cursor.execute('''CREATE TABLE IF NOT EXISTS dettagli_acquisto (
-                id SERIAL PRIMARY KEY,
-                acquisto_id INTEGER REFERENCES acquisti(id),
-                libro_id INTEGER REFERENCES libri(id),
-                libreria_id INTEGER REFERENCES librerie(id),
-                quantita INTEGER NOT NULL,
-                condizione VARCHAR(10) NOT NULL CHECK (condizione IN ('nuovo', 'usato')),
-                prezzo_unitario DECIMAL(10,2) NOT NULL,
-                sconto DECIMAL(10,2) DEFAULT 0,
-                totale DECIMAL(10,2) NOT NULL
-            )''')
-
-            cursor.execute('''CREATE TABLE IF NOT EXISTS feedback_libri (
-                id SERIAL PRIMARY KEY,
-                utente_id INTEGER REFERENCES utenti(id),
-                libro_id INTEGER REFERENCES libri(id),
-                acquisto_id INTEGER REFERENCES acquisti(id),
-                valutazione INTEGER CHECK (valutazione >= 1 AND valutazione <= 5),
-                commento TEXT,
-                utile INTEGER DEFAULT 0,
-                non_utile INTEGER DEFAULT 0,
-                data_recensione TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                moderato BOOLEAN DEFAULT FALSE
-            )''')
-
-            cursor.execute('''CREATE TABLE IF NOT EXISTS consegne (
-                id SERIAL PRIMARY KEY,
-                acquisto_id INTEGER REFERENCES acquisti(id),
-                corriere VARCHAR(100),
-                numero_tracking VARCHAR(100) UNIQUE,
-                stato VARCHAR(30) DEFAULT 'in_preparazione' CHECK (stato IN ('in_preparazione', 'spedito', 'in_transito', 'consegnato', 'ritornato')),
-                indirizzo_consegna TEXT,
-                data_spedizione TIMESTAMP,
-                data_consegna_prevista TIMESTAMP,
-                data_consegna_effettiva TIMESTAMP,
-                note TEXT
-            )''')
-
-            cursor.execute('''CREATE TABLE IF NOT EXISTS richieste_bibliotecari (
-                id SERIAL PRIMARY KEY,
-                bibliotecario_id INTEGER REFERENCES utenti(id),
-                tipo VARCHAR(30) NOT NULL CHECK (tipo IN ('prenotazione', 'lista_attesa', 'restituzione', 'altro')),
-                descrizione TEXT NOT NULL,
-                priorita VARCHAR(10) DEFAULT 'normale' CHECK (priorita IN ('bassa', 'normale', 'alta', 'urgente')),
-                stato VARCHAR(20) DEFAULT 'aperta' CHECK (stato IN ('aperta', 'in_lavorazione', 'risolta', 'chiusa')),
-                data_creazione TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                data_risoluzione TIMESTAMP
-            )''')
-
-            # Migrazioni per aggiornare lo schema esistente
-            cursor.execute('''ALTER TABLE libri ADD COLUMN IF NOT EXISTS prezzo_nuovo DECIMAL(10,2)''')
-            cursor.execute('''ALTER TABLE libri ADD COLUMN IF NOT EXISTS prezzo_usato DECIMAL(10,2)''')
-            cursor.execute('''ALTER TABLE libri ADD COLUMN IF NOT EXISTS descrizione TEXT''')
-            cursor.execute('''ALTER TABLE libri ADD COLUMN IF NOT EXISTS isbn VARCHAR(20)''')
-
-            # Aggiorna prezzi esistenti se NULL
-            cursor.execute('''UPDATE libri SET prezzo_nuovo = prezzo WHERE prezzo_nuovo IS NULL''')
-            cursor.execute('''UPDATE libri SET prezzo_usato = prezzo * 0.7 WHERE prezzo_usato IS NULL''')  # usato = 70% del prezzo nuovo
-
-            cursor.execute('''ALTER TABLE biblioteche ADD COLUMN IF NOT EXISTS citta_id INTEGER REFERENCES citta(id)''')
-            cursor.execute('''ALTER TABLE librerie ADD COLUMN IF NOT EXISTS citta_id INTEGER REFERENCES citta(id)''')
-
-            # Aggiorna dati esistenti se citta_id è NULL (per database esistenti)
-            cursor.execute('''UPDATE biblioteche SET citta_id = (SELECT id FROM citta WHERE nome = 'Roma' LIMIT 1) WHERE citta_id IS NULL''')
-            cursor.execute('''UPDATE librerie SET citta_id = (SELECT id FROM citta WHERE nome = 'Roma' LIMIT 1) WHERE citta_id IS NULL''')
-
-            # Inserisci ruoli di default se non esistono
-            cursor.execute("INSERT INTO ruoli (nome) VALUES ('bibliotecario') ON CONFLICT (nome) DO NOTHING")
-            cursor.execute("INSERT INTO ruoli (nome) VALUES ('libraio') ON CONFLICT (nome) DO NOTHING")
-            cursor.execute("INSERT INTO ruoli (nome) VALUES ('utente') ON CONFLICT (nome) DO NOTHING")
-
-            # Inserisci città di default se non esistono
-            cursor.execute("INSERT INTO citta (nome, regione) VALUES ('Milano', 'Lombardia') ON CONFLICT (nome) DO NOTHING")
-            cursor.execute("INSERT INTO citta (nome, regione) VALUES ('Roma', 'Lazio') ON CONFLICT (nome) DO NOTHING")
-            cursor.execute("INSERT INTO citta (nome, regione) VALUES ('Torino', 'Piemonte') ON CONFLICT (nome) DO NOTHING")
-            cursor.execute("INSERT INTO citta (nome, regione) VALUES ('Firenze', 'Toscana') ON CONFLICT (nome) DO NOTHING")
-            cursor.execute("INSERT INTO citta (nome, regione) VALUES ('Napoli', 'Campania') ON CONFLICT (nome) DO NOTHING")
-            cursor.execute("INSERT INTO citta (nome, regione) VALUES ('Bologna', 'Emilia-Romagna') ON CONFLICT (nome) DO NOTHING")
-
-            # Migrazioni per aggiornare lo schema esistente
-            cursor.execute('''ALTER TABLE biblioteche ADD COLUMN IF NOT EXISTS citta_id INTEGER REFERENCES citta(id)''')
-            cursor.execute('''ALTER TABLE librerie ADD COLUMN IF NOT EXISTS citta_id INTEGER REFERENCES citta(id)''')
-
-            # Aggiorna dati esistenti se citta_id è NULL (per database esistenti)
-            cursor.execute('''UPDATE biblioteche SET citta_id = (SELECT id FROM citta WHERE nome = 'Roma' LIMIT 1) WHERE citta_id IS NULL''')
-            cursor.execute('''UPDATE librerie SET citta_id = (SELECT id FROM citta WHERE nome = 'Roma' LIMIT 1) WHERE citta_id IS NULL''')
-
-            # Inserisci biblioteche di default se non esistono
-            cursor.execute("INSERT INTO biblioteche (nome, indirizzo, citta_id) SELECT 'Biblioteca Centrale', 'Via Roma 1, Milano', c.id FROM citta c WHERE c.nome = 'Milano' ON CONFLICT DO NOTHING")
-            cursor.execute("INSERT INTO biblioteche (nome, indirizzo, citta_id) SELECT 'Biblioteca Comunale', 'Piazza Garibaldi 2, Roma', c.id FROM citta c WHERE c.nome = 'Roma' ON CONFLICT DO NOTHING")
-            cursor.execute("INSERT INTO biblioteche (nome, indirizzo, citta_id) SELECT 'Biblioteca Nazionale', 'Via Nazionale 1, Roma', c.id FROM citta c WHERE c.nome = 'Roma' ON CONFLICT DO NOTHING")
-            cursor.execute("INSERT INTO biblioteche (nome, indirizzo, citta_id) SELECT 'Biblioteca Universitaria', 'Via Università 2, Milano', c.id FROM citta c WHERE c.nome = 'Milano' ON CONFLICT DO NOTHING")
-            cursor.execute("INSERT INTO biblioteche (nome, indirizzo, citta_id) SELECT 'Biblioteca Civica', 'Piazza Dante 3, Firenze', c.id FROM citta c WHERE c.nome = 'Firenze' ON CONFLICT DO NOTHING")
-            cursor.execute("INSERT INTO biblioteche (nome, indirizzo, citta_id) SELECT 'Biblioteca Provinciale', 'Via Garibaldi 4, Napoli', c.id FROM citta c WHERE c.nome = 'Napoli' ON CONFLICT DO NOTHING")
-
-            # Inserisci librerie di default se non esistono
-            cursor.execute("INSERT INTO librerie (nome, indirizzo, citta_id) SELECT 'Mondadori', 'Via dei Libri 1, Roma', c.id FROM citta c WHERE c.nome = 'Roma' ON CONFLICT DO NOTHING")
-            cursor.execute("INSERT INTO librerie (nome, indirizzo, citta_id) SELECT 'Feltrinelli', 'Corso Italia 2, Milano', c.id FROM citta c WHERE c.nome = 'Milano' ON CONFLICT DO NOTHING")
-            cursor.execute("INSERT INTO librerie (nome, indirizzo, citta_id) SELECT 'IBS', 'Via Shopping 3, Firenze', c.id FROM citta c WHERE c.nome = 'Firenze' ON CONFLICT DO NOTHING")
-            cursor.execute("INSERT INTO librerie (nome, indirizzo, citta_id) SELECT 'Libreria Universitaria', 'Via Studenti 4, Napoli', c.id FROM citta c WHERE c.nome = 'Napoli' ON CONFLICT DO NOTHING")
-            cursor.execute("INSERT INTO librerie (nome, indirizzo, citta_id) SELECT 'Libreria del Centro', 'Piazza Duomo 5, Bologna', c.id FROM citta c WHERE c.nome = 'Bologna' ON CONFLICT DO NOTHING")
-            cursor.execute("INSERT INTO librerie (nome, indirizzo, citta_id) SELECT 'Libreria Moderna', 'Via Moderna 6, Torino', c.id FROM citta c WHERE c.nome = 'Torino' ON CONFLICT DO NOTHING")
-
-            # Nuove tabelle per le funzionalità utente
-            cursor.execute('''CREATE TABLE IF NOT EXISTS prenotazioni (
-                id SERIAL PRIMARY KEY,
-                utente_id INTEGER REFERENCES utenti(id),
-                libro_id INTEGER REFERENCES libri(id),
-                data_prenotazione TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                data_scadenza TIMESTAMP,
-                stato VARCHAR(20) DEFAULT 'attiva' CHECK (stato IN ('attiva', 'completata', 'scaduta'))
-            )''')
-
-            cursor.execute('''CREATE TABLE IF NOT EXISTS liste_attesa (
-                id SERIAL PRIMARY KEY,
-                utente_id INTEGER REFERENCES utenti(id),
-                libro_id INTEGER REFERENCES libri(id),
-                data_richiesta TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                posizione INTEGER,
-                stato VARCHAR(20) DEFAULT 'attiva' CHECK (stato IN ('attiva', 'notificato', 'completata'))
-            )''')
-
-            cursor.execute('''CREATE TABLE IF NOT EXISTS libri_salvati (
-                id SERIAL PRIMARY KEY,
-                utente_id INTEGER REFERENCES utenti(id),
-                libro_id INTEGER REFERENCES libri(id),
-                data_salvataggio TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE(utente_id, libro_id)
-            )''')
-
-            cursor.execute('''CREATE TABLE IF NOT EXISTS notifiche (
-                id SERIAL PRIMARY KEY,
-                utente_id INTEGER REFERENCES utenti(id),
-                messaggio TEXT NOT NULL,
-                tipo VARCHAR(50) DEFAULT 'generale',
-                letta BOOLEAN DEFAULT FALSE,
-                data_creazione TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )''')
-
-            self.conn.commit()
-            cursor.close()
-
-            # Popola il database con dati di esempio
-            self.populate_sample_data_if_empty()
-
-        except Exception as e:
-            self.conn.rollback()
-            cursor.close()
-            raise e
+            yield conn
+        finally:
+            locale.conn = None
+            self._rilascia(conn)
+            # Dopo il commit: una ricerca che parte da qui vede già le modifiche.
+            # Quelle delle modifiche annullate vengono scartate
+            invalidazioni, locale.confermate = locale.confermate, []
+            locale.invalidazioni = []
+            for voci, struttura in invalidazioni:
+                if voci is None:
+                    self.cache_ricerche.svuota()
+                else:
+                    self.cache_ricerche.invalida(voci, struttura)
+
+    @contextmanager
+    def transazione(self, commit_ogni=None):
+        """Raggruppa più operazioni in un'unica transazione con un solo commit finale.
+
+        I metodi chiamati nel blocco non eseguono commit propri. Se uno di essi
+        fallisce la transazione viene annullata all'uscita (TransazioneAnnullata).
+        Con commit_ogni=N (per i caricamenti massivi) si esegue un commit ogni N
+        operazioni riuscite e quelle fallite vengono scartate singolarmente.
+        """
+        with self.connessione() as conn:
+            locale = self._locale
+            if locale.livello > 0:
+                # Transazione annidata: si unisce a quella esterna
+                yield conn
+                return
 
-    def populate_sample_data_if_empty(self):
-        """Popola il database con dati di esempio solo se è vuoto"""
-        try:
-            cursor = self.conn.cursor()
+            locale.livello = 1
+            locale.commit_ogni = commit_ogni
+            locale.livello_gruppo = 1
+            locale.in_sospeso = 0
+            try:
+                yield conn
+                if locale.solo_rollback:
+                    raise TransazioneAnnullata("Un'operazione della transazione è fallita")
+                self._esegui_commit()
+            except Exception:
+                self._esegui_rollback()
+                raise
+            finally:
+                locale.livello = 0
+                locale.solo_rollback = False
+                locale.commit_ogni = None
+                locale.livello_gruppo = 0
+
+    def _commit(self):
+        """Conferma il lavoro dell'operazione corrente rispettando la transazione esterna"""
+        locale = self._locale
+        if locale.livello <= 1:
+            if locale.solo_rollback:
+                locale.solo_rollback = False
+                raise TransazioneAnnullata("Un'operazione annidata è fallita")
+            self._esegui_commit()
+        elif locale.commit_ogni and locale.livello == locale.livello_gruppo + 1:
+            if locale.solo_rollback:
+                # È fallita un'operazione annidata: si scarta solo questa operazione
+                locale.solo_rollback = False
+                raise TransazioneAnnullata("Un'operazione annidata è fallita")
+            # Commit di gruppo: chiude il savepoint e conferma ogni commit_ogni operazioni
+            self._esegui_savepoint("RELEASE SAVEPOINT operazione")
+            locale.savepoint = False
+            locale.in_sospeso += 1
+            if locale.in_sospeso >= locale.commit_ogni:
+                self._esegui_commit()
+                locale.in_sospeso = 0
+
+    def _rollback(self):
+        """Annulla il lavoro dell'operazione corrente rispettando la transazione esterna"""
+        locale = self._locale
+        if locale.livello <= 1:
+            locale.solo_rollback = False
+            self._esegui_rollback()
+        elif locale.commit_ogni and locale.livello == locale.livello_gruppo + 1:
+            if locale.savepoint:
+                self._esegui_savepoint("ROLLBACK TO SAVEPOINT operazione")
+                # Le invalidazioni dell'operazione annullata non servono più
+                del locale.invalidazioni[locale.invalidazioni_savepoint:]
+                self._esegui_savepoint("RELEASE SAVEPOINT operazione")
+                locale.savepoint = False
+        else:
+            # Non si può annullare solo una parte: la transazione esterna fallirà
+            locale.solo_rollback = True
 
-            # Verifica se ci sono già utenti nel database
-            cursor.execute("SELECT COUNT(*) FROM utenti")
-            user_count = cursor.fetchone()[0]
+    def _esegui_commit(self):
+        """Commit sulla connessione: le invalidazioni in attesa diventano confermate"""
+        locale = self._locale
+        self.conn.commit()
+        locale.confermate.extend(locale.invalidazioni)
+        locale.invalidazioni = []
 
-            if user_count > 0:
-                print("Database già popolato con dati esistenti.")
-                cursor.close()
-                return
+    def _esegui_rollback(self):
+        """Rollback sulla connessione: le invalidazioni in attesa vengono scartate"""
+        self.conn.rollback()
+        self._locale.invalidazioni = []
 
-            # Se il database è vuoto, popola con dati di esempio
-            print("Database vuoto. Popolamento con dati di esempio...")
+    def _esegui_savepoint(self, comando):
+        cursor = self.conn.cursor()
+        cursor.execute(comando)
+        cursor.close()
 
-            # Aggiungi biblioteche di esempio con riferimento alla città
-            biblioteche = [
-                ('Biblioteca Nazionale', 'Via Nazionale 1, Roma', 'Roma'),
-                ('Biblioteca Universitaria', 'Via Università 2, Milano', 'Milano'),
-                ('Biblioteca Civica', 'Piazza Dante 3, Firenze', 'Firenze'),
-                ('Biblioteca Provinciale', 'Via Garibaldi 4, Napoli', 'Napoli')
-            ]
+    def _acquisisci(self):
+        """Prende la connessione condivisa o una connessione libera del pool"""
+        if self._pool is None:
+            self._lock.acquire()
+            return self._conn_condivisa
 
-            for nome, indirizzo, citta_nome in biblioteche:
-                cursor.execute("""
-                    INSERT INTO biblioteche (nome, indirizzo, citta_id)
-                    SELECT %s, %s, c.id FROM citta c WHERE c.nome = %s
-                    ON CONFLICT DO NOTHING
-                """, (nome, indirizzo, citta_nome))
-
-            # Aggiungi librerie di esempio con riferimento alla città
-            librerie = [
-                ('Mondadori', 'Via dei Libri 1, Roma', 'Roma'),
-                ('Feltrinelli', 'Corso Italia 2, Milano', 'Milano'),
-                ('IBS', 'Via Shopping 3, Firenze', 'Firenze'),
-                ('Libreria Universitaria', 'Via Studenti 4, Napoli', 'Napoli'),
-                ('Libreria del Centro', 'Piazza Duomo 5, Bologna', 'Bologna'),
-                ('Libreria Moderna', 'Via Moderna 6, Torino', 'Torino')
-            ]
+        if not self._slot.acquire(timeout=self.timeout):
+            raise PoolEsaurito(f"Nessuna connessione libera entro {self.timeout} secondi")
+        try:
+            conn = self._pool.getconn()
+            if conn.closed:
+                self._pool.putconn(conn, close=True)
+                conn = self._pool.getconn()
+            conn.autocommit = False
+            return conn
+        except Exception:
+            self._slot.release()
+            raise
 
-            for nome, indirizzo, citta_nome in librerie:
-                cursor.execute("""
-                    INSERT INTO librerie (nome, indirizzo, citta_id)
-                    SELECT %s, %s, c.id FROM citta c WHERE c.nome = %s
-                    ON CONFLICT DO NOTHING
-                """, (nome, indirizzo, citta_nome))
-
-            # Aggiungi utenti di esempio
-            utenti = [
-                # Bibliotecari
-                ('mario.rossi@email.com', 'mario_bib', 'Mario', 'Rossi', 'password123', 'bibliotecario', 1, None),
-                ('giulia.verdi@email.com', 'giulia_bib', 'Giulia', 'Verdi', 'password123', 'bibliotecario', 2, None),
-                ('luca.bianchi@email.com', 'luca_bib', 'Luca', 'Bianchi', 'password123', 'bibliotecario', 3, None),
-
-                # Librai
-                ('anna.neri@email.com', 'anna_lib', 'Anna', 'Neri', 'password123', 'libraio', None, 1),
-                ('franco.gallo@email.com', 'franco_lib', 'Franco', 'Gallo', 'password123', 'libraio', None, 2),
-                ('sara.moro@email.com', 'sara_lib', 'Sara', 'Moro', 'password123', 'libraio', None, 3),
-
-                # Utenti normali (studenti)
-                ('piero.amendola@email.com', 'piero_user', 'Piero', 'Amendola', 'password123', 'utente', None, None),
-                ('marco.tosi@email.com', 'marco_user', 'Marco', 'Tosi', 'password123', 'utente', None, None),
-                ('elena.fini@email.com', 'elena_user', 'Elena', 'Fini', 'password123', 'utente', None, None),
-                ('giovanni.roma@email.com', 'giovanni_user', 'Giovanni', 'Roma', 'password123', 'utente', None, None),
-                ('sofia.luna@email.com', 'sofia_user', 'Sofia', 'Luna', 'password123', 'utente', None, None)
-            ]
+    def _rilascia(self, conn):
+        """Restituisce la connessione annullando le transazioni lasciate aperte"""
+        try:
+            stato = conn.get_transaction_status() if not conn.closed else None
+            # Con il pool la connessione deve tornare pulita; con la connessione
+            # condivisa si annulla solo una transazione fallita, per non bloccare
+            # le operazioni successive
+            if stato == psycopg2.extensions.TRANSACTION_STATUS_INERROR or \
+                    (self._pool is not None and stato != psycopg2.extensions.TRANSACTION_STATUS_IDLE):
+                conn.rollback()
+        except psycopg2.Error:
+            pass
+        finally:
+            if self._pool is None:
+                self._lock.release()
+            else:
+                self._pool.putconn(conn, close=bool(conn.closed))
+                self._slot.release()
 
-            for email, username, nome, cognome, password, ruolo, bib_id, lib_id in utenti:
-                password_hash = self.hash_password(password)
-                cursor.execute("""
-                    INSERT INTO utenti (email, nome_utente, nome, cognome, password_hash, ruolo_id, biblioteca_id, libreria_id)
-                    SELECT %s, %s, %s, %s, %s, r.id, %s, %s
-                    FROM ruoli r WHERE r.nome = %s
-                    ON CONFLICT (email) DO NOTHING
-                """, (email, username, nome, cognome, password_hash, bib_id, lib_id, ruolo))
+    @_operazione
+    def create_tables(self):
+        """Porta lo schema del database all'ultima versione applicando le migrazioni mancanti"""
+        applica_migrazioni(self.conn)
 
-            self.conn.commit()
+    @_operazione
+    def populate_sample_data_if_empty(self):
+        """Popola il database con dati di esempio solo se è vuoto"""
+        try:
+            cursor = self.conn.cursor()
+            popola_dati_esempio(cursor)
+            self._commit()
             cursor.close()
-            print("Database popolato con dati di esempio per i test.")
 
         except Exception as e:
             print(f"Errore durante la popolazione del database: {str(e)}")
-            self.conn.rollback()
+            self._rollback()
             cursor.close()
 
     def hash_password(self, password):
         """Hash della password usando SHA-256"""
         return hashlib.sha256(password.encode()).hexdigest()
 
-    # Metodi per la gestione delle città
+    # Metodi per città, strutture e ruoli, serviti dalla memoria
+    @_operazione
+    def ricarica_riferimento(self):
+        """Rilegge con una sola query città, biblioteche, librerie e ruoli"""
+        cursor = self.conn.cursor()
+        cursor.execute('''SELECT 'citta', id, nome, regione, NULL::INTEGER FROM citta
+                          UNION ALL
+                          SELECT 'biblioteca', id, nome, NULL, citta_id FROM biblioteche
+                          UNION ALL
+                          SELECT 'libreria', id, nome, NULL, citta_id FROM librerie
+                          UNION ALL
+                          SELECT 'ruolo', id, nome, NULL, NULL FROM ruoli
+                          ORDER BY 1, 3, 2''')
+        self._riferimento = DatiRiferimento(cursor.fetchall(), time.monotonic())
+        cursor.close()
+        return self._riferimento
+
+    def invalida_riferimento(self):
+        """Forza la rilettura dei dati di riferimento al prossimo accesso (es. dopo una NOTIFY)"""
+        self._riferimento.caricati_il = None
+
+    def riferimento_in_memoria(self):
+        """Indica se città, strutture e ruoli si possono leggere senza query"""
+        caricati_il = self._riferimento.caricati_il
+        return caricati_il is not None and time.monotonic() - caricati_il < TTL_RIFERIMENTO
+
+    def _dati_riferimento(self):
+        """Dati di riferimento aggiornati; se la rilettura fallisce restano quelli precedenti"""
+        if self.riferimento_in_memoria():
+            return self._riferimento
+        with self._lock_riferimento:
+            # Un altro thread potrebbe averli appena riletti
+            if not self.riferimento_in_memoria():
+                try:
+                    self.ricarica_riferimento()
+                except Exception as e:
+                    print(f"Errore nella lettura di città e strutture: {e}")
+        return self._riferimento
+
     def get_citta(self):
         """Restituisce la lista delle città"""
-        try:
-            cursor = self.conn.cursor()
-            cursor.execute("SELECT id, nome, regione FROM citta ORDER BY nome")
-            citta = cursor.fetchall()
-            cursor.close()
-            return citta
-        except Exception as e:
-            cursor.close()
-            return []
+        return list(self._dati_riferimento().citta)
 
     def get_biblioteche_by_citta(self, citta_id):
         """Restituisce la lista delle biblioteche per una città specifica"""
-        try:
-            cursor = self.conn.cursor()
-            cursor.execute("SELECT id, nome FROM biblioteche WHERE citta_id = %s ORDER BY nome", (citta_id,))
-            biblioteche = cursor.fetchall()
-            cursor.close()
-            return biblioteche
-        except Exception as e:
-            cursor.close()
-            return []
+        return list(self._dati_riferimento().biblioteche_per_citta.get(citta_id, ()))
 
     def get_librerie_by_citta(self, citta_id):
         """Restituisce la lista delle librerie per una città specifica"""
-        try:
-            cursor = self.conn.cursor()
-            cursor.execute("SELECT id, nome FROM librerie WHERE citta_id = %s ORDER BY nome", (citta_id,))
-            librerie = cursor.fetchall()
-            cursor.close()
-            return librerie
-        except Exception as e:
-            cursor.close()
-            return []
+        return list(self._dati_riferimento().librerie_per_citta.get(citta_id, ()))
 
-    # Metodi per la gestione delle strutture
     def get_biblioteche(self):
         """Restituisce la lista delle biblioteche"""
-        try:
-            cursor = self.conn.cursor()
-            cursor.execute("SELECT id, nome FROM biblioteche ORDER BY nome")
-            biblioteche = cursor.fetchall()
-            cursor.close()
-            return biblioteche
-        except Exception as e:
-            cursor.close()
-            return []
+        return list(self._dati_riferimento().biblioteche)
 
     def get_librerie(self):
         """Restituisce la lista delle librerie"""
-        try:
-            cursor = self.conn.cursor()
-            cursor.execute("SELECT id, nome FROM librerie ORDER BY nome")
-            librerie = cursor.fetchall()
-            cursor.close()
-            return librerie
-        except Exception as e:
-            cursor.close()
-            return []
+        return list(self._dati_riferimento().librerie)
 
     # Metodi per la gestione degli utenti
+    @_operazione
     def registra_utente(self, email, nome_utente, nome, cognome, password, ruolo, struttura_id=None):
         """Registra un nuovo utente nel database"""
         try:
             cursor = self.conn.cursor()
             password_hash = self.hash_password(password)
 
-            # Ottieni l'ID del ruolo
-            cursor.execute("SELECT id FROM ruoli WHERE nome = %s", (ruolo,))
-            ruolo_id = cursor.fetchone()
-            if not ruolo_id:
+            # Ottieni l'ID del ruolo; un ruolo sconosciuto potrebbe essere appena stato aggiunto
+            ruolo_id = self._dati_riferimento().ruoli.get(ruolo)
+            if ruolo_id is None:
+                ruolo_id = self.ricarica_riferimento().ruoli.get(ruolo)
+            if ruolo_id is None:
+                cursor.close()
                 return False, "Ruolo non valido"
 
-            ruolo_id = ruolo_id[0]
-
             # Prepara i dati per l'inserimento
             if ruolo == 'bibliotecario':
                 query = """INSERT INTO utenti (email, nome_utente, nome, cognome, password_hash, ruolo_id, biblioteca_id)
@@ -493,11 +572,11 @@ class DatabaseManager:
                 params = (email, nome_utente, nome, cognome, password_hash, ruolo_id)
 
             cursor.execute(query, params)
-            self.conn.commit()
+            self._commit()
             cursor.close()
             return True, "Registrazione completata con successo"
         except psycopg2.IntegrityError as e:
-            self.conn.rollback()
+            self._rollback()
             cursor.close()
             if 'email' in str(e):
                 return False, "Email già registrata"
@@ -506,10 +585,11 @@ class DatabaseManager:
             else:
                 return False, "Errore di integrità dei dati"
         except Exception as e:
-            self.conn.rollback()
+            self._rollback()
             cursor.close()
             return False, f"Errore durante la registrazione: {str(e)}"
 
+    @_operazione
     def login(self, email_utente, password):
         """Effettua il login dell'utente"""
         try:
@@ -550,21 +630,7 @@ class DatabaseManager:
     # Metodi per la gestione dei libri
     def load_libri(self):
         """Carica tutti i libri dal database"""
-        cursor = self.conn.cursor()
-        cursor.execute('''SELECT l.titolo, a.nome, g.nome, l.anno_pubblicazione, l.numero_pagine, l.prezzo,
-                                 l.prezzo_nuovo, l.prezzo_usato, l.descrizione, l.isbn,
-                                 CASE WHEN ld.libro_id IS NOT NULL THEN TRUE ELSE FALSE END as disponibile
-                          FROM libri l
-                          JOIN autori a ON l.autore_id = a.id
-                          JOIN generi g ON l.genere_id = g.id
-                          LEFT JOIN libri_disponibili ld ON l.id = ld.libro_id''')
-        rows = cursor.fetchall()
-        libri = []
-        for row in rows:
-            libro = Libro(row[0], row[1], row[2], row[3], row[4], row[5], row[6], row[7], row[8], row[9])
-            libro.disponibile = bool(row[10])
-            libri.append(libro)
-        cursor.close()
+        libri = list(self.itera_libri())
         print(f"Caricati {len(libri)} libri dal database PostgreSQL.")
         # Se il DB è vuoto, aggiungi libri di default
         if not libri:
@@ -578,8 +644,75 @@ class DatabaseManager:
             libri = default_libri
         return libri
 
-    def save_libro(self, libro):
-        """Salva un libro nel database"""
+    def itera_libri(self, itersize=ITERSIZE_LIBRI):
+        """Restituisce i libri uno alla volta, in ordine di id, senza caricarli tutti.
+
+        Le righe arrivano dal server a blocchi di itersize tramite un cursore con
+        nome, in una transazione di sola lettura su una connessione presa alla
+        prima lettura (vedi _connessione_lettura) e lasciata quando il ciclo
+        finisce. Interrompere il ciclo (break, itertools.islice) o chiamare
+        close() sul generatore chiude subito il cursore, senza leggere il resto
+        del catalogo. Essendo un'altra connessione, non vede le modifiche non
+        confermate della transazione in corso nel thread.
+        """
+        for row in self._righe_libri(itersize=itersize):
+            yield self._libro_da_riga(row)
+
+    def _righe_libri(self, condizione='TRUE', params=(), itersize=ITERSIZE_LIBRI):
+        """Righe di _seleziona_libri lette in streaming (vedi itera_libri)"""
+        with self._connessione_lettura() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SET TRANSACTION READ ONLY")
+            cursor.close()
+            cursor = conn.cursor(name='libri')
+            cursor.itersize = itersize
+            try:
+                self._seleziona_libri(cursor, condizione, params)
+                yield from cursor
+            finally:
+                # Termina la transazione: chiude il cursore sul server
+                if not conn.closed:
+                    conn.rollback()
+
+    @contextmanager
+    def _connessione_lettura(self):
+        """Connessione per le letture in streaming, separata da quella del thread.
+
+        Con il pool se ne prende in prestito una, che torna al pool alla fine.
+        Senza pool si usa una connessione di lettura aperta una volta dal
+        manager; se è già occupata da un'altra lettura se ne apre una temporanea.
+        """
+        if self._pool is not None:
+            conn = self._acquisisci()
+            try:
+                yield conn
+            finally:
+                self._rilascia(conn)
+            return
+
+        if not self._lock_lettura.acquire(blocking=False):
+            conn = psycopg2.connect(self.dsn, connection_factory=ConnessioneStrumentata)
+            try:
+                yield conn
+            finally:
+                conn.close()
+            return
+        try:
+            if self._conn_lettura is None or self._conn_lettura.closed:
+                self._conn_lettura = psycopg2.connect(self.dsn, connection_factory=ConnessioneStrumentata)
+            yield self._conn_lettura
+        finally:
+            self._lock_lettura.release()
+
+    def apri_catalogo(self, ordina='titolo', discendente=False, filtro=None):
+        """Apre un CursoreCatalogo sul catalogo, ordinato per la colonna indicata
+        e filtrato per titolo, autore o genere; va chiuso con chiudi()"""
+        return CursoreCatalogo(self, ordina, discendente, filtro)
+
+    @_operazione
+    def save_libro(self, libro, biblioteca_id=None):
+        """Salva un libro nel database con una copia nella biblioteca indicata
+        (in tutte le biblioteche se biblioteca_id è None) e ne restituisce l'id"""
         cursor = self.conn.cursor()
         # Inserisci autore se non esiste
         cursor.execute('INSERT INTO autori (nome) VALUES (%s) ON CONFLICT (nome) DO NOTHING', (libro.autore,))
@@ -599,86 +732,149 @@ class DatabaseManager:
             cursor.execute('INSERT INTO libri_disponibili (libro_id) VALUES (%s)', (libro_id,))
         else:
             cursor.execute('INSERT INTO libri_prestati (libro_id) VALUES (%s)', (libro_id,))
-        self.conn.commit()
+        cursor.execute('''INSERT INTO inventario_biblioteche (biblioteca_id, libro_id, copie_totali, copie_disponibili)
+                          SELECT b.id, %s, 1, %s FROM biblioteche b
+                          WHERE %s IS NULL OR b.id = %s
+                          ON CONFLICT (biblioteca_id, libro_id) DO NOTHING''',
+                       (libro_id, 1 if libro.disponibile else 0, biblioteca_id, biblioteca_id))
+        # Il libro compare nelle ricerche globali e in quelle delle biblioteche
+        self._invalida_ricerche([(libro_id, testo_libro(libro))])
+        self._commit()
         cursor.close()
+        return libro_id
 
+    @_operazione
     def update_disponibile(self, libro):
         """Aggiorna la disponibilità di un libro"""
         cursor = self.conn.cursor()
-        cursor.execute('SELECT id FROM libri WHERE titolo = %s', (libro.titolo,))
-        libro_id = cursor.fetchone()[0]
+        libro_id = getattr(libro, 'id', None)
+        if libro_id is None:
+            cursor.execute('SELECT id FROM libri WHERE titolo = %s', (libro.titolo,))
+            libro_id = cursor.fetchone()[0]
         if libro.disponibile:
             cursor.execute('DELETE FROM libri_prestati WHERE libro_id = %s', (libro_id,))
             cursor.execute('INSERT INTO libri_disponibili (libro_id) VALUES (%s) ON CONFLICT DO NOTHING', (libro_id,))
         else:
             cursor.execute('DELETE FROM libri_disponibili WHERE libro_id = %s', (libro_id,))
             cursor.execute('INSERT INTO libri_prestati (libro_id) VALUES (%s)', (libro_id,))
-        self.conn.commit()
+        self._invalida_ricerche([(libro_id, testo_libro(libro))])
+        self._commit()
         cursor.close()
 
+    @_operazione
     def rimuovi_libro(self, titolo):
         """Rimuove un libro dal database"""
         libro = self.cerca_titolo(titolo)
         if libro:
             cursor = self.conn.cursor()
-            cursor.execute('SELECT id FROM libri WHERE titolo = %s', (titolo,))
-            libro_id = cursor.fetchone()[0]
+            libro_id = libro.id
+            cursor.execute('DELETE FROM inventario_biblioteche WHERE libro_id = %s', (libro_id,))
             cursor.execute('DELETE FROM libri_disponibili WHERE libro_id = %s', (libro_id,))
             cursor.execute('DELETE FROM libri_prestati WHERE libro_id = %s', (libro_id,))
             cursor.execute('DELETE FROM libri WHERE id = %s', (libro_id,))
-            self.conn.commit()
+            self._invalida_ricerche([(libro_id, testo_libro(libro))])
+            self._commit()
             cursor.close()
             return True
         return False
 
+    @_operazione
+    def _cerca_libri_esatti(self, condizione, params, limite=None):
+        """Restituisce i libri che soddisfano una condizione su colonne indicizzate"""
+        cursor = self.conn.cursor()
+        self._seleziona_libri(cursor, condizione, params, limite)
+        libri = [self._libro_da_riga(row) for row in cursor.fetchall()]
+        cursor.close()
+        return libri
+
+    def _seleziona_libri(self, cursor, condizione, params, limite=None):
+        """Esegue sul cursore la lettura dei libri nel formato di _libro_da_riga, in ordine di id"""
+        cursor.execute(f'''SELECT l.id, l.titolo, a.nome, g.nome, l.anno_pubblicazione, l.numero_pagine, l.prezzo,
+                                  l.prezzo_nuovo, l.prezzo_usato, l.descrizione, l.isbn,
+                                  ld.libro_id IS NOT NULL as disponibile
+                           FROM libri l
+                           JOIN autori a ON l.autore_id = a.id
+                           JOIN generi g ON l.genere_id = g.id
+                           LEFT JOIN libri_disponibili ld ON l.id = ld.libro_id
+                           WHERE {condizione}
+                           ORDER BY l.id
+                           LIMIT %s''', tuple(params) + (limite,))
+
+    @_operazione
     def cerca_titolo(self, titolo):
         """Cerca un libro per titolo"""
-        for libro in self.load_libri():
-            if libro.titolo == titolo:
-                return libro
-        return None
+        libri = self._cerca_libri_esatti('l.titolo = %s', (titolo,), 1)
+        return libri[0] if libri else None
 
+    @_operazione
     def cerca_autore(self, autore):
         """Cerca un libro per autore"""
-        for libro in self.load_libri():
-            if libro.autore == autore:
-                return libro
-        return None
+        libri = self._cerca_libri_esatti('a.nome = %s', (autore,), 1)
+        return libri[0] if libri else None
 
+    @_operazione
+    def cerca_libri_autore(self, autore):
+        """Restituisce tutti i libri di un autore"""
+        return self._cerca_libri_esatti('a.nome = %s', (autore,))
+
+    @_operazione
+    def cerca_isbn(self, isbn):
+        """Cerca un libro per codice ISBN"""
+        libri = self._cerca_libri_esatti('l.isbn = %s', (isbn,), 1)
+        return libri[0] if libri else None
+
+    @_operazione
     def presta_libro(self, titolo):
         """Presta un libro"""
         libro = self.cerca_titolo(titolo)
         if libro and libro.disponibile:
             libro.disponibile = False
             self.update_disponibile(libro)
+            self._commit()
             return libro
         return None
 
+    @_operazione
     def riprendi_libro(self, titolo):
         """Restituisce un libro prestato"""
         libro = self.cerca_titolo(titolo)
         if libro and not libro.disponibile:
             libro.disponibile = True
             self.update_disponibile(libro)
+            self._commit()
             return libro
         return None
 
+    @_operazione
     def modifica_libro(self, titolo_vecchio, nuovo_libro):
         """Modifica un libro esistente"""
         libro = self.cerca_titolo(titolo_vecchio)
         if libro:
             cursor = self.conn.cursor()
-            cursor.execute('SELECT id FROM libri WHERE titolo = %s', (titolo_vecchio,))
-            libro_id = cursor.fetchone()[0]
+            libro_id = libro.id
+            # Le copie delle biblioteche passano al libro modificato
+            cursor.execute('SELECT biblioteca_id, copie_totali, copie_disponibili FROM inventario_biblioteche WHERE libro_id = %s',
+                           (libro_id,))
+            copie = cursor.fetchall()
+            cursor.execute('DELETE FROM inventario_biblioteche WHERE libro_id = %s', (libro_id,))
             cursor.execute('DELETE FROM libri_disponibili WHERE libro_id = %s', (libro_id,))
             cursor.execute('DELETE FROM libri_prestati WHERE libro_id = %s', (libro_id,))
             cursor.execute('DELETE FROM libri WHERE id = %s', (libro_id,))
-            self.conn.commit()
+            self._invalida_ricerche([(libro_id, testo_libro(libro))])
+            # Cancellazione e nuovo inserimento vengono confermati insieme
+            nuovo_id = self.save_libro(nuovo_libro)
+            if copie:
+                cursor.execute('DELETE FROM inventario_biblioteche WHERE libro_id = %s', (nuovo_id,))
+                cursor.executemany('''INSERT INTO inventario_biblioteche (biblioteca_id, libro_id, copie_totali, copie_disponibili)
+                                      VALUES (%s, %s, %s, %s)''',
+                                   [(biblioteca_id, nuovo_id, totali, disponibili)
+                                    for biblioteca_id, totali, disponibili in copie])
+            self._commit()
             cursor.close()
-            self.save_libro(nuovo_libro)
             return True
         return False
 
+    @_operazione
     def mostra_autori(self):
         """Restituisce la lista degli autori"""
         cursor = self.conn.cursor()
@@ -688,6 +884,7 @@ class DatabaseManager:
         cursor.close()
         return autori
 
+    @_operazione
     def mostra_generi(self):
         """Restituisce la lista dei generi"""
         cursor = self.conn.cursor()
@@ -697,15 +894,538 @@ class DatabaseManager:
         cursor.close()
         return generi
 
+    @_operazione
     def get_libro_id_by_titolo(self, titolo):
         """Restituisce l'ID del libro dato il titolo"""
         cursor = self.conn.cursor()
-        cursor.execute('SELECT id FROM libri WHERE titolo = %s', (titolo,))
+        cursor.execute('SELECT id FROM libri WHERE titolo = %s ORDER BY id LIMIT 1', (titolo,))
         result = cursor.fetchone()
         cursor.close()
         return result[0] if result else None
 
+    # Metodi per la ricerca nel catalogo
+    def _invalida_ricerche(self, voci, struttura=OGNI_STRUTTURA):
+        """Prenota l'invalidazione della cache delle ricerche per i libri modificati.
+
+        voci sono coppie (id, testo), None per svuotare la cache; struttura è
+        quella dove i libri possono essere comparsi o spariti dai risultati.
+        Viene eseguita alla fine dell'operazione più esterna, solo se il commit
+        è avvenuto; con un rollback viene scartata.
+        """
+        if self.cache_ricerche is not None:
+            self._locale.invalidazioni.append((voci, struttura))
+
+    def _testi_libri(self, ids):
+        """Coppie (id, testo) dei libri per _invalida_ricerche (va chiamata in un'operazione)"""
+        if self.cache_ricerche is None or not ids:
+            return []
+        cursor = self.conn.cursor()
+        cursor.execute('''SELECT l.id, concat_ws(' ', l.titolo, a.nome, g.nome, l.descrizione)
+                          FROM libri l
+                          JOIN autori a ON l.autore_id = a.id
+                          JOIN generi g ON l.genere_id = g.id
+                          WHERE l.id = ANY(%s)''', (list(ids),))
+        voci = cursor.fetchall()
+        cursor.close()
+        return voci
+
+    def _libro_da_riga(self, row):
+        """Crea un Libro da una riga (id, titolo, autore, genere, anno, pagine, prezzo,
+        prezzo_nuovo, prezzo_usato, descrizione, isbn, disponibile)"""
+        libro = Libro(row[1], row[2], row[3], row[4], row[5], row[6], row[7], row[8], row[9], row[10])
+        libro.id = row[0]
+        libro.disponibile = bool(row[11])
+        return libro
+
+    def _escape_like(self, testo):
+        """Protegge i caratteri speciali di LIKE/ILIKE presenti nel testo cercato"""
+        return testo.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+    def _componi_ricerca(self, query, modalita, tipo_struttura, struttura_id):
+        """Prepara i frammenti SQL (con i relativi parametri) di una ricerca nel catalogo.
+
+        Restituisce un dizionario con sorgente, inventario, filtro e ordine; i
+        parametri di ciascun frammento sono nelle chiavi params_<frammento>.
+        Una query vuota (o di soli spazi) restituisce tutto il catalogo in ogni modalità.
+        """
+        query = query.strip()
+        parti = {
+            'sorgente': "libri l", 'params_sorgente': [],
+            'filtro': "TRUE", 'params_filtro': [],
+            'params_ordine': [],
+        }
+        if not query:
+            # Nessun testo da confrontare: come in modalità 'testo', che con il
+            # pattern '%%' trova ogni libro, l'intero catalogo ordinato per titolo
+            parti['ordine'] = "l.titolo, l.id"
+        elif modalita == 'prefisso':
+            # Testo ancora in digitazione: le parole complete devono esserci tutte,
+            # l'ultima può essere l'inizio di una parola (sempre tramite l'indice GIN)
+            parole = re.findall(r"\w+", query)
+            if parole:
+                parti['filtro'] = "l.ricerca_tsv @@ to_tsquery('italiano_unaccent', %s)"
+                parti['params_filtro'] = [' & '.join(parole) + ':*']
+            else:
+                parti['filtro'] = "FALSE"
+            parti['ordine'] = "l.titolo, l.id"
+        elif modalita == 'fulltext':
+            parti['filtro'] = "l.ricerca_tsv @@ websearch_to_tsquery('italiano_unaccent', %s)"
+            parti['params_filtro'] = [query]
+            parti['ordine'] = "ts_rank(l.ricerca_tsv, websearch_to_tsquery('italiano_unaccent', %s)) DESC, l.titolo, l.id"
+            parti['params_ordine'] = [query]
+        elif modalita == 'fuzzy':
+            # I candidati sono cercati separatamente su titoli e autori, così che
+            # ciascun ramo usi il proprio indice a trigrammi
+            parti['sorgente'] = """(SELECT id, MAX(punteggio) AS punteggio FROM (
+                                       SELECT l.id, word_similarity(f_unaccent(%s), f_unaccent(l.titolo)) AS punteggio
+                                       FROM libri l
+                                       WHERE f_unaccent(%s) <%% f_unaccent(l.titolo)
+                                       UNION ALL
+                                       SELECT l.id, word_similarity(f_unaccent(%s), f_unaccent(a.nome))
+                                       FROM autori a
+                                       JOIN libri l ON l.autore_id = a.id
+                                       WHERE f_unaccent(%s) <%% f_unaccent(a.nome)
+                                   ) candidati GROUP BY id) m
+                                   JOIN libri l ON l.id = m.id"""
+            parti['params_sorgente'] = [query, query, query, query]
+            parti['ordine'] = "m.punteggio DESC, l.titolo, l.id"
+        else:
+            pattern = f"%{self._escape_like(query)}%"
+            parti['filtro'] = "(l.titolo ILIKE %s OR a.nome ILIKE %s OR g.nome ILIKE %s)"
+            parti['params_filtro'] = [pattern, pattern, pattern]
+            parti['ordine'] = "l.titolo, l.id"
+
+        if tipo_struttura == 'libreria' and struttura_id is not None:
+            parti['inventario'] = """JOIN inventario_librerie inv ON inv.libro_id = l.id AND inv.libreria_id = %s
+                                     AND (inv.copie_nuove > 0 OR inv.copie_usate > 0)"""
+            parti['colonne_giacenza'] = "inv.copie_nuove, inv.copie_usate"
+            parti['chiavi_giacenza'] = ('copie_nuove', 'copie_usate')
+            parti['params_inventario'] = [struttura_id]
+        elif tipo_struttura == 'biblioteca' and struttura_id is not None:
+            parti['inventario'] = """JOIN inventario_biblioteche inv ON inv.libro_id = l.id AND inv.biblioteca_id = %s
+                                     AND inv.copie_totali > 0"""
+            parti['colonne_giacenza'] = "inv.copie_totali, inv.copie_disponibili"
+            parti['chiavi_giacenza'] = ('copie_totali', 'copie_disponibili')
+            parti['params_inventario'] = [struttura_id]
+        else:
+            parti['inventario'] = ""
+            parti['colonne_giacenza'] = "NULL, NULL"
+            parti['chiavi_giacenza'] = None
+            parti['params_inventario'] = []
+        return parti
+
+    def cerca_libri(self, query, limit=20, offset=0, modalita='testo', soglia=None,
+                    tipo_struttura=None, struttura_id=None, annullamento=None):
+        """Cerca libri per titolo, autore o genere.
+
+        Filtro, ordinamento e paginazione sono eseguiti da PostgreSQL: viene
+        trasferita solo la pagina richiesta (limit/offset).
+        Modalità disponibili:
+        - 'testo': il testo compare in titolo, autore o genere
+        - 'fulltext': ricerca per parole su titolo, autore, genere e descrizione, con
+          stemming italiano, senza distinzione di accenti e ordinata per rilevanza
+        - 'fuzzy': titoli e autori simili al testo anche con errori di battitura,
+          ordinati per similarità; soglia (0-1) è la similarità minima richiesta
+        - 'prefisso': come 'fulltext' ma l'ultima parola può essere incompleta,
+          per la ricerca mentre si digita; ordinata per titolo
+
+        Con una query vuota (o di soli spazi) ogni modalità restituisce l'intero
+        catalogo ordinato per titolo.
+        Se sono indicati tipo_struttura ('biblioteca' o 'libreria') e struttura_id,
+        vengono restituiti solo i titoli presenti nella struttura e ogni libro ha
+        l'attributo giacenza con le copie possedute (None per la ricerca globale).
+        Con un Annullamento la query può essere interrotta da un altro thread
+        (QueryAnnullata), ad esempio quando l'utente ha già digitato altro.
+        Le pagine già lette vengono servite da cache_ricerche finché sono valide.
+        """
+        cache = self.cache_ricerche
+        if cache is None:
+            return self._cerca_libri(query, limit, offset, modalita, soglia, tipo_struttura, struttura_id, annullamento)
+        struttura = (tipo_struttura, struttura_id) if struttura_id is not None else (None, None)
+        chiave = chiave_ricerca('cerca_libri', modalita, soglia, struttura, limit, offset, query=query)
+        libri = cache.leggi(chiave)
+        if libri is None:
+            epoca = cache.epoca
+            libri = tuple(self._cerca_libri(query, limit, offset, modalita, soglia, tipo_struttura, struttura_id,
+                                            annullamento))
+            cache.salva(chiave, libri, libri, modalita, query, struttura, epoca)
+        return list(libri)
+
+    @_operazione
+    def _cerca_libri(self, query, limit, offset, modalita, soglia, tipo_struttura, struttura_id, annullamento):
+        """Esegue la query di cerca_libri"""
+        parti = self._componi_ricerca(query, modalita, tipo_struttura, struttura_id)
+
+        cursor = self.conn.cursor()
+        with annullamento.esecuzione(self.conn) if annullamento else nullcontext():
+            if modalita == 'fuzzy':
+                # Vale solo per la transazione corrente
+                cursor.execute("SELECT set_config('pg_trgm.word_similarity_threshold', %s, true)",
+                               (str(soglia if soglia is not None else SOGLIA_SIMILARITA),))
+            cursor.execute(f'''SELECT l.id, l.titolo, a.nome, g.nome, l.anno_pubblicazione, l.numero_pagine, l.prezzo,
+                                      l.prezzo_nuovo, l.prezzo_usato, l.descrizione, l.isbn,
+                                      ld.libro_id IS NOT NULL as disponibile, {parti['colonne_giacenza']}
+                               FROM {parti['sorgente']}
+                               {parti['inventario']}
+                               JOIN autori a ON l.autore_id = a.id
+                               JOIN generi g ON l.genere_id = g.id
+                               LEFT JOIN libri_disponibili ld ON l.id = ld.libro_id
+                               WHERE {parti['filtro']}
+                               ORDER BY {parti['ordine']}
+                               LIMIT %s OFFSET %s''',
+                           parti['params_sorgente'] + parti['params_inventario'] + parti['params_filtro'] +
+                           parti['params_ordine'] + [limit, offset])
+        libri = []
+        chiavi_giacenza = parti['chiavi_giacenza']
+        for row in cursor.fetchall():
+            libro = self._libro_da_riga(row)
+            libro.giacenza = dict(zip(chiavi_giacenza, (row[12] or 0, row[13] or 0))) if chiavi_giacenza else None
+            libri.append(libro)
+        cursor.close()
+        return libri
+
+    def _condizioni_faccette(self, filtri):
+        """Condizioni SQL (con parametri) dei filtri per faccetta; TRUE se il filtro non è impostato"""
+        filtri = filtri or {}
+        condizioni = {}
+        if filtri.get('generi'):
+            condizioni['genere'] = ("g.nome = ANY(%s)", [list(filtri['generi'])])
+        else:
+            condizioni['genere'] = ("TRUE", [])
+
+        anno, params_anno = [], []
+        if filtri.get('anno_da') is not None:
+            anno.append("l.anno_pubblicazione >= %s")
+            params_anno.append(filtri['anno_da'])
+        if filtri.get('anno_a') is not None:
+            anno.append("l.anno_pubblicazione <= %s")
+            params_anno.append(filtri['anno_a'])
+        condizioni['anno'] = (" AND ".join(anno) or "TRUE", params_anno)
+
+        if filtri.get('fasce_prezzo'):
+            condizioni['prezzo'] = (f"width_bucket({PREZZO_FACCETTA}, %s::numeric[]) = ANY(%s)",
+                                    [LIMITI_FASCE_PREZZO, list(filtri['fasce_prezzo'])])
+        else:
+            condizioni['prezzo'] = ("TRUE", [])
+
+        condizioni['disponibile'] = ("ld.libro_id IS NOT NULL" if filtri.get('solo_disponibili') else "TRUE", [])
+        return condizioni
+
+    def cerca_libri_faccette(self, query, filtri=None, limit=20, offset=0, modalita='testo', soglia=None,
+                             tipo_struttura=None, struttura_id=None, conteggi=True, annullamento=None):
+        """Ricerca come cerca_libri, ristretta dai filtri per faccetta e con i conteggi di ogni faccetta.
+
+        filtri è un dizionario con le chiavi opzionali generi (lista di nomi),
+        anno_da, anno_a, fasce_prezzo (indici di FASCE_PREZZO) e solo_disponibili.
+        Restituisce (libri, faccette); faccette è None se conteggi è False
+        (pagine successive alla prima), altrimenti un dizionario con:
+        - 'totale': libri che soddisfano ricerca e filtri
+        - 'generi', 'decenni', 'fasce_prezzo': liste di (valore, conteggio)
+        - 'disponibili': libri disponibili ora
+
+        Pagina e conteggi arrivano con un'unica query: le corrispondenze della
+        ricerca vengono lette una volta e contate con GROUPING SETS. Il conteggio
+        di ogni faccetta applica i filtri delle altre ma non il proprio, così
+        mostra quanti libri si otterrebbero cambiando quella scelta.
+        Come cerca_libri, passa dalla cache delle ricerche.
+        """
+        cache = self.cache_ricerche
+        if cache is None:
+            return self._cerca_libri_faccette(query, filtri, limit, offset, modalita, soglia, tipo_struttura,
+                                              struttura_id, conteggi, annullamento)
+        struttura = (tipo_struttura, struttura_id) if struttura_id is not None else (None, None)
+        chiave = chiave_ricerca('cerca_libri_faccette', modalita, soglia, struttura, limit, offset, conteggi,
+                                query=query, filtri=filtri)
+        risultato = cache.leggi(chiave)
+        if risultato is None:
+            epoca = cache.epoca
+            libri, faccette = self._cerca_libri_faccette(query, filtri, limit, offset, modalita, soglia,
+                                                         tipo_struttura, struttura_id, conteggi, annullamento)
+            risultato = (tuple(libri), faccette)
+            cache.salva(chiave, risultato, risultato[0], modalita, query, struttura, epoca, faccette)
+        return list(risultato[0]), risultato[1]
+
+    @_operazione
+    def _cerca_libri_faccette(self, query, filtri, limit, offset, modalita, soglia, tipo_struttura, struttura_id,
+                              conteggi, annullamento):
+        """Esegue la query di cerca_libri_faccette"""
+        parti = self._componi_ricerca(query, modalita, tipo_struttura, struttura_id)
+        condizioni = self._condizioni_faccette(filtri)
+        colonne_giacenza = ', '.join(f"{colonna} AS giacenza_{i}"
+                                     for i, colonna in enumerate(parti['colonne_giacenza'].split(', '), 1))
+        sorgente = f'''FROM {parti['sorgente']}
+                       {parti['inventario']}
+                       JOIN autori a ON l.autore_id = a.id
+                       JOIN generi g ON l.genere_id = g.id
+                       LEFT JOIN libri_disponibili ld ON l.id = ld.libro_id
+                       WHERE {parti['filtro']}'''
+        params_sorgente = parti['params_sorgente'] + parti['params_inventario'] + parti['params_filtro']
+
+        if conteggi:
+            # Un flag per filtro: i conteggi di ogni faccetta ignorano il filtro di quella faccetta
+            flag = ', '.join(f"{condizione} AS ok_{nome}" for nome, (condizione, _) in condizioni.items())
+            params_flag = [p for _, params in condizioni.values() for p in params]
+            sql = f'''WITH risultati AS MATERIALIZED (
+                          SELECT l.id, g.nome AS genere, ld.libro_id IS NOT NULL AS disponibile,
+                                 (l.anno_pubblicazione / 10) * 10 AS decennio,
+                                 width_bucket({PREZZO_FACCETTA}, %s::numeric[]) AS fascia,
+                                 {flag}, {colonne_giacenza},
+                                 row_number() OVER (ORDER BY {parti['ordine']}) AS posizione
+                          {sorgente}
+                      ), conteggi AS (
+                          SELECT GROUPING(genere, decennio, fascia) AS insieme, genere, decennio, fascia,
+                                 COUNT(*) FILTER (WHERE ok_anno AND ok_prezzo AND ok_disponibile) AS n_genere,
+                                 COUNT(*) FILTER (WHERE ok_genere AND ok_prezzo AND ok_disponibile) AS n_decennio,
+                                 COUNT(*) FILTER (WHERE ok_genere AND ok_anno AND ok_disponibile) AS n_fascia,
+                                 COUNT(*) FILTER (WHERE ok_genere AND ok_anno AND ok_prezzo AND disponibile) AS n_disponibili,
+                                 COUNT(*) FILTER (WHERE ok_genere AND ok_anno AND ok_prezzo AND ok_disponibile) AS n_totale
+                          FROM risultati
+                          GROUP BY GROUPING SETS ((genere), (decennio), (fascia), ())
+                      ), faccette AS (
+                          SELECT json_agg(json_build_array(insieme, genere, decennio, fascia, n_genere, n_decennio,
+                                                           n_fascia, n_disponibili, n_totale)) AS dati
+                          FROM conteggi
+                      ), pagina AS (
+                          SELECT r.posizione, l.id, l.titolo, a.nome AS autore, r.genere, l.anno_pubblicazione,
+                                 l.numero_pagine, l.prezzo, l.prezzo_nuovo, l.prezzo_usato, l.descrizione, l.isbn,
+                                 r.disponibile, r.giacenza_1, r.giacenza_2
+                          FROM risultati r
+                          JOIN libri l ON l.id = r.id
+                          JOIN autori a ON l.autore_id = a.id
+                          WHERE r.ok_genere AND r.ok_anno AND r.ok_prezzo AND r.ok_disponibile
+                          ORDER BY r.posizione
+                          LIMIT %s OFFSET %s
+                      )
+                      SELECT f.dati, p.id, p.titolo, p.autore, p.genere, p.anno_pubblicazione, p.numero_pagine,
+                             p.prezzo, p.prezzo_nuovo, p.prezzo_usato, p.descrizione, p.isbn, p.disponibile,
+                             p.giacenza_1, p.giacenza_2
+                      FROM faccette f
+                      LEFT JOIN pagina p ON TRUE
+                      ORDER BY p.posizione'''
+            params = ([LIMITI_FASCE_PREZZO] + params_flag + parti['params_ordine'] + params_sorgente +
+                      [limit, offset])
+        else:
+            filtro_faccette = ' AND '.join(condizione for condizione, _ in condizioni.values())
+            sql = f'''SELECT NULL, l.id, l.titolo, a.nome, g.nome, l.anno_pubblicazione, l.numero_pagine, l.prezzo,
+                             l.prezzo_nuovo, l.prezzo_usato, l.descrizione, l.isbn,
+                             ld.libro_id IS NOT NULL, {colonne_giacenza}
+                      {sorgente} AND {filtro_faccette}
+                      ORDER BY {parti['ordine']}
+                      LIMIT %s OFFSET %s'''
+            params = (params_sorgente + [p for _, params in condizioni.values() for p in params] +
+                      parti['params_ordine'] + [limit, offset])
+
+        cursor = self.conn.cursor()
+        with annullamento.esecuzione(self.conn) if annullamento else nullcontext():
+            if modalita == 'fuzzy':
+                # Vale solo per la transazione corrente
+                cursor.execute("SELECT set_config('pg_trgm.word_similarity_threshold', %s, true)",
+                               (str(soglia if soglia is not None else SOGLIA_SIMILARITA),))
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+        cursor.close()
+
+        libri = []
+        chiavi_giacenza = parti['chiavi_giacenza']
+        for row in rows:
+            if row[1] is None:
+                # Riga dei soli conteggi: la pagina è vuota
+                continue
+            libro = self._libro_da_riga(row[1:])
+            libro.giacenza = dict(zip(chiavi_giacenza, (row[13] or 0, row[14] or 0))) if chiavi_giacenza else None
+            libri.append(libro)
+
+        faccette = None
+        if conteggi:
+            faccette = {'totale': 0, 'disponibili': 0, 'generi': [], 'decenni': [], 'fasce_prezzo': []}
+            for insieme, genere, decennio, fascia, n_genere, n_decennio, n_fascia, n_disp, n_totale in rows[0][0] or []:
+                if insieme == 0b011 and n_genere:
+                    faccette['generi'].append((genere, n_genere))
+                elif insieme == 0b101 and n_decennio and decennio is not None:
+                    faccette['decenni'].append((decennio, n_decennio))
+                elif insieme == 0b110 and n_fascia and fascia is not None:
+                    faccette['fasce_prezzo'].append((fascia, n_fascia))
+                elif insieme == 0b111:
+                    faccette['totale'], faccette['disponibili'] = n_totale, n_disp
+            faccette['generi'].sort(key=lambda v: (-v[1], v[0]))
+            faccette['decenni'].sort()
+            faccette['fasce_prezzo'].sort()
+        return libri, faccette
+
+    # Metodi per la copia locale del catalogo (cache_catalogo.CacheCatalogo)
+    def carica_catalogo(self, finestra=FINESTRA_VERSIONI):
+        """Tutti i libri con la versione del catalogo a cui corrispondono.
+
+        Restituisce (catalogo, versione, buchi) dove catalogo è un
+        models.CatalogoColonnare costruito man mano che le righe arrivano in
+        streaming, senza creare un Libro per ciascuna, e buchi sono i numeri di versione
+        tra versione - finestra e versione non ancora registrati: possono
+        appartenere a transazioni non ancora terminate.
+        La versione è letta prima dei libri, quindi una modifica che arriva nel
+        mezzo ricompare nel primo delta, che la riapplica senza danni.
+        """
+        # Prima si rilascia la connessione della versione, poi si leggono i libri:
+        # così il caricamento occupa una sola connessione del pool alla volta
+        versione, buchi = self._versione_catalogo(finestra)
+        return CatalogoColonnare.da_righe(self._righe_libri()), versione, buchi
+
+    @_operazione
+    def _versione_catalogo(self, finestra):
+        """Versione attuale del catalogo e buchi sotto di essa (vedi carica_catalogo)"""
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT COALESCE(MAX(versione), 0) FROM modifiche_catalogo")
+        versione = cursor.fetchone()[0]
+        cursor.execute("SELECT versione FROM modifiche_catalogo WHERE versione > %s AND versione <= %s",
+                       (versione - finestra, versione))
+        recenti = {row[0] for row in cursor.fetchall()}
+        cursor.close()
+        return versione, sorted(set(range(max(versione - finestra, 0) + 1, versione + 1)) - recenti)
+
+    @_operazione
+    def carica_catalogo_delta(self, versione, buchi=()):
+        """Modifiche al catalogo dopo versione, più quelle con i numeri in buchi.
+
+        Restituisce (versioni, libri, rimossi): i numeri delle modifiche lette,
+        lo stato attuale dei libri modificati e gli id di quelli cancellati.
+        Restituisce None se il catalogo va ricaricato per intero, perché il
+        registro è stato potato oltre versione o c'è stato un caricamento massivo.
+        """
+        cursor = self.conn.cursor()
+        cursor.execute('''SELECT (SELECT MIN(versione) FROM modifiche_catalogo),
+                                 array_agg(versione), bool_or(libro_id IS NULL),
+                                 array_agg(DISTINCT libro_id) FILTER (WHERE libro_id IS NOT NULL)
+                          FROM modifiche_catalogo
+                          WHERE versione > %s OR versione = ANY(%s::bigint[])''', (versione, list(buchi)))
+        minima, versioni, ricarica, ids = cursor.fetchone()
+        cursor.close()
+        if ricarica or (minima is not None and versione < minima - 1):
+            return None
+
+        libri = self._cerca_libri_esatti('l.id = ANY(%s)', (ids,)) if ids else []
+        rimossi = set(ids or ()) - {libro.id for libro in libri}
+        return versioni or [], libri, sorted(rimossi)
+
+    @_operazione
+    def pota_modifiche_catalogo(self, versioni=VERSIONI_CONSERVATE, giorni=GIORNI_MODIFICHE_CONSERVATE):
+        """Cancella dal registro modifiche_catalogo le righe che nessun client dovrebbe più chiedere.
+
+        Restano l'ultima riga, le ultime versioni indicate e le modifiche degli
+        ultimi giorni; un client rimasto indietro oltre la potatura se ne accorge
+        in carica_catalogo_delta e ricarica il catalogo. Se un altro client sta
+        già potando non fa nulla. Restituisce il numero di righe cancellate.
+        """
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute("SELECT pg_try_advisory_xact_lock(%s)", (LOCK_POTATURA_CATALOGO,))
+            cancellate = 0
+            if cursor.fetchone()[0]:
+                cursor.execute('''DELETE FROM modifiche_catalogo
+                                  WHERE versione < (SELECT MAX(versione) FROM modifiche_catalogo) - %s
+                                    AND modificato_il < CURRENT_TIMESTAMP - make_interval(days => %s)''', (versioni, giorni))
+                cancellate = cursor.rowcount
+            self._commit()
+            return cancellate
+        except Exception:
+            self._rollback()
+            raise
+        finally:
+            cursor.close()
+
+    def apri_ascolto(self, *canali):
+        """Apre una connessione dedicata in autocommit in ascolto (LISTEN) sui canali.
+
+        Le notifiche si leggono con conn.poll() e conn.notifies quando il socket
+        (conn.fileno()) è leggibile; la connessione va chiusa dal chiamante.
+        """
+        conn = psycopg2.connect(self.dsn)
+        try:
+            conn.autocommit = True
+            cursor = conn.cursor()
+            for canale in canali:
+                cursor.execute(f"LISTEN {canale}")
+            cursor.close()
+        except Exception:
+            conn.close()
+            raise
+        return conn
+
+    # Metodi per i suggerimenti della casella di ricerca
+    @_operazione
+    def carica_suggerimenti(self, limite_titoli=50000):
+        """Voci per MotoreSuggerimenti: tutti gli autori e i generi e i titoli più popolari.
+
+        La popolarità di un libro è data da copie vendute, prenotazioni e
+        prestito in corso; autori e generi sommano quella dei loro libri.
+        Restituisce (voci, istante, ultimo_libro_id) con voci (tipo, testo, peso);
+        istante e ultimo_libro_id vanno passati a carica_suggerimenti_delta.
+        """
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT now(), COALESCE(MAX(id), 0) FROM libri")
+        istante, ultimo_libro_id = cursor.fetchone()
+        cursor.execute('''WITH popolarita AS (
+                              SELECT libro_id, SUM(peso) AS peso FROM (
+                                  SELECT libro_id, quantita AS peso FROM dettagli_acquisto
+                                  UNION ALL
+                                  SELECT libro_id, 1 FROM prenotazioni
+                                  UNION ALL
+                                  SELECT libro_id, 1 FROM libri_prestati
+                              ) eventi
+                              GROUP BY libro_id
+                          ), libri_pesati AS (
+                              SELECT l.id, l.titolo, l.autore_id, l.genere_id, COALESCE(p.peso, 0) AS peso
+                              FROM libri l
+                              LEFT JOIN popolarita p ON p.libro_id = l.id
+                          )
+                          SELECT 'autore', a.nome, COALESCE(SUM(lp.peso), 0)
+                          FROM autori a
+                          LEFT JOIN libri_pesati lp ON lp.autore_id = a.id
+                          GROUP BY a.id, a.nome
+                          UNION ALL
+                          SELECT 'genere', g.nome, COALESCE(SUM(lp.peso), 0)
+                          FROM generi g
+                          LEFT JOIN libri_pesati lp ON lp.genere_id = g.id
+                          GROUP BY g.id, g.nome
+                          UNION ALL
+                          (SELECT 'titolo', titolo, peso FROM libri_pesati ORDER BY peso DESC, id LIMIT %s)''',
+                       (limite_titoli,))
+        voci = [(tipo, testo, int(peso)) for tipo, testo, peso in cursor.fetchall()]
+        cursor.close()
+        return voci, istante, ultimo_libro_id
+
+    @_operazione
+    def carica_suggerimenti_delta(self, dal, ultimo_libro_id):
+        """Popolarità aggiunta dopo l'istante dal e libri con id oltre ultimo_libro_id.
+
+        Restituisce (righe, istante, ultimo_libro_id) con righe (titolo, autore,
+        genere, peso aggiunto). Gli eventi sono datati all'inizio della loro
+        transazione: un acquisto ancora in corso a cavallo di dal può sfuggire,
+        il che per una classifica di popolarità è accettabile.
+        """
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT now(), COALESCE(MAX(id), 0) FROM libri")
+        istante, nuovo_ultimo_id = cursor.fetchone()
+        cursor.execute('''WITH eventi AS (
+                              SELECT d.libro_id, d.quantita AS peso
+                              FROM acquisti ac
+                              JOIN dettagli_acquisto d ON d.acquisto_id = ac.id
+                              WHERE ac.data_acquisto > %s
+                              UNION ALL
+                              SELECT libro_id, 1 FROM prenotazioni WHERE data_prenotazione > %s
+                              UNION ALL
+                              SELECT id, 0 FROM libri WHERE id > %s
+                          )
+                          SELECT l.titolo, a.nome, g.nome, SUM(e.peso)
+                          FROM eventi e
+                          JOIN libri l ON l.id = e.libro_id
+                          JOIN autori a ON l.autore_id = a.id
+                          JOIN generi g ON l.genere_id = g.id
+                          GROUP BY l.id, l.titolo, a.nome, g.nome''', (dal, dal, ultimo_libro_id))
+        righe = [(titolo, autore, genere, int(peso)) for titolo, autore, genere, peso in cursor.fetchall()]
+        cursor.close()
+        return righe, istante, nuovo_ultimo_id
+
     # Metodi per prenotazioni e liste d'attesa
+    @_operazione
     def prenota_libro(self, utente_id, libro_titolo):
         """Permette a un utente di prenotare un libro disponibile"""
         try:
@@ -740,16 +1460,18 @@ class DatabaseManager:
             # Rimuovi il libro dalla disponibilità
             cursor.execute('DELETE FROM libri_disponibili WHERE libro_id = %s', (libro_id,))
             cursor.execute('INSERT INTO libri_prestati (libro_id) VALUES (%s)', (libro_id,))
+            self._invalida_ricerche(self._testi_libri([libro_id]))
 
-            self.conn.commit()
+            self._commit()
             cursor.close()
             return True, f"Prenotazione effettuata con successo. Scadenza: {data_scadenza.strftime('%d/%m/%Y')}"
 
         except Exception as e:
-            self.conn.rollback()
+            self._rollback()
             cursor.close()
             return False, f"Errore durante la prenotazione: {str(e)}"
 
+    @_operazione
     def aggiungi_lista_attesa(self, utente_id, libro_titolo):
         """Aggiunge un utente alla lista d'attesa per un libro non disponibile"""
         try:
@@ -783,15 +1505,16 @@ class DatabaseManager:
             cursor.execute('''INSERT INTO liste_attesa (utente_id, libro_id, posizione)
                             VALUES (%s, %s, %s)''', (utente_id, libro_id, posizione))
 
-            self.conn.commit()
+            self._commit()
             cursor.close()
             return True, f"Aggiunto alla lista d'attesa. La tua posizione è: {posizione}"
 
         except Exception as e:
-            self.conn.rollback()
+            self._rollback()
             cursor.close()
             return False, f"Errore durante l'aggiunta alla lista d'attesa: {str(e)}"
 
+    @_operazione
     def aggiungi_favorito(self, utente_id, libro_titolo):
         """Permette a un utente di salvare un libro nei preferiti"""
         try:
@@ -814,15 +1537,16 @@ class DatabaseManager:
             cursor.execute('INSERT INTO libri_salvati (utente_id, libro_id) VALUES (%s, %s)',
                          (utente_id, libro_id))
 
-            self.conn.commit()
+            self._commit()
             cursor.close()
             return True, "Libro aggiunto ai preferiti"
 
         except Exception as e:
-            self.conn.rollback()
+            self._rollback()
             cursor.close()
             return False, f"Errore durante l'aggiunta ai preferiti: {str(e)}"
 
+    @_operazione
     def mostra_favoriti(self, utente_id):
         """Restituisce la lista dei libri salvati dall'utente"""
         try:
@@ -848,6 +1572,7 @@ class DatabaseManager:
             cursor.close()
             return []
 
+    @_operazione
     def mostra_prenotazioni_utente(self, utente_id):
         """Restituisce la lista delle prenotazioni attive dell'utente"""
         try:
@@ -876,6 +1601,7 @@ class DatabaseManager:
             cursor.close()
             return []
 
+    @_operazione
     def mostra_notifiche(self, utente_id):
         """Restituisce le notifiche non lette dell'utente"""
         try:
@@ -901,34 +1627,37 @@ class DatabaseManager:
             cursor.close()
             return []
 
+    @_operazione
     def segna_notifiche_lette(self, utente_id):
         """Segna tutte le notifiche dell'utente come lette"""
         try:
             cursor = self.conn.cursor()
             cursor.execute('UPDATE notifiche SET letta = TRUE WHERE utente_id = %s AND letta = FALSE', (utente_id,))
-            self.conn.commit()
+            self._commit()
             cursor.close()
             return True
         except Exception as e:
-            self.conn.rollback()
+            self._rollback()
             cursor.close()
             return False
 
+    @_operazione
     def aggiungi_notifica(self, utente_id, messaggio, tipo='generale'):
         """Aggiunge una notifica per un utente"""
         try:
             cursor = self.conn.cursor()
             cursor.execute('INSERT INTO notifiche (utente_id, messaggio, tipo) VALUES (%s, %s, %s)',
                          (utente_id, messaggio, tipo))
-            self.conn.commit()
+            self._commit()
             cursor.close()
             return True
         except Exception as e:
-            self.conn.rollback()
+            self._rollback()
             cursor.close()
             return False
 
     # Metodi per la gestione degli indirizzi utente
+    @_operazione
     def salva_indirizzo(self, utente_id, nome, cognome, indirizzo, citta, cap, provincia, telefono=None, is_default=False):
         """Salva un indirizzo per l'utente"""
         try:
@@ -942,14 +1671,15 @@ class DatabaseManager:
                             VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)''',
                          (utente_id, nome, cognome, indirizzo, citta, cap, provincia, telefono, is_default))
 
-            self.conn.commit()
+            self._commit()
             cursor.close()
             return True, "Indirizzo salvato con successo"
         except Exception as e:
-            self.conn.rollback()
+            self._rollback()
             cursor.close()
             return False, f"Errore nel salvataggio dell'indirizzo: {str(e)}"
 
+    @_operazione
     def get_indirizzi_utente(self, utente_id):
         """Restituisce tutti gli indirizzi dell'utente"""
         try:
@@ -980,6 +1710,7 @@ class DatabaseManager:
             return []
 
     # Metodi per la gestione dei metodi di pagamento
+    @_operazione
     def salva_metodo_pagamento(self, utente_id, tipo, numero_carta, scadenza, titolare, is_default=False):
         """Salva un metodo di pagamento per l'utente"""
         try:
@@ -996,14 +1727,15 @@ class DatabaseManager:
                             VALUES (%s, %s, %s, %s, %s, %s)''',
                          (utente_id, tipo, numero_criptato, scadenza, titolare, is_default))
 
-            self.conn.commit()
+            self._commit()
             cursor.close()
             return True, "Metodo di pagamento salvato con successo"
         except Exception as e:
-            self.conn.rollback()
+            self._rollback()
             cursor.close()
             return False, f"Errore nel salvataggio del metodo di pagamento: {str(e)}"
 
+    @_operazione
     def get_metodi_pagamento_utente(self, utente_id):
         """Restituisce tutti i metodi di pagamento dell'utente"""
         try:
@@ -1030,6 +1762,7 @@ class DatabaseManager:
             cursor.close()
             return []
 
+    @_operazione
     def imposta_metodo_predefinito(self, utente_id, metodo_id):
         """Imposta un metodo di pagamento come predefinito"""
         try:
@@ -1042,14 +1775,15 @@ class DatabaseManager:
             cursor.execute('UPDATE metodi_pagamento SET is_default = TRUE WHERE id = %s AND utente_id = %s',
                          (metodo_id, utente_id))
 
-            self.conn.commit()
+            self._commit()
             cursor.close()
             return True, "Metodo di pagamento impostato come predefinito"
         except Exception as e:
-            self.conn.rollback()
+            self._rollback()
             cursor.close()
             return False, f"Errore nell'impostazione del metodo predefinito: {str(e)}"
 
+    @_operazione
     def elimina_metodo_pagamento(self, metodo_id):
         """Elimina un metodo di pagamento"""
         try:
@@ -1066,15 +1800,16 @@ class DatabaseManager:
 
             cursor.execute('DELETE FROM metodi_pagamento WHERE id = %s', (metodo_id,))
 
-            self.conn.commit()
+            self._commit()
             cursor.close()
             return True, "Metodo di pagamento eliminato con successo"
         except Exception as e:
-            self.conn.rollback()
+            self._rollback()
             cursor.close()
             return False, f"Errore nell'eliminazione del metodo di pagamento: {str(e)}"
 
     # Metodi per la gestione dell'inventario librerie
+    @_operazione
     def aggiorna_inventario_libreria(self, libreria_id, libro_id, copie_nuove=None, copie_usate=None):
         """Aggiorna l'inventario di una libreria per un libro specifico"""
         try:
@@ -1103,14 +1838,16 @@ class DatabaseManager:
                                 VALUES (%s, %s, %s, %s)''',
                              (libreria_id, libro_id, copie_nuove or 0, copie_usate or 0))
 
-            self.conn.commit()
+            self._invalida_ricerche(self._testi_libri([libro_id]), ('libreria', libreria_id))
+            self._commit()
             cursor.close()
             return True, "Inventario aggiornato con successo"
         except Exception as e:
-            self.conn.rollback()
+            self._rollback()
             cursor.close()
             return False, f"Errore nell'aggiornamento dell'inventario: {str(e)}"
 
+    @_operazione
     def get_inventario_libreria(self, libreria_id, libro_id=None):
         """Restituisce l'inventario di una libreria (per tutti i libri o per un libro specifico)"""
         try:
@@ -1144,7 +1881,179 @@ class DatabaseManager:
             cursor.close()
             return []
 
+    # Metodi per la gestione dell'inventario biblioteche
+    @_operazione
+    def aggiorna_inventario_biblioteca(self, biblioteca_id, libro_id, copie_totali=None, copie_disponibili=None):
+        """Aggiorna le copie possedute da una biblioteca per un libro specifico"""
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute('''INSERT INTO inventario_biblioteche (biblioteca_id, libro_id, copie_totali, copie_disponibili)
+                            VALUES (%s, %s, COALESCE(%s, 0), COALESCE(%s, %s, 0))
+                            ON CONFLICT (biblioteca_id, libro_id) DO UPDATE
+                            SET copie_totali = COALESCE(%s, inventario_biblioteche.copie_totali),
+                                copie_disponibili = COALESCE(%s, inventario_biblioteche.copie_disponibili)''',
+                         (biblioteca_id, libro_id, copie_totali, copie_disponibili, copie_totali,
+                          copie_totali, copie_disponibili))
+            self._invalida_ricerche(self._testi_libri([libro_id]), ('biblioteca', biblioteca_id))
+            self._commit()
+            cursor.close()
+            return True, "Inventario aggiornato con successo"
+        except Exception as e:
+            self._rollback()
+            cursor.close()
+            return False, f"Errore nell'aggiornamento dell'inventario: {str(e)}"
+
+    # Caricamento massivo: COPY in tabelle di appoggio e unione con poche query set-based
+    @_operazione
+    def importa_libri(self, libri):
+        """Importa molti libri (oggetti Libro) in un'unica transazione.
+
+        Autori e generi mancanti vengono creati; i libri con un ISBN già
+        presente vengono ignorati. Restituisce (successo, messaggio).
+        """
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute('''CREATE TEMP TABLE staging_libri (
+                id INTEGER,
+                titolo VARCHAR(255),
+                autore VARCHAR(255),
+                genere VARCHAR(100),
+                anno_pubblicazione INTEGER,
+                numero_pagine INTEGER,
+                prezzo DECIMAL(10,2),
+                prezzo_nuovo DECIMAL(10,2),
+                prezzo_usato DECIMAL(10,2),
+                descrizione TEXT,
+                isbn VARCHAR(20),
+                disponibile BOOLEAN
+            ) ON COMMIT DROP''')
+            copia_righe(cursor, 'staging_libri',
+                        ['titolo', 'autore', 'genere', 'anno_pubblicazione', 'numero_pagine', 'prezzo',
+                         'prezzo_nuovo', 'prezzo_usato', 'descrizione', 'isbn', 'disponibile'],
+                        ((l.titolo, l.autore, l.genere, l.anno_pubblicazione, l.numero_pagine, l.prezzo,
+                          l.prezzo_nuovo, l.prezzo_usato, l.descrizione, l.isbn, l.disponibile) for l in libri))
+
+            cursor.execute('''INSERT INTO autori (nome)
+                            SELECT DISTINCT autore FROM staging_libri WHERE autore IS NOT NULL
+                            ON CONFLICT (nome) DO NOTHING''')
+            cursor.execute('''INSERT INTO generi (nome)
+                            SELECT DISTINCT genere FROM staging_libri WHERE genere IS NOT NULL
+                            ON CONFLICT (nome) DO NOTHING''')
+
+            # Gli id vengono assegnati prima dell'inserimento per poter collegare
+            # ogni libro alla sua disponibilità senza rileggerlo per titolo
+            cursor.execute("UPDATE staging_libri SET id = nextval(pg_get_serial_sequence('libri', 'id'))")
+            cursor.execute('''WITH nuovi AS (
+                                INSERT INTO libri (id, titolo, autore_id, genere_id, anno_pubblicazione, numero_pagine,
+                                                   prezzo, prezzo_nuovo, prezzo_usato, descrizione, isbn)
+                                SELECT s.id, s.titolo, a.id, g.id, s.anno_pubblicazione, s.numero_pagine,
+                                       s.prezzo, s.prezzo_nuovo, s.prezzo_usato, s.descrizione, s.isbn
+                                FROM staging_libri s
+                                LEFT JOIN autori a ON a.nome = s.autore
+                                LEFT JOIN generi g ON g.nome = s.genere
+                                ON CONFLICT (isbn) DO NOTHING
+                                RETURNING id
+                            ), disponibili AS (
+                                INSERT INTO libri_disponibili (libro_id)
+                                SELECT s.id FROM staging_libri s JOIN nuovi n ON n.id = s.id
+                                WHERE s.disponibile IS NOT FALSE
+                                RETURNING libro_id
+                            )
+                            INSERT INTO libri_prestati (libro_id)
+                            SELECT s.id FROM staging_libri s JOIN nuovi n ON n.id = s.id
+                            WHERE s.disponibile IS FALSE''')
+            cursor.execute('''SELECT COUNT(*) FROM libri l JOIN staging_libri s ON s.id = l.id''')
+            importati = cursor.fetchone()[0]
+            # Dentro transazione() il commit (e l'ON COMMIT DROP) è rimandato:
+            # senza eliminarla subito una seconda importazione troverebbe la tabella
+            cursor.execute('DROP TABLE staging_libri')
+
+            self._invalida_ricerche(None)
+            self._commit()
+            cursor.close()
+            return True, f"Importati {importati} libri"
+        except Exception as e:
+            self._rollback()
+            cursor.close()
+            return False, f"Errore nell'importazione dei libri: {str(e)}"
+
+    @_operazione
+    def importa_inventario_librerie(self, righe):
+        """Importa molte voci di inventario (libreria_id, libro_id, copie_nuove, copie_usate).
+
+        Le voci già esistenti vengono sovrascritte; a parità di libreria e libro
+        vale l'ultima riga fornita. Restituisce (successo, messaggio).
+        """
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute('''CREATE TEMP TABLE staging_inventario (
+                riga SERIAL,
+                libreria_id INTEGER,
+                libro_id INTEGER,
+                copie_nuove INTEGER,
+                copie_usate INTEGER
+            ) ON COMMIT DROP''')
+            copia_righe(cursor, 'staging_inventario', ['libreria_id', 'libro_id', 'copie_nuove', 'copie_usate'], righe)
+
+            cursor.execute('''INSERT INTO inventario_librerie (libreria_id, libro_id, copie_nuove, copie_usate)
+                            SELECT DISTINCT ON (libreria_id, libro_id)
+                                   libreria_id, libro_id, COALESCE(copie_nuove, 0), COALESCE(copie_usate, 0)
+                            FROM staging_inventario
+                            ORDER BY libreria_id, libro_id, riga DESC
+                            ON CONFLICT (libreria_id, libro_id) DO UPDATE
+                            SET copie_nuove = EXCLUDED.copie_nuove, copie_usate = EXCLUDED.copie_usate''')
+            importate = cursor.rowcount
+            cursor.execute('DROP TABLE staging_inventario')  # vedi importa_libri
+
+            self._invalida_ricerche(None)
+            self._commit()
+            cursor.close()
+            return True, f"Importate {importate} voci di inventario"
+        except Exception as e:
+            self._rollback()
+            cursor.close()
+            return False, f"Errore nell'importazione dell'inventario: {str(e)}"
+
+    @_operazione
+    def importa_inventario_biblioteche(self, righe):
+        """Importa molte voci di inventario (biblioteca_id, libro_id, copie_totali, copie_disponibili).
+
+        Come importa_inventario_librerie: le voci già esistenti vengono
+        sovrascritte e vale l'ultima riga fornita. Restituisce (successo, messaggio).
+        """
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute('''CREATE TEMP TABLE staging_inventario_biblioteche (
+                riga SERIAL,
+                biblioteca_id INTEGER,
+                libro_id INTEGER,
+                copie_totali INTEGER,
+                copie_disponibili INTEGER
+            ) ON COMMIT DROP''')
+            copia_righe(cursor, 'staging_inventario_biblioteche',
+                        ['biblioteca_id', 'libro_id', 'copie_totali', 'copie_disponibili'], righe)
+
+            cursor.execute('''INSERT INTO inventario_biblioteche (biblioteca_id, libro_id, copie_totali, copie_disponibili)
+                            SELECT DISTINCT ON (biblioteca_id, libro_id)
+                                   biblioteca_id, libro_id, COALESCE(copie_totali, 0), COALESCE(copie_disponibili, 0)
+                            FROM staging_inventario_biblioteche
+                            ORDER BY biblioteca_id, libro_id, riga DESC
+                            ON CONFLICT (biblioteca_id, libro_id) DO UPDATE
+                            SET copie_totali = EXCLUDED.copie_totali, copie_disponibili = EXCLUDED.copie_disponibili''')
+            importate = cursor.rowcount
+            cursor.execute('DROP TABLE staging_inventario_biblioteche')  # vedi importa_libri
+
+            self._invalida_ricerche(None)
+            self._commit()
+            cursor.close()
+            return True, f"Importate {importate} voci di inventario"
+        except Exception as e:
+            self._rollback()
+            cursor.close()
+            return False, f"Errore nell'importazione dell'inventario: {str(e)}"
+
     # Metodi per gli acquisti
+    @_operazione
     def crea_acquisto(self, utente_id, libreria_id, indirizzo_id, metodo_pagamento_id, carrello, tipo_consegna='negozio', note=None):
         """Crea un nuovo acquisto"""
         try:
@@ -1202,14 +2111,19 @@ class DatabaseManager:
             # Aggiungi notifica all'utente
             self.aggiungi_notifica(utente_id, f"Il tuo acquisto #{acquisto_id} è stato confermato!", "acquisto")
 
-            self.conn.commit()
+            # Le giacenze sono cambiate solo in questa libreria
+            self._invalida_ricerche(self._testi_libri({item['libro_id'] for item in carrello}),
+                                    ('libreria', libreria_id))
+
+            self._commit()
             cursor.close()
             return True, f"Acquisto #{acquisto_id} creato con successo"
         except Exception as e:
-            self.conn.rollback()
+            self._rollback()
             cursor.close()
             return False, f"Errore nella creazione dell'acquisto: {str(e)}"
 
+    @_operazione
     def get_acquisti_utente(self, utente_id):
         """Restituisce la lista degli acquisti dell'utente"""
         try:
@@ -1241,6 +2155,7 @@ class DatabaseManager:
             cursor.close()
             return []
 
+    @_operazione
     def get_dettagli_acquisto(self, acquisto_id):
         """Restituisce i dettagli di un acquisto specifico"""
         try:
@@ -1297,6 +2212,7 @@ class DatabaseManager:
             return None
 
     # Metodi per il feedback e recensioni
+    @_operazione
     def aggiungi_feedback(self, utente_id, libro_id, acquisto_id, valutazione, commento=None):
         """Aggiunge una recensione per un libro acquistato"""
         try:
@@ -1313,14 +2229,15 @@ class DatabaseManager:
                             VALUES (%s, %s, %s, %s, %s)''',
                          (utente_id, libro_id, acquisto_id, valutazione, commento))
 
-            self.conn.commit()
+            self._commit()
             cursor.close()
             return True, "Recensione aggiunta con successo"
         except Exception as e:
-            self.conn.rollback()
+            self._rollback()
             cursor.close()
             return False, f"Errore nell'aggiunta della recensione: {str(e)}"
 
+    @_operazione
     def get_feedback_libro(self, libro_id, limit=10):
         """Restituisce le recensioni di un libro"""
         try:
@@ -1350,6 +2267,7 @@ class DatabaseManager:
             cursor.close()
             return []
 
+    @_operazione
     def vota_feedback(self, feedback_id, utile=True):
         """Vota utile/non utile una recensione"""
         try:
@@ -1360,15 +2278,16 @@ class DatabaseManager:
             else:
                 cursor.execute('UPDATE feedback_libri SET non_utile = non_utile + 1 WHERE id = %s', (feedback_id,))
 
-            self.conn.commit()
+            self._commit()
             cursor.close()
             return True
         except Exception as e:
-            self.conn.rollback()
+            self._rollback()
             cursor.close()
             return False
 
     # Metodi per le richieste dei bibliotecari
+    @_operazione
     def crea_richiesta_bibliotecario(self, bibliotecario_id, tipo, descrizione, priorita='normale'):
         """Crea una nuova richiesta per un bibliotecario"""
         try:
@@ -1388,14 +2307,15 @@ class DatabaseManager:
                 if bib[0] != bibliotecario_id:  # Non notificare se stesso
                     self.aggiungi_notifica(bib[0], f"Nuova richiesta #{richiesta_id}: {tipo}", "richiesta")
 
-            self.conn.commit()
+            self._commit()
             cursor.close()
             return True, f"Richiesta #{richiesta_id} creata con successo"
         except Exception as e:
-            self.conn.rollback()
+            self._rollback()
             cursor.close()
             return False, f"Errore nella creazione della richiesta: {str(e)}"
 
+    @_operazione
     def get_richieste_bibliotecario(self, bibliotecario_id=None):
         """Restituisce le richieste dei bibliotecari (tutte se admin, solo proprie se bibliotecario)"""
         try:
@@ -1433,6 +2353,7 @@ class DatabaseManager:
             cursor.close()
             return []
 
+    @_operazione
     def aggiorna_stato_richiesta(self, richiesta_id, nuovo_stato, bibliotecario_id=None):
         """Aggiorna lo stato di una richiesta"""
         try:
@@ -1451,15 +2372,17 @@ class DatabaseManager:
                 if bib_id:
                     self.aggiungi_notifica(bib_id[0], f"La tua richiesta #{richiesta_id} è stata aggiornata a '{nuovo_stato}'", "richiesta")
 
-            self.conn.commit()
+            self._commit()
             cursor.close()
             return True, "Stato richiesta aggiornato con successo"
         except Exception as e:
-            self.conn.rollback()
+            self._rollback()
             cursor.close()
             return False, f"Errore nell'aggiornamento dello stato: {str(e)}"
 
     def __del__(self):
-        """Chiude la connessione al database"""
-        if hasattr(self, 'conn') and self.conn:
-            self.conn.close()
\ No newline at end of file
+        """Chiude le connessioni al database"""
+        if getattr(self, '_pool', None) is not None:
+            self._pool.closeall()
+        elif getattr(self, '_conn_condivisa', None) is not None:
+            self._conn_condivisa.close()
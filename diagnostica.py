@@ -0,0 +1,187 @@
+"""
+Script di diagnostica: segnala le query più frequenti di database.py che
+PostgreSQL esegue ancora con una scansione sequenziale.
+
+Le query non sono copiate qui: si chiamano i metodi di DatabaseManager, ognuno
+in una transazione poi annullata, e si registrano gli statement che emettono
+tramite la strumentazione (come in piani.py).
+"""
+
+import sys
+
+import psycopg2
+
+from database import DatabaseManager, TransazioneAnnullata
+from strumentazione import strumentazione
+
+
+# Metodi più frequenti di DatabaseManager con parametri rappresentativi:
+# nome -> funzione(db, campione) che esegue una chiamata
+CHIAMATE_FREQUENTI = {
+    'login': lambda db, c: db.login(c['email'], 'password'),
+    'cerca_titolo': lambda db, c: db.cerca_titolo(c['titolo_disponibile']),
+    'cerca_autore': lambda db, c: db.cerca_autore(c['autore']),
+    'cerca_libri (fulltext)': lambda db, c: db.cerca_libri('romanzo', modalita='fulltext'),
+    'cerca_libri (fuzzy)': lambda db, c: db.cerca_libri('pirandelo', modalita='fuzzy'),
+    'cerca_libri (prefisso)': lambda db, c: db.cerca_libri('roma', modalita='prefisso'),
+    'cerca_libri (libreria)': lambda db, c: db.cerca_libri('romanzo', tipo_struttura='libreria',
+                                                           struttura_id=c['libreria_id']),
+    'cerca_libri (biblioteca)': lambda db, c: db.cerca_libri('romanzo', tipo_struttura='biblioteca',
+                                                             struttura_id=c['biblioteca_id']),
+    'prenota_libro': lambda db, c: db.prenota_libro(c['utente_id'], c['titolo_disponibile']),
+    'mostra_prenotazioni_utente': lambda db, c: db.mostra_prenotazioni_utente(c['utente_id']),
+    'aggiungi_lista_attesa': lambda db, c: db.aggiungi_lista_attesa(c['utente_id'], c['titolo_prestato']),
+    'mostra_notifiche': lambda db, c: db.mostra_notifiche(c['utente_id']),
+    'segna_notifiche_lette': lambda db, c: db.segna_notifiche_lette(c['utente_id']),
+    'mostra_favoriti': lambda db, c: db.mostra_favoriti(c['utente_id']),
+    'get_indirizzi_utente': lambda db, c: db.get_indirizzi_utente(c['utente_id']),
+    'get_metodi_pagamento_utente': lambda db, c: db.get_metodi_pagamento_utente(c['utente_id']),
+    'get_acquisti_utente': lambda db, c: db.get_acquisti_utente(c['utente_id']),
+    'get_dettagli_acquisto': lambda db, c: db.get_dettagli_acquisto(c['acquisto_id']),
+    'get_feedback_libro': lambda db, c: db.get_feedback_libro(c['libro_id']),
+    'aggiorna_inventario_libreria': lambda db, c: db.aggiorna_inventario_libreria(c['libreria_id'], c['libro_id'], 1, 0),
+    'aggiorna_inventario_biblioteca': lambda db, c: db.aggiorna_inventario_biblioteca(c['biblioteca_id'], c['libro_id'], 1, 1),
+    'get_richieste_bibliotecario': lambda db, c: db.get_richieste_bibliotecario(c['utente_id']),
+}
+
+# Statement di cui si può chiedere il piano
+COMANDI_SPIEGABILI = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH')
+
+# Tabelle di riferimento con poche righe, per cui una scansione sequenziale è normale
+TABELLE_PICCOLE = {'ruoli', 'citta', 'biblioteche', 'librerie'}
+
+# Valori usati quando il database non ha righe da cui prendere un parametro:
+# il piano si ottiene comunque, anche se il metodo si ferma ai primi controlli
+CAMPIONE_PREDEFINITO = {
+    'utente_id': 1, 'email': 'utente', 'libro_id': 1, 'autore': 'autore',
+    'titolo_disponibile': 'titolo', 'titolo_prestato': 'titolo',
+    'libreria_id': 1, 'biblioteca_id': 1, 'acquisto_id': 1,
+}
+
+
+class _Annulla(Exception):
+    """Fa annullare la transazione in cui è stata eseguita una chiamata"""
+
+
+def campione(conn):
+    """Parametri per CHIAMATE_FREQUENTI letti dal database"""
+    interrogazioni = {
+        ('utente_id', 'email'): 'SELECT id, email FROM utenti ORDER BY id LIMIT 1',
+        ('libro_id', 'autore'): '''SELECT l.id, a.nome FROM libri l JOIN autori a ON l.autore_id = a.id
+                                   ORDER BY l.id LIMIT 1''',
+        ('titolo_disponibile',): '''SELECT l.titolo FROM libri l JOIN libri_disponibili t ON t.libro_id = l.id
+                                    ORDER BY l.id LIMIT 1''',
+        ('titolo_prestato',): '''SELECT l.titolo FROM libri l JOIN libri_prestati t ON t.libro_id = l.id
+                                 ORDER BY l.id LIMIT 1''',
+        ('libreria_id',): 'SELECT id FROM librerie ORDER BY id LIMIT 1',
+        ('biblioteca_id',): 'SELECT id FROM biblioteche ORDER BY id LIMIT 1',
+        ('acquisto_id',): 'SELECT id FROM acquisti ORDER BY id LIMIT 1',
+    }
+    valori = dict(CAMPIONE_PREDEFINITO)
+    cursor = conn.cursor()
+    try:
+        for chiavi, query in interrogazioni.items():
+            cursor.execute(query)
+            riga = cursor.fetchone()
+            if riga:
+                valori.update(zip(chiavi, riga))
+    finally:
+        conn.rollback()
+        cursor.close()
+    return valori
+
+
+def cattura_statement(db, valori):
+    """Esegue ogni chiamata frequente in una transazione annullata.
+
+    Restituisce {metodo: {forma: (query, parametri)}} con il primo esempio di
+    ogni forma di statement emessa dal metodo.
+    """
+    statement = {}
+    corrente = {}
+
+    def osserva(forma, query, parametri):
+        if query.lstrip().upper().startswith(COMANDI_SPIEGABILI):
+            corrente.setdefault(forma, (query, parametri))
+
+    strumentazione.osservatore = osserva
+    strumentazione.abilita()
+    try:
+        for nome, chiamata in CHIAMATE_FREQUENTI.items():
+            corrente = statement[nome] = {}
+            try:
+                with db.transazione():
+                    chiamata(db, valori)
+                    raise _Annulla()
+            except (_Annulla, TransazioneAnnullata, psycopg2.Error):
+                pass
+    finally:
+        strumentazione.disabilita()
+        strumentazione.osservatore = None
+    return statement
+
+
+def trova_scansioni_sequenziali(piano):
+    """Restituisce le tabelle lette con Seq Scan in un piano EXPLAIN (FORMAT JSON)"""
+    tabelle = []
+    if piano.get('Node Type') == 'Seq Scan':
+        tabelle.append(piano.get('Relation Name'))
+    for figlio in piano.get('Plans', []):
+        tabelle.extend(trova_scansioni_sequenziali(figlio))
+    return tabelle
+
+
+def verifica_scansioni_sequenziali(conn, statement):
+    """Esegue EXPLAIN sugli statement catturati e restituisce {metodo: [tabelle con Seq Scan]}.
+
+    Le scansioni sequenziali sono disabilitate per il planner: se una compare
+    comunque nel piano, per quel predicato non esiste un indice utilizzabile,
+    indipendentemente dalla dimensione attuale delle tabelle.
+    """
+    risultati = {}
+    cursor = conn.cursor()
+    try:
+        for nome, forme in statement.items():
+            tabelle = []
+            for query, params in forme.values():
+                try:
+                    cursor.execute("SET LOCAL enable_seqscan = off")
+                    cursor.execute("EXPLAIN (FORMAT JSON) " + query, params)
+                    piano = cursor.fetchone()[0][0]['Plan']
+                    tabelle.extend(t for t in trova_scansioni_sequenziali(piano) if t not in TABELLE_PICCOLE)
+                except psycopg2.Error:
+                    pass
+                conn.rollback()
+            risultati[nome] = tabelle
+    finally:
+        conn.rollback()
+        cursor.close()
+    return risultati
+
+
+def main():
+    """Stampa il report e termina con codice 1 se qualche query usa scansioni sequenziali"""
+    db = DatabaseManager(cache_ricerche=False)
+    with db.connessione() as conn:
+        valori = campione(conn)
+    statement = cattura_statement(db, valori)
+    with db.connessione() as conn:
+        risultati = verifica_scansioni_sequenziali(conn, statement)
+
+    print("=== QUERY FREQUENTI: SCANSIONI SEQUENZIALI ===")
+    problemi = 0
+    for nome, tabelle in risultati.items():
+        if tabelle:
+            problemi += 1
+            print(f"✗ {nome}: Seq Scan su {', '.join(sorted(set(tabelle)))}")
+        elif not statement[nome]:
+            print(f"? {nome}: nessuno statement eseguito")
+        else:
+            print(f"✓ {nome}")
+
+    print(f"\n{problemi} metodi su {len(risultati)} senza un indice adeguato.")
+    return 1 if problemi else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
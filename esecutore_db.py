@@ -0,0 +1,131 @@
+"""
+Esecuzione delle chiamate a DatabaseManager fuori dal thread dell'interfaccia
+"""
+
+import itertools
+
+import psycopg2
+from PyQt5.QtCore import QObject, QRunnable, QSocketNotifier, QThreadPool, pyqtSignal
+
+
+class _SegnaliLavoro(QObject):
+    """Segnali emessi dai thread di lavoro e consegnati nel thread dell'interfaccia"""
+    terminato = pyqtSignal(int, bool, object)
+
+
+class _Lavoro(QRunnable):
+    """Esegue una funzione in un thread del pool e ne segnala il risultato"""
+
+    def __init__(self, lavoro_id, funzione, args, kwargs, segnali):
+        super().__init__()
+        self.lavoro_id = lavoro_id
+        self.funzione = funzione
+        self.args = args
+        self.kwargs = kwargs
+        self.segnali = segnali
+
+    def run(self):
+        try:
+            risultato = self.funzione(*self.args, **self.kwargs)
+            ok = True
+        except Exception as e:
+            risultato = e
+            ok = False
+        self.segnali.terminato.emit(self.lavoro_id, ok, risultato)
+
+
+class EsecutoreDatabase(QObject):
+    """Esegue funzioni in un QThreadPool e consegna i risultati nel thread dell'interfaccia.
+
+    Le richieste con la stessa chiave si sostituiscono: se ne parte una nuova
+    prima che la precedente termini, il risultato della precedente viene
+    scartato. Il segnale occupato indica se ci sono lavori in corso.
+    """
+
+    occupato = pyqtSignal(bool)
+
+    def __init__(self, parent=None, max_thread=4):
+        super().__init__(parent)
+        self._pool = QThreadPool(self)
+        self._pool.setMaxThreadCount(max_thread)
+        self._segnali = _SegnaliLavoro(self)
+        self._segnali.terminato.connect(self._consegna)
+        self._contatore = itertools.count(1)
+        self._ultimi = {}  # chiave -> id dell'ultimo lavoro richiesto
+        self._in_corso = {}  # id -> (chiave, al_termine, in_errore)
+
+    def esegui(self, funzione, *args, al_termine=None, in_errore=None, chiave=None, **kwargs):
+        """Avvia funzione(*args, **kwargs) in background e restituisce l'id del lavoro"""
+        lavoro_id = next(self._contatore)
+        if chiave is not None:
+            self._ultimi[chiave] = lavoro_id
+        self._in_corso[lavoro_id] = (chiave, al_termine, in_errore)
+        if len(self._in_corso) == 1:
+            self.occupato.emit(True)
+        self._pool.start(_Lavoro(lavoro_id, funzione, args, kwargs, self._segnali))
+        return lavoro_id
+
+    def annulla(self, chiave):
+        """Scarta il risultato dell'ultimo lavoro con questa chiave, se non è ancora arrivato"""
+        self._ultimi.pop(chiave, None)
+
+    def in_corso(self, chiave):
+        """Indica se c'è un lavoro con questa chiave il cui risultato è ancora atteso"""
+        return chiave in self._ultimi
+
+    def attendi(self, msecs=-1):
+        """Attende la fine di tutti i lavori (per la chiusura dell'applicazione)"""
+        return self._pool.waitForDone(msecs)
+
+    def _consegna(self, lavoro_id, ok, risultato):
+        chiave, al_termine, in_errore = self._in_corso.pop(lavoro_id)
+        if not self._in_corso:
+            self.occupato.emit(False)
+
+        if chiave is not None:
+            if self._ultimi.get(chiave) != lavoro_id:
+                # Risultato di una richiesta superata da una più recente
+                return
+            del self._ultimi[chiave]
+
+        if ok:
+            if al_termine is not None:
+                al_termine(risultato)
+        elif in_errore is not None:
+            in_errore(risultato)
+        else:
+            print(f"Errore nell'operazione sul database: {risultato}")
+
+
+class AscoltatoreNotifiche(QObject):
+    """Consegna nel thread dell'interfaccia le NOTIFY ricevute da una connessione in LISTEN.
+
+    Il socket della connessione (DatabaseManager.apri_ascolto) è osservato con
+    un QSocketNotifier, quindi l'attesa non blocca l'interfaccia e non occupa
+    thread. Se la connessione cade emette interrotto e smette di ascoltare.
+    """
+
+    notifica = pyqtSignal(str, str)  # canale, contenuto
+    interrotto = pyqtSignal(object)
+
+    def __init__(self, conn, parent=None):
+        super().__init__(parent)
+        self._conn = conn
+        self._notifier = QSocketNotifier(conn.fileno(), QSocketNotifier.Read, self)
+        self._notifier.activated.connect(self._leggi)
+
+    def _leggi(self):
+        try:
+            self._conn.poll()
+        except psycopg2.Error as e:
+            self.chiudi()
+            self.interrotto.emit(e)
+            return
+        while self._conn.notifies:
+            notifica = self._conn.notifies.pop(0)
+            self.notifica.emit(notifica.channel, notifica.payload)
+
+    def chiudi(self):
+        self._notifier.setEnabled(False)
+        if not self._conn.closed:
+            self._conn.close()
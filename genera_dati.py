@@ -0,0 +1,547 @@
+"""
+Generatore di dati sintetici a fattore di scala per test di carico e benchmark.
+
+Con SF1 crea 10.000 libri, 5.000 utenti e 100.000 acquisti; le quantità
+crescono linearmente (SF100 = 1M libri, 500k utenti, 10M acquisti). I dati
+sono deterministici: stesso seme e stessa scala producono lo stesso database,
+indipendentemente dal numero di processi usati per generarlo.
+
+Uso: python genera_dati.py --scala 1 --seme 42 --processi 8
+"""
+
+import argparse
+import bisect
+import hashlib
+import itertools
+import math
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from multiprocessing import Pool
+
+import psycopg2
+
+from database import DSN_PREDEFINITO, copia_righe
+from migrazioni import applica_migrazioni
+
+
+# Data di riferimento fissa: i dati non devono dipendere dal giorno della generazione
+DATA_RIFERIMENTO = datetime(2025, 1, 1)
+
+# Righe principali generate da ogni processo per blocco
+BLOCCO_LIBRI = 50000
+BLOCCO_UTENTI = 20000
+BLOCCO_ACQUISTI = 100000
+BLOCCO_STRUTTURE = 50
+
+# Peso relativo degli acquisti per mese (picchi a settembre e dicembre, calo estivo)
+PESI_MESI = [0.8, 0.7, 0.8, 0.9, 0.9, 0.8, 0.7, 0.5, 1.4, 1.0, 1.2, 2.0]
+_CUMULATI_MESI = list(itertools.accumulate(PESI_MESI))
+# Peso relativo per ora del giorno (picco serale)
+_CUMULATI_ORE = list(itertools.accumulate([1] * 8 + [3] * 10 + [5] * 4 + [2] * 2))
+
+GENERI = [
+    "Narrativa", "Saggistica", "Poesia", "Teatro", "Fantascienza", "Fantasy",
+    "Giallo", "Thriller", "Horror", "Storico", "Biografia", "Autobiografia",
+    "Filosofia", "Psicologia", "Scienza", "Storia", "Arte", "Musica",
+    "Cinema", "Fotografia", "Viaggi", "Sport", "Cucina", "Giardinaggio",
+    "Manuali", "Scuola", "Università", "Bambini", "Ragazzi", "Giovani Adulti"
+]
+
+NOMI = [
+    "Marco", "Giulia", "Luca", "Francesca", "Alessandro", "Chiara", "Andrea", "Sara",
+    "Matteo", "Valentina", "Lorenzo", "Elena", "Davide", "Martina", "Simone", "Federica",
+    "Giorgio", "Alessia", "Stefano", "Silvia", "Paolo", "Laura", "Roberto", "Anna",
+    "Francesco", "Elisa", "Riccardo", "Giorgia", "Antonio", "Beatrice", "Emanuele", "Irene"
+]
+
+COGNOMI = [
+    "Rossi", "Russo", "Ferrari", "Esposito", "Bianchi", "Romano", "Colombo", "Ricci",
+    "Marino", "Greco", "Bruno", "Gallo", "Conti", "De Luca", "Mancini", "Costa",
+    "Giordano", "Rizzo", "Lombardi", "Moretti", "Barbieri", "Fontana", "Santoro", "Mariani",
+    "Rinaldi", "Caruso", "Ferrara", "Galli", "Martini", "Leone", "Longo", "Gentile"
+]
+
+REGIONI = [
+    "Lombardia", "Lazio", "Campania", "Sicilia", "Veneto", "Emilia-Romagna", "Piemonte",
+    "Puglia", "Toscana", "Calabria", "Sardegna", "Liguria", "Marche", "Abruzzo",
+    "Friuli-Venezia Giulia", "Trentino-Alto Adige", "Umbria", "Basilicata", "Molise", "Valle d'Aosta"
+]
+
+SOGGETTI = [
+    "Il segreto", "La casa", "Il viaggio", "L'ombra", "La memoria", "Il giardino", "La notte",
+    "Il silenzio", "La città", "Il ritorno", "L'isola", "La lettera", "Il mistero", "La strada",
+    "Il sogno", "La voce", "Il tempo", "La promessa", "Il confine", "La luce"
+]
+
+COMPLEMENTI = [
+    "del mare", "di pietra", "dei ricordi", "delle stelle", "del nord", "di vetro", "perduto",
+    "dell'inverno", "senza nome", "del lago", "d'autunno", "della montagna", "nascosto",
+    "dei Medici", "di Venezia", "del deserto", "infinito", "di carta", "del faro", "sospeso"
+]
+
+
+def conteggi(scala):
+    """Numero di righe principali per ogni entità al fattore di scala indicato"""
+    return {
+        'citta': max(6, int(20 + 5 * scala)),
+        'autori': max(10, int(1000 * scala)),
+        'libri': max(100, int(10000 * scala)),
+        'utenti': max(50, int(5000 * scala)),
+        'acquisti': max(100, int(100000 * scala)),
+    }
+
+
+# Distribuzioni Zipf: pesi cumulativi calcolati una volta per processo
+_ZIPF = {}
+
+
+def zipf(rng, n, s=1.1):
+    """Estrae un rango 0..n-1 con probabilità proporzionale a 1 / (rango + 1)^s"""
+    cumulati = _ZIPF.get((n, s))
+    if cumulati is None:
+        cumulati = list(itertools.accumulate(1.0 / (k + 1) ** s for k in range(n)))
+        _ZIPF[(n, s)] = cumulati
+    return bisect.bisect_left(cumulati, rng.random() * cumulati[-1])
+
+
+_PASSI = {}
+
+
+def sparpaglia(rango, n):
+    """Associa il rango di popolarità a una posizione 0..n-1, così i più popolari non sono i primi id"""
+    passo = _PASSI.get(n)
+    if passo is None:
+        # Un passo coprimo con n rende la corrispondenza biunivoca
+        passo = 2654435761
+        while math.gcd(passo, n) != 1:
+            passo += 2
+        _PASSI[n] = passo
+    return (rango * passo) % n
+
+
+def prezzo_libro(libro_id):
+    """Prezzo del nuovo ricavabile dal solo id, così ogni processo lo conosce senza query"""
+    return round(5 + ((libro_id * 2654435761) % 4500) / 100, 2)
+
+
+def titolo_libro(libro_id):
+    """Titolo ricavabile dal solo id e diverso per ogni libro.
+
+    Le prime combinazioni soggetto + complemento sono sparse sugli id; quando
+    sono esaurite si ripetono come volumi successivi ("..., vol. 2").
+    """
+    combinazioni = len(SOGGETTI) * len(COMPLEMENTI)
+    volume, k = divmod(libro_id - 1, combinazioni)
+    coppia = sparpaglia(k, combinazioni)
+    titolo = f"{SOGGETTI[coppia // len(COMPLEMENTI)]} {COMPLEMENTI[coppia % len(COMPLEMENTI)]}"
+    return f"{titolo}, vol. {volume + 1}" if volume else titolo
+
+
+def data_stagionale(rng, anni=3):
+    """Data negli ultimi anni con stagionalità mensile e picco di ore serali"""
+    anno = DATA_RIFERIMENTO.year - 1 - rng.randrange(anni)
+    mese = rng.choices(range(1, 13), cum_weights=_CUMULATI_MESI)[0]
+    giorno = rng.randint(1, 28)
+    ora = rng.choices(range(24), cum_weights=_CUMULATI_ORE)[0]
+    return datetime(anno, mese, giorno, ora, rng.randrange(60), rng.randrange(60))
+
+
+def _rng(contesto, tabella, blocco):
+    """Generatore casuale dipendente solo da seme, tabella e blocco"""
+    chiave = f"{contesto['seme']}:{tabella}:{blocco}".encode()
+    return random.Random(int.from_bytes(hashlib.sha256(chiave).digest()[:8], 'big'))
+
+
+# Generatori per blocco: ognuno restituisce [(tabella, colonne, righe), ...] nell'ordine di caricamento
+
+def genera_base(contesto, inizio, fine, rng):
+    """Città, biblioteche, librerie e autori (blocco unico)"""
+    n = contesto['n']
+    off = contesto['offset']
+    citta, biblioteche, librerie, autori = [], [], [], []
+    for i in range(n['citta']):
+        citta_id = off['citta'] + i + 1
+        citta.append((citta_id, f"Comune {citta_id}", REGIONI[i % len(REGIONI)]))
+    for i in range(contesto['n_biblioteche']):
+        citta_id = off['citta'] + i % n['citta'] + 1
+        biblioteche.append((off['biblioteche'] + i + 1, f"Biblioteca {i + 1}",
+                            f"Via {rng.choice(COGNOMI)} {rng.randint(1, 200)}", citta_id))
+    for i in range(contesto['n_librerie']):
+        citta_id = off['citta'] + i % n['citta'] + 1
+        librerie.append((off['librerie'] + i + 1, f"Libreria {i + 1}",
+                         f"Corso {rng.choice(COGNOMI)} {rng.randint(1, 200)}", citta_id))
+    for i in range(n['autori']):
+        # Nome, iniziale e cognome derivati dall'id (non dall'indice): tutti distinti
+        # anche quando si aggiungono dati a un database già popolato
+        k = off['autori'] + i
+        nome = NOMI[k % len(NOMI)]
+        cognome = COGNOMI[(k // len(NOMI)) % len(COGNOMI)]
+        iniziale = chr(ord('A') + (k // (len(NOMI) * len(COGNOMI))) % 26)
+        giro = k // (len(NOMI) * len(COGNOMI) * 26)
+        autori.append((k + 1, f"{nome} {iniziale}. {cognome}" + (f" {giro}" if giro else "")))
+    return [
+        ('citta', ['id', 'nome', 'regione'], citta),
+        ('biblioteche', ['id', 'nome', 'indirizzo', 'citta_id'], biblioteche),
+        ('librerie', ['id', 'nome', 'indirizzo', 'citta_id'], librerie),
+        ('autori', ['id', 'nome'], autori),
+    ]
+
+
+def genera_libri(contesto, inizio, fine, rng):
+    """Libri con disponibilità; pochi autori scrivono molti libri (Zipf)"""
+    n = contesto['n']
+    off = contesto['offset']
+    generi = contesto['generi']
+    libri, disponibili, prestati = [], [], []
+    for i in range(inizio, fine):
+        libro_id = off['libri'] + i + 1
+        autore_id = off['autori'] + sparpaglia(zipf(rng, n['autori'], 1.0), n['autori']) + 1
+        genere_id = generi[zipf(rng, len(generi), 0.8)]
+        anno = int(rng.triangular(1900, DATA_RIFERIMENTO.year, 2015))
+        pagine = max(48, int(rng.gauss(320, 120)))
+        prezzo = prezzo_libro(libro_id)
+        titolo = titolo_libro(libro_id)
+        descrizione = f"{titolo}: un'opera pubblicata nel {anno}, {pagine} pagine."
+        isbn = f"979-{libro_id:010d}"
+        libri.append((libro_id, titolo, autore_id, genere_id, anno, pagine,
+                       prezzo, prezzo, round(prezzo * 0.6, 2), descrizione, isbn))
+        (disponibili if rng.random() < 0.85 else prestati).append((libro_id,))
+    return [
+        ('libri', ['id', 'titolo', 'autore_id', 'genere_id', 'anno_pubblicazione', 'numero_pagine',
+                   'prezzo', 'prezzo_nuovo', 'prezzo_usato', 'descrizione', 'isbn'], libri),
+        ('libri_disponibili', ['libro_id'], disponibili),
+        ('libri_prestati', ['libro_id'], prestati),
+    ]
+
+
+def _libri_popolari(rng, contesto, quanti):
+    """Insieme di libri distinti scelti secondo la popolarità"""
+    n_libri = contesto['n']['libri']
+    scelti = set()
+    tentativi = 0
+    while len(scelti) < quanti and tentativi < quanti * 4:
+        scelti.add(contesto['offset']['libri'] + sparpaglia(zipf(rng, n_libri), n_libri) + 1)
+        tentativi += 1
+    return sorted(scelti)
+
+
+def genera_inventari(contesto, inizio, fine, rng):
+    """Giacenze per un gruppo di strutture; le librerie tengono soprattutto i titoli popolari"""
+    n_libri = contesto['n']['libri']
+    off = contesto['offset']
+    librerie, biblioteche = [], []
+    for i in range(inizio, fine):
+        if i < contesto['n_librerie']:
+            libreria_id = off['librerie'] + i + 1
+            for libro_id in _libri_popolari(rng, contesto, min(n_libri // 10, 2000)):
+                librerie.append((libreria_id, libro_id, rng.randint(0, 10), rng.randint(0, 5)))
+        if i < contesto['n_biblioteche']:
+            biblioteca_id = off['biblioteche'] + i + 1
+            for libro_id in _libri_popolari(rng, contesto, min(n_libri // 10, 1500)):
+                totali = rng.randint(1, 4)
+                biblioteche.append((biblioteca_id, libro_id, totali, rng.randint(0, totali)))
+    return [
+        ('inventario_librerie', ['libreria_id', 'libro_id', 'copie_nuove', 'copie_usate'], librerie),
+        ('inventario_biblioteche', ['biblioteca_id', 'libro_id', 'copie_totali', 'copie_disponibili'], biblioteche),
+    ]
+
+
+def genera_utenti(contesto, inizio, fine, rng):
+    """Utenti con indirizzo, metodo di pagamento e attività (salvati, prenotazioni, code, notifiche)"""
+    n = contesto['n']
+    off = contesto['offset']
+    ruoli = contesto['ruoli']
+    utenti, indirizzi, metodi, salvati = [], [], [], []
+    prenotazioni, attese, notifiche, richieste = [], [], [], []
+
+    def libro_popolare():
+        return off['libri'] + sparpaglia(zipf(rng, n['libri']), n['libri']) + 1
+
+    for i in range(inizio, fine):
+        utente_id = off['utenti'] + i + 1
+        nome, cognome = rng.choice(NOMI), rng.choice(COGNOMI)
+        tipo = rng.random()
+        biblioteca_id = libreria_id = None
+        if tipo < 0.01:
+            ruolo = 'bibliotecario'
+            biblioteca_id = off['biblioteche'] + rng.randrange(contesto['n_biblioteche']) + 1
+        elif tipo < 0.02:
+            ruolo = 'libraio'
+            libreria_id = off['librerie'] + rng.randrange(contesto['n_librerie']) + 1
+        else:
+            ruolo = 'utente'
+        registrazione = DATA_RIFERIMENTO - timedelta(days=rng.randrange(3 * 365), seconds=rng.randrange(86400))
+        utenti.append((utente_id, f"utente{utente_id}@esempio.it", f"utente{utente_id}", nome, cognome,
+                       contesto['password_hash'], ruoli[ruolo], biblioteca_id, libreria_id, registrazione))
+
+        # Un indirizzo e un metodo di pagamento per utente, con lo stesso indice dell'utente
+        citta_nome = f"Comune {off['citta'] + rng.randrange(n['citta']) + 1}"
+        indirizzi.append((off['indirizzi_utente'] + i + 1, utente_id, nome, cognome,
+                          f"Via {rng.choice(COGNOMI)} {rng.randint(1, 300)}", citta_nome,
+                          f"{rng.randint(10, 98)}{rng.randint(0, 999):03d}", rng.choice(REGIONI)[:2].upper(),
+                          None, True, registrazione))
+        metodi.append((off['metodi_pagamento'] + i + 1, utente_id,
+                       rng.choice(['carta_credito', 'carta_debito', 'paypal']),
+                       f"**** **** **** {rng.randint(0, 9999):04d}", DATA_RIFERIMENTO.date() + timedelta(days=rng.randint(30, 1500)),
+                       f"{nome} {cognome}", True, registrazione))
+
+        for libro_id in {libro_popolare() for _ in range(rng.choice([0, 0, 1, 2, 3, 5]))}:
+            salvati.append((utente_id, libro_id, registrazione + timedelta(days=rng.randrange(300))))
+
+        if rng.random() < 0.2:
+            for _ in range(rng.randint(1, 2)):
+                data = data_stagionale(rng)
+                stato = rng.choices(['attiva', 'completata', 'scaduta'], weights=[2, 6, 2])[0]
+                prenotazioni.append((utente_id, libro_popolare(), data, data + timedelta(days=7), stato))
+
+        if rng.random() < 0.05:
+            attese.append((utente_id, libro_popolare(), data_stagionale(rng), rng.randint(1, 5),
+                           rng.choices(['attiva', 'notificato', 'completata'], weights=[5, 2, 3])[0]))
+
+        for _ in range(rng.randint(0, 8)):
+            notifiche.append((utente_id, "Aggiornamento sul tuo account", rng.choice(['acquisto', 'prenotazione', 'generale']),
+                              rng.random() < 0.7, data_stagionale(rng)))
+
+        if ruolo == 'bibliotecario':
+            for _ in range(rng.randint(0, 10)):
+                data = data_stagionale(rng)
+                stato = rng.choice(['aperta', 'in_lavorazione', 'risolta', 'chiusa'])
+                richieste.append((utente_id, rng.choice(['prenotazione', 'lista_attesa', 'restituzione', 'altro']),
+                                  "Richiesta generata", rng.choice(['bassa', 'normale', 'alta', 'urgente']), stato, data,
+                                  data + timedelta(days=rng.randint(1, 20)) if stato in ('risolta', 'chiusa') else None))
+
+    return [
+        ('utenti', ['id', 'email', 'nome_utente', 'nome', 'cognome', 'password_hash', 'ruolo_id',
+                    'biblioteca_id', 'libreria_id', 'data_registrazione'], utenti),
+        ('indirizzi_utente', ['id', 'utente_id', 'nome', 'cognome', 'indirizzo', 'citta', 'cap', 'provincia',
+                              'telefono', 'is_default', 'data_creazione'], indirizzi),
+        ('metodi_pagamento', ['id', 'utente_id', 'tipo', 'numero_carta', 'scadenza', 'titolare',
+                              'is_default', 'data_creazione'], metodi),
+        ('libri_salvati', ['utente_id', 'libro_id', 'data_salvataggio'], salvati),
+        ('prenotazioni', ['utente_id', 'libro_id', 'data_prenotazione', 'data_scadenza', 'stato'], prenotazioni),
+        ('liste_attesa', ['utente_id', 'libro_id', 'data_richiesta', 'posizione', 'stato'], attese),
+        ('notifiche', ['utente_id', 'messaggio', 'tipo', 'letta', 'data_creazione'], notifiche),
+        ('richieste_bibliotecari', ['bibliotecario_id', 'tipo', 'descrizione', 'priorita', 'stato',
+                                    'data_creazione', 'data_risoluzione'], richieste),
+    ]
+
+
+def genera_acquisti(contesto, inizio, fine, rng):
+    """Acquisti stagionali con dettagli, consegne e recensioni; pochi utenti comprano molto"""
+    n = contesto['n']
+    off = contesto['offset']
+    acquisti, dettagli, consegne, feedback = [], [], [], []
+    for k in range(inizio, fine):
+        acquisto_id = off['acquisti'] + k + 1
+        j = sparpaglia(zipf(rng, n['utenti'], 0.9), n['utenti'])
+        utente_id = off['utenti'] + j + 1
+        libreria_id = off['librerie'] + rng.randrange(contesto['n_librerie']) + 1
+        data = data_stagionale(rng)
+        tipo_consegna = 'casa' if rng.random() < 0.6 else 'negozio'
+        stato = rng.choices(['in_attesa', 'confermato', 'spedito', 'consegnato', 'cancellato'],
+                            weights=[2, 3, 3, 20, 1])[0]
+
+        totale = 0
+        righe = {}
+        for _ in range(rng.choice([1, 1, 1, 2, 2, 3, 4])):
+            libro_id = off['libri'] + sparpaglia(zipf(rng, n['libri']), n['libri']) + 1
+            righe[libro_id] = 'nuovo' if rng.random() < 0.75 else 'usato'
+        for libro_id, condizione in righe.items():
+            quantita = 1 if rng.random() < 0.9 else 2
+            prezzo = prezzo_libro(libro_id) if condizione == 'nuovo' else round(prezzo_libro(libro_id) * 0.6, 2)
+            riga_totale = round(prezzo * quantita, 2)
+            totale += riga_totale
+            dettagli.append((acquisto_id, libro_id, libreria_id, quantita, condizione, prezzo, riga_totale))
+
+        prevista = data + timedelta(days=rng.randint(2, 7))
+        acquisti.append((acquisto_id, utente_id, libreria_id,
+                         off['indirizzi_utente'] + j + 1 if tipo_consegna == 'casa' else None,
+                         off['metodi_pagamento'] + j + 1, round(totale, 2), stato, tipo_consegna, data, prevista,
+                         prevista if stato == 'consegnato' else None))
+
+        if tipo_consegna == 'casa' and stato in ('spedito', 'consegnato'):
+            consegne.append((acquisto_id, rng.choice(['BRT', 'GLS', 'SDA', 'Poste Italiane']), f"TRK{acquisto_id:012d}",
+                             'consegnato' if stato == 'consegnato' else 'in_transito',
+                             data + timedelta(days=1), prevista, prevista if stato == 'consegnato' else None))
+
+        if stato == 'consegnato' and rng.random() < 0.1:
+            libro_id = next(iter(righe))
+            feedback.append((utente_id, libro_id, acquisto_id, rng.choices([1, 2, 3, 4, 5], weights=[1, 1, 2, 4, 6])[0],
+                             "Recensione generata", rng.randint(0, 20), rng.randint(0, 5),
+                             prevista + timedelta(days=rng.randint(1, 60)), rng.random() < 0.02))
+
+    return [
+        ('acquisti', ['id', 'utente_id', 'libreria_id', 'indirizzo_consegna_id', 'metodo_pagamento_id', 'totale',
+                      'stato', 'tipo_consegna', 'data_acquisto', 'data_consegna_prevista',
+                      'data_consegna_effettiva'], acquisti),
+        ('dettagli_acquisto', ['acquisto_id', 'libro_id', 'libreria_id', 'quantita', 'condizione',
+                               'prezzo_unitario', 'totale'], dettagli),
+        ('consegne', ['acquisto_id', 'corriere', 'numero_tracking', 'stato', 'data_spedizione',
+                      'data_consegna_prevista', 'data_consegna_effettiva'], consegne),
+        ('feedback_libri', ['utente_id', 'libro_id', 'acquisto_id', 'valutazione', 'commento', 'utile',
+                            'non_utile', 'data_recensione', 'moderato'], feedback),
+    ]
+
+
+# Fasi eseguite in sequenza per rispettare le chiavi esterne; i blocchi di una fase vanno in parallelo
+FASI = [
+    ('base', genera_base, None, None),
+    ('libri', genera_libri, 'libri', BLOCCO_LIBRI),
+    ('inventari', genera_inventari, 'strutture', BLOCCO_STRUTTURE),
+    ('utenti', genera_utenti, 'utenti', BLOCCO_UTENTI),
+    ('acquisti', genera_acquisti, 'acquisti', BLOCCO_ACQUISTI),
+]
+
+# Tabelle con il trigger che registra le modifiche per la cache del catalogo dei client
+TABELLE_CATALOGO = ['libri', 'libri_disponibili', 'libri_prestati', 'inventario_librerie']
+
+# Tabelle con id assegnati dal generatore (le altre usano la sequenza)
+TABELLE_CON_ID = ['citta', 'biblioteche', 'librerie', 'autori', 'libri', 'utenti',
+                  'indirizzi_utente', 'metodi_pagamento', 'acquisti']
+
+
+def carica_blocco(compito):
+    """Genera un blocco e lo carica con COPY in una propria connessione e transazione"""
+    dsn, contesto, nome_fase, blocco, inizio, fine = compito
+    generatore = next(fase[1] for fase in FASI if fase[0] == nome_fase)
+    rng = _rng(contesto, nome_fase, blocco)
+    conn = psycopg2.connect(dsn)
+    try:
+        cursor = conn.cursor()
+        # I dati sono rigenerabili: non serve attendere il flush del WAL a ogni commit
+        cursor.execute("SET synchronous_commit = off")
+        caricate = {}
+        for tabella, colonne, righe in generatore(contesto, inizio, fine, rng):
+            caricate[tabella] = copia_righe(cursor, tabella, colonne, righe)
+        conn.commit()
+        cursor.close()
+        return caricate
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def prepara_contesto(conn, scala, seme):
+    """Legge offset degli id, ruoli e generi: i blocchi non devono interrogare il database"""
+    cursor = conn.cursor()
+    offset = {}
+    for tabella in TABELLE_CON_ID:
+        cursor.execute(f"SELECT COALESCE(MAX(id), 0) FROM {tabella}")
+        offset[tabella] = cursor.fetchone()[0]
+
+    for genere in GENERI:
+        cursor.execute("INSERT INTO generi (nome) VALUES (%s) ON CONFLICT (nome) DO NOTHING", (genere,))
+    cursor.execute("SELECT id FROM generi WHERE nome = ANY(%s) ORDER BY id", (GENERI,))
+    generi = [row[0] for row in cursor.fetchall()]
+    cursor.execute("SELECT nome, id FROM ruoli")
+    ruoli = dict(cursor.fetchall())
+    conn.commit()
+    cursor.close()
+
+    n = conteggi(scala)
+    return {
+        'seme': seme,
+        'n': n,
+        'n_biblioteche': n['citta'] * 2,
+        'n_librerie': n['citta'] * 3,
+        'offset': offset,
+        'generi': generi,
+        'ruoli': ruoli,
+        # Tutti gli utenti generati hanno password "password123"
+        'password_hash': hashlib.sha256("password123".encode()).hexdigest(),
+    }
+
+
+def compiti_fase(dsn, contesto, nome_fase, entita, dimensione):
+    """Suddivide una fase in blocchi di righe principali"""
+    if entita is None:
+        return [(dsn, contesto, nome_fase, 0, 0, 1)]
+    if entita == 'strutture':
+        totale = max(contesto['n_librerie'], contesto['n_biblioteche'])
+    else:
+        totale = contesto['n'][entita]
+    return [(dsn, contesto, nome_fase, blocco, inizio, min(inizio + dimensione, totale))
+            for blocco, inizio in enumerate(range(0, totale, dimensione))]
+
+
+def genera(dsn, scala, seme=42, processi=None):
+    """Popola il database al fattore di scala indicato e restituisce le righe caricate per tabella"""
+    conn = psycopg2.connect(dsn)
+    applica_migrazioni(conn)
+    contesto = prepara_contesto(conn, scala, seme)
+    cursor = conn.cursor()
+
+    # Il vettore di ricerca si calcola alla fine con un solo UPDATE invece che riga per riga,
+    # e al posto del registro delle modifiche riga per riga i client ricevono un'unica
+    # richiesta di ricaricare il catalogo
+    cursor.execute("ALTER TABLE libri DISABLE TRIGGER trg_libri_ricerca")
+    for tabella in TABELLE_CATALOGO:
+        cursor.execute(f"ALTER TABLE {tabella} DISABLE TRIGGER trg_{tabella}_catalogo")
+    conn.commit()
+
+    totali = {}
+    try:
+        with Pool(processi or os.cpu_count()) as pool:
+            for nome_fase, _, entita, dimensione in FASI:
+                inizio = time.perf_counter()
+                compiti = compiti_fase(dsn, contesto, nome_fase, entita, dimensione)
+                for caricate in pool.imap_unordered(carica_blocco, compiti):
+                    for tabella, righe in caricate.items():
+                        totali[tabella] = totali.get(tabella, 0) + righe
+                print(f"Fase {nome_fase}: {len(compiti)} blocchi in {time.perf_counter() - inizio:.1f}s")
+
+        inizio = time.perf_counter()
+        cursor.execute('''UPDATE libri l SET ricerca_tsv =
+                            setweight(to_tsvector('italiano_unaccent', coalesce(l.titolo, '')), 'A') ||
+                            setweight(to_tsvector('italiano_unaccent', coalesce(a.nome, '')), 'B') ||
+                            setweight(to_tsvector('italiano_unaccent', coalesce(g.nome, '')), 'C') ||
+                            setweight(to_tsvector('italiano_unaccent', coalesce(l.descrizione, '')), 'D')
+                        FROM autori a, generi g
+                        WHERE a.id = l.autore_id AND g.id = l.genere_id AND l.id > %s''',
+                       (contesto['offset']['libri'],))
+        print(f"Indice di ricerca aggiornato in {time.perf_counter() - inizio:.1f}s")
+    finally:
+        cursor.execute("ALTER TABLE libri ENABLE TRIGGER trg_libri_ricerca")
+        for tabella in TABELLE_CATALOGO:
+            cursor.execute(f"ALTER TABLE {tabella} ENABLE TRIGGER trg_{tabella}_catalogo")
+        cursor.execute("INSERT INTO modifiche_catalogo (libro_id) VALUES (NULL)")
+        cursor.execute("NOTIFY catalogo")
+        conn.commit()
+
+    # Le sequenze devono ripartire dopo gli id assegnati esplicitamente
+    for tabella in TABELLE_CON_ID:
+        cursor.execute(f"SELECT setval(pg_get_serial_sequence('{tabella}', 'id'), "
+                       f"(SELECT GREATEST(MAX(id), 1) FROM {tabella}))")
+    conn.commit()
+
+    conn.autocommit = True
+    cursor.execute("ANALYZE")
+    cursor.close()
+    conn.close()
+    return totali
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Genera dati sintetici a fattore di scala")
+    parser.add_argument('--scala', type=float, default=1, help="fattore di scala (1 = 10.000 libri)")
+    parser.add_argument('--seme', type=int, default=42, help="seme per la generazione deterministica")
+    parser.add_argument('--processi', type=int, default=None, help="processi paralleli (default: numero di CPU)")
+    parser.add_argument('--dsn', default=os.environ.get('BIBLIOTECA_DSN', DSN_PREDEFINITO))
+    args = parser.parse_args()
+
+    print(f"=== GENERAZIONE DATI SF{args.scala:g} (seme {args.seme}) ===")
+    inizio = time.perf_counter()
+    totali = genera(args.dsn, args.scala, args.seme, args.processi)
+    for tabella, righe in sorted(totali.items()):
+        print(f"- {tabella}: {righe} righe")
+    print(f"Completato in {time.perf_counter() - inizio:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
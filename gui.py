@@ -4,23 +4,49 @@ Modulo per l'interfaccia grafica dell'applicazione biblioteca
 
 from PyQt5.QtWidgets import (
     QApplication, QWidget, QVBoxLayout, QHBoxLayout, QLabel, QPushButton,
-    QLineEdit, QComboBox, QDialog, QDialogButtonBox, QTextEdit, QTableWidget,
-    QTableWidgetItem, QScrollArea, QGridLayout, QFormLayout, QStackedWidget,
-    QMenu, QMessageBox, QInputDialog, QHeaderView, QCheckBox, QSpinBox,
-    QGroupBox, QRadioButton, QButtonGroup
+    QLineEdit, QComboBox, QDialog, QDialogButtonBox, QTextEdit, QScrollArea,
+    QGridLayout, QFormLayout, QStackedWidget, QMenu, QMessageBox, QInputDialog,
+    QHeaderView, QCheckBox, QGroupBox, QRadioButton, QButtonGroup, QListView, QAbstractItemView, QTableView, QCompleter
 )
-from PyQt5.QtCore import Qt, QTimer
+from PyQt5.QtCore import Qt, QTimer, QStringListModel
 from PyQt5.QtGui import QFont, QPalette, QColor, QPixmap, QIcon
 import sys
 import hashlib
+import threading
 
-from database import DatabaseManager
+from database import (
+    DatabaseManager, Annullamento, QueryAnnullata, FASCE_PREZZO, CANALE_CATALOGO, CANALE_RIFERIMENTO
+)
+from esecutore_db import EsecutoreDatabase, AscoltatoreNotifiche
+from cache_catalogo import CacheCatalogo
+from cache_ricerche import testo_libro
+from modelli_gui import ModelloRisultati, DelegatoLibro, ModelloLibri, ModelloCatalogo
 from models import Libro
+from suggerimenti import MotoreSuggerimenti
 from utils import (
     get_input_stylesheet, get_combobox_stylesheet,
     get_primary_button_stylesheet, get_secondary_button_stylesheet
 )
 
+# Numero di libri caricati per ogni pagina dei risultati di ricerca: la vista
+# ne chiede un'altra quando si scorre fino in fondo
+RISULTATI_PER_PAGINA = 50
+
+# Ricerca mentre si digita: pausa dopo l'ultimo tasto e lunghezza minima del testo
+RITARDO_RICERCA_MS = 150
+MIN_CARATTERI_RICERCA = 3
+
+# Suggerimenti mostrati sotto la casella di ricerca e intervallo di aggiornamento dei pesi
+NUMERO_SUGGERIMENTI = 8
+AGGIORNAMENTO_SUGGERIMENTI_MS = 60000
+
+# Cache del catalogo: attesa per raggruppare le notifiche ravvicinate e controllo
+# periodico, utile se la connessione in ascolto non è disponibile
+RITARDO_NOTIFICHE_CATALOGO_MS = 200
+AGGIORNAMENTO_CATALOGO_MS = 60000
+# Intervallo tra le potature del registro delle modifiche al catalogo
+POTATURA_CATALOGO_MS = 3600000
+
 
 class ResultDialog(QDialog):
     """Dialog per mostrare risultati di operazioni"""
@@ -41,20 +67,11 @@ class ResultDialog(QDialog):
 
         # Contenuto
         if isinstance(content, list) and content and isinstance(content[0], Libro):
-            # Mostra in tabella
-            table = QTableWidget()
-            table.setColumnCount(7)
-            table.setHorizontalHeaderLabels(['Titolo', 'Autore', 'Genere', 'Anno Pubblicazione', 'Numero Pagine', 'Prezzo', 'Disponibile'])
+            # Mostra in tabella: il modello formatta solo le celle visibili
+            table = QTableView()
+            table.setModel(ModelloLibri(content, table))
             table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
-            table.setRowCount(len(content))
-            for row, libro in enumerate(content):
-                table.setItem(row, 0, QTableWidgetItem(libro.titolo))
-                table.setItem(row, 1, QTableWidgetItem(libro.autore))
-                table.setItem(row, 2, QTableWidgetItem(libro.genere))
-                table.setItem(row, 3, QTableWidgetItem(str(libro.anno_pubblicazione)))
-                table.setItem(row, 4, QTableWidgetItem(str(libro.numero_pagine)))
-                table.setItem(row, 5, QTableWidgetItem(f"€{libro.prezzo:.2f}"))
-                table.setItem(row, 6, QTableWidgetItem('Sì' if libro.disponibile else 'No'))
+            table.verticalHeader().hide()
             layout.addWidget(table)
         else:
             # Mostra come testo
@@ -72,6 +89,72 @@ class ResultDialog(QDialog):
         self.setLayout(layout)
 
 
+class CatalogoDialog(QDialog):
+    """Dialog con il catalogo completo, caricato a blocchi mentre si scorre"""
+
+    def __init__(self, db, esecutore, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle('Catalogo della Biblioteca')
+        self.setModal(True)
+        self.resize(900, 600)
+
+        layout = QVBoxLayout()
+
+        title_label = QLabel('Catalogo della Biblioteca')
+        title_label.setFont(QFont('Helvetica Neue', 20, QFont.Bold))
+        title_label.setAlignment(Qt.AlignCenter)
+        layout.addWidget(title_label)
+
+        # Filtro applicato da PostgreSQL, dopo una breve pausa nella digitazione
+        self.filtro_edit = QLineEdit()
+        self.filtro_edit.setPlaceholderText('Filtra per titolo, autore o genere...')
+        self.filtro_edit.setStyleSheet(get_input_stylesheet())
+        layout.addWidget(self.filtro_edit)
+
+        self.timer_filtro = QTimer(self)
+        self.timer_filtro.setSingleShot(True)
+        self.timer_filtro.setInterval(300)
+        self.filtro_edit.textChanged.connect(self.timer_filtro.start)
+
+        self.modello = ModelloCatalogo(db, esecutore, parent=self)
+        self.timer_filtro.timeout.connect(lambda: self.modello.imposta_filtro(self.filtro_edit.text()))
+        self.modello.caricamento.connect(self.aggiorna_stato)
+        self.modello.errore.connect(
+            lambda e: QMessageBox.critical(self, 'Errore', f"Si è verificato un errore: {str(e)}"))
+
+        # Il clic sulle intestazioni riordina il catalogo con ORDER BY
+        self.tabella = QTableView()
+        self.tabella.setModel(self.modello)
+        self.tabella.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        self.tabella.verticalHeader().hide()
+        self.tabella.horizontalHeader().setSortIndicator(0, Qt.AscendingOrder)
+        self.tabella.setSortingEnabled(True)  # apre il cursore con l'ordinamento iniziale
+        layout.addWidget(self.tabella)
+
+        self.stato_label = QLabel()
+        self.stato_label.setStyleSheet("color: #86868b;")
+        layout.addWidget(self.stato_label)
+
+        close_btn = QPushButton('Chiudi')
+        close_btn.clicked.connect(self.accept)
+        layout.addWidget(close_btn, alignment=Qt.AlignCenter)
+
+        self.setLayout(layout)
+
+    def aggiorna_stato(self, in_caricamento):
+        righe = self.modello.rowCount()
+        if in_caricamento:
+            self.stato_label.setText(f"⏳ Caricamento... ({righe} libri)")
+        else:
+            self.stato_label.setText(f"{righe} libri caricati" +
+                                     ("" if self.modello.canFetchMore() else " (catalogo completo)"))
+
+    def done(self, risultato):
+        self.timer_filtro.stop()
+        self.modello.chiudi()
+        super().done(risultato)
+
+
 class AddBookDialog(QDialog):
     """Dialog per aggiungere un nuovo libro"""
 
@@ -165,13 +248,49 @@ class BibliotecaGUI(QWidget):
 
     def __init__(self):
         super().__init__()
-        self.db = DatabaseManager()
+        # Pool di connessioni: le chiamate al database avvengono in thread di lavoro
+        self.db = DatabaseManager(pool_min=1, pool_max=4)
+        self.esecutore = EsecutoreDatabase(self, max_thread=4)
+        self.esecutore.occupato.connect(self.on_db_occupato)
         self.current_user = None  # Utente attualmente loggato
         self.current_role = None  # Ruolo attualmente selezionato
-        self.libri = []  # Cache dei libri
+        self.catalogo = CacheCatalogo()  # Copia locale del catalogo, aggiornata con i delta
+        self.ascoltatore_notifiche = None  # Riceve le NOTIFY delle modifiche a catalogo e strutture
         self.carrello = []  # Carrello acquisti
+        self.search_annullamento = None  # Permette di interrompere la ricerca in corso
+        self.search_query = ''  # Ricerca corrente
+        self.search_modalita = 'testo'
+        self.search_struttura = (None, None)  # (tipo, id) della struttura in cui si cerca
+        self.search_filtri = {}  # Filtri per faccetta della ricerca corrente
+        self.search_offset = 0  # Libri della ricerca corrente già mostrati
+        self.motore_suggerimenti = None  # Indice in memoria per l'autocompletamento
         self.initUI()
 
+        # L'indice dei suggerimenti viene costruito in background e poi aggiornato con i delta
+        self.carica_suggerimenti()
+        self.timer_suggerimenti = QTimer(self)
+        self.timer_suggerimenti.setInterval(AGGIORNAMENTO_SUGGERIMENTI_MS)
+        self.timer_suggerimenti.timeout.connect(self.aggiorna_suggerimenti_popolarita)
+        self.timer_suggerimenti.start()
+
+        # Il catalogo viene caricato una volta; poi si leggono solo le modifiche
+        # segnalate dalle NOTIFY, raggruppando quelle ravvicinate
+        self.timer_notifiche_catalogo = QTimer(self)
+        self.timer_notifiche_catalogo.setSingleShot(True)
+        self.timer_notifiche_catalogo.setInterval(RITARDO_NOTIFICHE_CATALOGO_MS)
+        self.timer_notifiche_catalogo.timeout.connect(self.aggiorna_catalogo)
+        self.timer_catalogo = QTimer(self)
+        self.timer_catalogo.setInterval(AGGIORNAMENTO_CATALOGO_MS)
+        self.timer_catalogo.timeout.connect(self.aggiorna_catalogo)
+        self.timer_catalogo.start()
+        self.timer_potatura_catalogo = QTimer(self)
+        self.timer_potatura_catalogo.setInterval(POTATURA_CATALOGO_MS)
+        self.timer_potatura_catalogo.timeout.connect(self.pota_registro_catalogo)
+        self.timer_potatura_catalogo.start()
+        self.avvia_ascolto_notifiche()
+        self.carica_catalogo()
+        self.pota_registro_catalogo()
+
     def initUI(self):
         """Inizializza l'interfaccia utente"""
         self.setWindowTitle('Gestione Biblioteca')
@@ -250,6 +369,42 @@ class BibliotecaGUI(QWidget):
             }
         """)
 
+    def esegui_db(self, funzione, *args, al_termine=None, chiave=None, **kwargs):
+        """Esegue una chiamata al database in un thread di lavoro.
+
+        al_termine riceve il risultato nel thread dell'interfaccia; con una chiave,
+        una nuova richiesta rende obsoleto il risultato di quella precedente.
+        """
+        return self.esecutore.esegui(funzione, *args, al_termine=al_termine,
+                                     in_errore=self.mostra_errore_db, chiave=chiave, **kwargs)
+
+    def carica_riferimento(self, funzione, *args, al_termine, chiave):
+        """Legge città o strutture: subito dalla memoria se aggiornate, altrimenti in background"""
+        if self.db.riferimento_in_memoria():
+            # Scarta un'eventuale richiesta precedente ancora in corso
+            self.esecutore.annulla(chiave)
+            al_termine(funzione(*args))
+        else:
+            self.esegui_db(funzione, *args, al_termine=al_termine, chiave=chiave)
+
+    def mostra_errore_db(self, errore):
+        """Mostra un errore sollevato da una chiamata al database"""
+        QMessageBox.critical(self, 'Errore', f'Errore durante l\'operazione sul database:\n{errore}')
+
+    def on_db_occupato(self, occupato):
+        """Indica con il cursore che ci sono operazioni sul database in corso"""
+        if occupato:
+            QApplication.setOverrideCursor(Qt.BusyCursor)
+        else:
+            QApplication.restoreOverrideCursor()
+
+    def closeEvent(self, event):
+        """Attende le operazioni sul database ancora in corso prima di chiudere"""
+        if self.ascoltatore_notifiche is not None:
+            self.ascoltatore_notifiche.chiudi()
+        self.esecutore.attendi(5000)
+        super().closeEvent(event)
+
     def create_welcome_page(self):
         """Crea la pagina di benvenuto"""
         welcome_widget = QWidget()
@@ -531,8 +686,10 @@ class BibliotecaGUI(QWidget):
             QMessageBox.warning(self, 'Errore', 'Inserisci email/nome utente e password.')
             return
 
-        user = self.db.login(username, password)
+        self.esegui_db(self.db.login, username, password, al_termine=self.on_login_completato, chiave='login')
 
+    def on_login_completato(self, user):
+        """Riceve l'esito del login dal thread del database"""
         if user:
             self.current_user = user
             QMessageBox.information(self, 'Successo', f"Benvenuto {user['nome']} {user['cognome']}!")
@@ -815,13 +972,10 @@ class BibliotecaGUI(QWidget):
             self.register_citta_combo.show()
 
             # Popola il combo città
-            citta = self.db.get_citta()
             self.register_citta_combo.clear()
-            if citta:
-                for c in citta:
-                    self.register_citta_combo.addItem(f"{c[1]} ({c[2]})", c[0])  # ID come data, "Nome (Regione)" come testo
-            else:
-                self.register_citta_combo.addItem('Nessuna città disponibile', None)
+            self.register_citta_combo.addItem('⏳ Caricamento città...', None)
+            self.carica_riferimento(self.db.get_citta, al_termine=self.on_register_citta_caricate,
+                                    chiave='register_citta')
 
             # Nascondi il combo struttura fino a quando non viene selezionata una città
             self.register_struttura_label.hide()
@@ -833,6 +987,15 @@ class BibliotecaGUI(QWidget):
             self.register_struttura_label.hide()
             self.register_struttura_combo.hide()
 
+    def on_register_citta_caricate(self, citta):
+        """Popola il combo città della registrazione"""
+        self.register_citta_combo.clear()
+        if citta:
+            for c in citta:
+                self.register_citta_combo.addItem(f"{c[1]} ({c[2]})", c[0])  # ID come data, "Nome (Regione)" come testo
+        else:
+            self.register_citta_combo.addItem('Nessuna città disponibile', None)
+
     def on_citta_changed(self, citta_text):
         """Gestisce il cambio di città nella registrazione"""
         citta_id = self.register_citta_combo.currentData()
@@ -841,24 +1004,31 @@ class BibliotecaGUI(QWidget):
         if citta_id is not None and role in ['🏛️ Bibliotecario', '📚 Libraio']:
             if role == '🏛️ Bibliotecario':
                 self.register_struttura_label.setText('Biblioteca di riferimento')
-                strutture = self.db.get_biblioteche_by_citta(citta_id)
+                carica_strutture = self.db.get_biblioteche_by_citta
             else:  # Libraio
                 self.register_struttura_label.setText('Libreria di riferimento')
-                strutture = self.db.get_librerie_by_citta(citta_id)
+                carica_strutture = self.db.get_librerie_by_citta
 
             self.register_struttura_combo.clear()
-            if strutture:
-                for struttura in strutture:
-                    self.register_struttura_combo.addItem(struttura[1], struttura[0])
-            else:
-                self.register_struttura_combo.addItem('Nessuna struttura disponibile in questa città', None)
-
+            self.register_struttura_combo.addItem('⏳ Caricamento...', None)
             self.register_struttura_label.show()
             self.register_struttura_combo.show()
+            self.carica_riferimento(carica_strutture, citta_id, al_termine=self.on_register_strutture_caricate,
+                                    chiave='register_strutture')
         else:
+            self.esecutore.annulla('register_strutture')
             self.register_struttura_label.hide()
             self.register_struttura_combo.hide()
 
+    def on_register_strutture_caricate(self, strutture):
+        """Popola il combo delle strutture della città scelta nella registrazione"""
+        self.register_struttura_combo.clear()
+        if strutture:
+            for struttura in strutture:
+                self.register_struttura_combo.addItem(struttura[1], struttura[0])
+        else:
+            self.register_struttura_combo.addItem('Nessuna struttura disponibile in questa città', None)
+
     def show_register_page(self):
         """Mostra la pagina di registrazione"""
         role_names = {
@@ -937,10 +1107,12 @@ class BibliotecaGUI(QWidget):
             struttura_id = struttura_selezionata
 
         # Effettua la registrazione
-        success, message = self.db.registra_utente(
-            email, username, nome, cognome, password, ruolo, struttura_id
-        )
+        self.esegui_db(self.db.registra_utente, email, username, nome, cognome, password, ruolo, struttura_id,
+                       al_termine=self.on_registrazione_completata, chiave='registrazione')
 
+    def on_registrazione_completata(self, esito):
+        """Riceve l'esito della registrazione dal thread del database"""
+        success, message = esito
         if success:
             QMessageBox.information(self, 'Successo', message)
             # Torna alla pagina di login
@@ -1064,6 +1236,27 @@ class BibliotecaGUI(QWidget):
         structure_layout.addStretch()
         search_layout.addLayout(structure_layout)
 
+        # Modalità di ricerca
+        mode_layout = QHBoxLayout()
+        mode_layout.setSpacing(15)
+
+        mode_label = QLabel('Modalità:')
+        mode_label.setFont(QFont('SF Pro Text', 16, QFont.Medium))
+        mode_label.setStyleSheet("color: #1d1d1f; background: transparent;")
+        mode_layout.addWidget(mode_label)
+
+        self.search_mode_combo = QComboBox()
+        self.search_mode_combo.addItem('🔤 Contiene il testo', 'testo')
+        self.search_mode_combo.addItem('📝 Parole (anche descrizione)', 'fulltext')
+        self.search_mode_combo.addItem('🪄 Tollerante agli errori', 'fuzzy')
+        self.search_mode_combo.setFont(QFont('SF Pro Text', 16))
+        self.search_mode_combo.setMinimumHeight(44)
+        self.search_mode_combo.setStyleSheet(get_combobox_stylesheet())
+        mode_layout.addWidget(self.search_mode_combo)
+
+        mode_layout.addStretch()
+        search_layout.addLayout(mode_layout)
+
         # Barra di ricerca
         search_bar_layout = QVBoxLayout()
         search_bar_layout.setSpacing(10)
@@ -1097,6 +1290,21 @@ class BibliotecaGUI(QWidget):
             }
         """)
         self.search_input.returnPressed.connect(self.perform_search)
+
+        # Ricerca mentre si digita: parte quando l'utente fa una breve pausa
+        self.timer_ricerca = QTimer(self)
+        self.timer_ricerca.setSingleShot(True)
+        self.timer_ricerca.setInterval(RITARDO_RICERCA_MS)
+        self.timer_ricerca.timeout.connect(self.ricerca_mentre_scrivi)
+        self.search_input.textEdited.connect(self.timer_ricerca.start)
+
+        # Autocompletamento: le voci vengono dal motore in memoria, senza query per tasto
+        self.suggerimenti_model = QStringListModel(self)
+        self.completer = QCompleter(self.suggerimenti_model, self)
+        self.completer.setCompletionMode(QCompleter.UnfilteredPopupCompletion)
+        self.completer.setWidget(self.search_input)
+        self.completer.activated[str].connect(self.on_suggerimento_scelto)
+        self.search_input.textEdited.connect(self.mostra_suggerimenti)
         search_input_layout.addWidget(self.search_input)
 
         search_btn = QPushButton('🔍 Cerca')
@@ -1120,10 +1328,53 @@ class BibliotecaGUI(QWidget):
         results_layout = QVBoxLayout()
         results_layout.setContentsMargins(15, 15, 15, 15)
 
-        self.results_scroll = QScrollArea()
-        self.results_scroll.setWidgetResizable(True)
-        self.results_scroll.setStyleSheet("""
-            QScrollArea {
+        # Filtri per faccetta: le voci mostrano quanti libri restano scegliendole
+        filtri_layout = QHBoxLayout()
+        filtri_layout.setSpacing(10)
+
+        self.filtro_genere_combo = QComboBox()
+        self.filtro_decennio_combo = QComboBox()
+        self.filtro_prezzo_combo = QComboBox()
+        for combo in (self.filtro_genere_combo, self.filtro_decennio_combo, self.filtro_prezzo_combo):
+            combo.setFont(QFont('SF Pro Text', 14))
+            combo.setMinimumHeight(36)
+            combo.setStyleSheet(get_combobox_stylesheet())
+            combo.activated.connect(self.applica_filtri_ricerca)
+            filtri_layout.addWidget(combo)
+
+        self.filtro_disponibili_check = QCheckBox('Disponibili ora')
+        self.filtro_disponibili_check.setFont(QFont('SF Pro Text', 14))
+        self.filtro_disponibili_check.setStyleSheet("color: #1d1d1f; background: transparent;")
+        self.filtro_disponibili_check.clicked.connect(self.applica_filtri_ricerca)
+        filtri_layout.addWidget(self.filtro_disponibili_check)
+        filtri_layout.addStretch()
+        results_layout.addLayout(filtri_layout)
+        self.aggiorna_faccette(None)
+
+        # Stato della ricerca (caricamento, nessun risultato, errori)
+        self.search_status_label = QLabel()
+        self.search_status_label.setFont(QFont('SF Pro Text', 16))
+        self.search_status_label.setAlignment(Qt.AlignCenter)
+        self.search_status_label.hide()
+        results_layout.addWidget(self.search_status_label)
+
+        # Vista virtualizzata: le card vengono disegnate solo per le righe visibili
+        # e le pagine successive vengono richieste quando si arriva in fondo
+        self.results_model = ModelloRisultati(self)
+        self.results_model.richiedi_pagina.connect(self.carica_pagina_risultati)
+        self.results_delegate = DelegatoLibro(self)
+        self.results_delegate.aggiungi_al_carrello.connect(self.aggiungi_al_carrello)
+
+        self.results_view = QListView()
+        self.results_view.setModel(self.results_model)
+        self.results_view.setItemDelegate(self.results_delegate)
+        self.results_view.setUniformItemSizes(True)
+        self.results_view.setMouseTracking(True)
+        self.results_view.setVerticalScrollMode(QAbstractItemView.ScrollPerPixel)
+        self.results_view.setEditTriggers(QAbstractItemView.CurrentChanged | QAbstractItemView.SelectedClicked)
+        self.results_view.setMinimumHeight(400)
+        self.results_view.setStyleSheet("""
+            QListView {
                 border: none;
                 background: transparent;
             }
@@ -1141,13 +1392,7 @@ class BibliotecaGUI(QWidget):
                 background: #a0a0a0;
             }
         """)
-
-        self.results_widget = QWidget()
-        self.results_layout = QVBoxLayout(self.results_widget)
-        self.results_layout.setSpacing(15)  # Maggiore spaziatura per migliore visualizzazione
-
-        self.results_scroll.setWidget(self.results_widget)
-        results_layout.addWidget(self.results_scroll)
+        results_layout.addWidget(self.results_view)
 
         self.results_container.setLayout(results_layout)
         layout.addWidget(self.results_section)
@@ -1183,7 +1428,10 @@ class BibliotecaGUI(QWidget):
 
     def populate_search_citta(self):
         """Popola il combo delle città per la ricerca"""
-        citta = self.db.get_citta()
+        self.carica_riferimento(self.db.get_citta, al_termine=self.on_search_citta_caricate, chiave='search_citta')
+
+    def on_search_citta_caricate(self, citta):
+        """Riempie il combo delle città per la ricerca"""
         self.search_citta_combo.clear()
         if citta:
             for c in citta:
@@ -1199,21 +1447,29 @@ class BibliotecaGUI(QWidget):
         if citta_id is not None:
             if search_type == '🏛️ Biblioteca':
                 self.structure_label.setText('Biblioteca:')
-                strutture = self.db.get_biblioteche_by_citta(citta_id)
+                carica_strutture = self.db.get_biblioteche_by_citta
             else:  # Libreria
                 self.structure_label.setText('Libreria:')
-                strutture = self.db.get_librerie_by_citta(citta_id)
+                carica_strutture = self.db.get_librerie_by_citta
 
             self.search_structure_combo.clear()
-            if strutture:
-                for struttura in strutture:
-                    self.search_structure_combo.addItem(struttura[1], struttura[0])
-            else:
-                self.search_structure_combo.addItem('Nessuna struttura disponibile in questa città', None)
+            self.search_structure_combo.addItem('⏳ Caricamento...', None)
+            self.carica_riferimento(carica_strutture, citta_id, al_termine=self.on_search_strutture_caricate,
+                                    chiave='search_strutture')
         else:
+            self.esecutore.annulla('search_strutture')
             self.search_structure_combo.clear()
             self.search_structure_combo.addItem('Seleziona prima una città', None)
 
+    def on_search_strutture_caricate(self, strutture):
+        """Riempie il combo delle strutture della città selezionata"""
+        self.search_structure_combo.clear()
+        if strutture:
+            for struttura in strutture:
+                self.search_structure_combo.addItem(struttura[1], struttura[0])
+        else:
+            self.search_structure_combo.addItem('Nessuna struttura disponibile in questa città', None)
+
     def on_search_type_changed(self, search_type):
         """Aggiorna la selezione struttura quando cambia il tipo"""
         # Questo metodo ora viene chiamato da on_search_citta_changed
@@ -1221,6 +1477,7 @@ class BibliotecaGUI(QWidget):
 
     def perform_search(self):
         """Esegue la ricerca dei libri"""
+        self.timer_ricerca.stop()
         query = self.search_input.text().strip()
         if not query:
             QMessageBox.warning(self, 'Ricerca vuota', 'Inserisci un termine di ricerca.')
@@ -1231,248 +1488,251 @@ class BibliotecaGUI(QWidget):
             QMessageBox.warning(self, 'Struttura non selezionata', 'Seleziona una struttura valida.')
             return
 
-        # Qui dovrei implementare la ricerca nel database
-        # Per ora mostro un messaggio di placeholder
-        self.show_search_results(query, struttura_id)
+        tipo_struttura = 'biblioteca' if self.search_type_combo.currentText() == '🏛️ Biblioteca' else 'libreria'
+        self.show_search_results(query, struttura_id, tipo_struttura)
 
-    def show_search_results(self, query, struttura_id):
-        """Mostra i risultati della ricerca"""
-        # Pulisci risultati precedenti
-        for i in reversed(range(self.results_layout.count())):
-            widget = self.results_layout.itemAt(i).widget()
-            if widget:
-                widget.setParent(None)
+    def carica_suggerimenti(self):
+        """Costruisce in background l'indice dei suggerimenti"""
+        def costruisci():
+            return MotoreSuggerimenti(*self.db.carica_suggerimenti())
 
-        # Carica libri dal database invece di usare mock data
-        try:
-            libri = self.db.load_libri()
-            # Filtra libri per query se presente
-            if query:
-                libri_filtrati = []
-                query_lower = query.lower()
-                for libro in libri:
-                    if (query_lower in libro.titolo.lower() or
-                        query_lower in libro.autore.lower() or
-                        query_lower in libro.genere.lower()):
-                        libri_filtrati.append(libro)
-                libri = libri_filtrati
-
-            if not libri:
-                no_results_label = QLabel("Nessun libro trovato per la ricerca effettuata.")
-                no_results_label.setFont(QFont('SF Pro Text', 16))
-                no_results_label.setStyleSheet("color: #86868b; text-align: center;")
-                no_results_label.setAlignment(Qt.AlignCenter)
-                self.results_layout.addWidget(no_results_label)
-            else:
-                for libro in libri:
-                    book_card = self.create_purchase_book_card(libro)
-                    self.results_layout.addWidget(book_card)
+        self.esecutore.esegui(costruisci, al_termine=self.on_suggerimenti_caricati, chiave='suggerimenti',
+                              in_errore=lambda e: print(f"Suggerimenti non disponibili: {e}"))
 
-        except Exception as e:
-            error_label = QLabel(f"Errore nel caricamento dei libri: {str(e)}")
-            error_label.setFont(QFont('SF Pro Text', 16))
-            error_label.setStyleSheet("color: #ff3b30; text-align: center;")
-            error_label.setAlignment(Qt.AlignCenter)
-            self.results_layout.addWidget(error_label)
+    def on_suggerimenti_caricati(self, motore):
+        self.motore_suggerimenti = motore
 
-        self.results_section.show()
-
-    def create_purchase_book_card(self, libro):
-        """Crea una card elegante per un libro con funzionalità di acquisto"""
-        card = QWidget()
-        card.setStyleSheet("""
-            QWidget {
-                background: white;
-                border-radius: 12px;
-                border: 1px solid #e5e5e7;
-                margin: 5px;
-            }
-            QWidget:hover {
-                border-color: #007aff;
-                background: #f8f9fa;
-            }
-        """)
-        card.setMinimumHeight(200)  # Altezza aumentata per i nuovi controlli
-        card.setMinimumWidth(650)   # Larghezza aumentata
+    def aggiorna_suggerimenti_popolarita(self):
+        """Applica all'indice le vendite, le prenotazioni e i libri nuovi dall'ultimo aggiornamento"""
+        motore = self.motore_suggerimenti
+        if motore is None or self.esecutore.in_corso('suggerimenti'):
+            return
+        # Il nuovo indice si costruisce in background; qui si sostituisce soltanto
+        def aggiorna():
+            return motore.con_delta(self.db.carica_suggerimenti_delta(motore.istante, motore.ultimo_libro_id))
 
-        layout = QHBoxLayout(card)
-        layout.setContentsMargins(20, 20, 20, 20)
-        layout.setSpacing(20)
+        self.esecutore.esegui(aggiorna, al_termine=self.on_suggerimenti_caricati, chiave='suggerimenti',
+                              in_errore=lambda e: print(f"Aggiornamento dei suggerimenti non riuscito: {e}"))
 
-        # Icona libro
-        icon_label = QLabel('📖')
-        icon_label.setFont(QFont('SF Pro Text', 48))
-        icon_label.setFixedSize(60, 60)
-        layout.addWidget(icon_label)
+    def avvia_ascolto_notifiche(self):
+        """Si mette in ascolto delle modifiche a catalogo e strutture.
 
-        # Informazioni libro
-        info_layout = QVBoxLayout()
-        info_layout.setSpacing(8)
-
-        # Titolo
-        title_label = QLabel(libro.titolo)
-        title_label.setFont(QFont('SF Pro Display', 18, QFont.Bold))
-        title_label.setStyleSheet("color: #1d1d1f;")
-        title_label.setWordWrap(True)
-        info_layout.addWidget(title_label)
-
-        # Autore e genere
-        author_genre = QLabel(f"di {libro.autore} • {libro.genere}")
-        author_genre.setFont(QFont('SF Pro Text', 14))
-        author_genre.setStyleSheet("color: #86868b;")
-        author_genre.setWordWrap(True)
-        info_layout.addWidget(author_genre)
-
-        # Dettagli
-        details = QLabel(f"{libro.anno_pubblicazione} • {libro.numero_pagine} pagine")
-        details.setFont(QFont('SF Pro Text', 14))
-        details.setStyleSheet("color: #1d1d1f;")
-        info_layout.addWidget(details)
-
-        # Descrizione se presente
-        if libro.descrizione:
-            desc = QLabel(libro.descrizione[:100] + "..." if len(libro.descrizione) > 100 else libro.descrizione)
-            desc.setFont(QFont('SF Pro Text', 12))
-            desc.setStyleSheet("color: #86868b;")
-            desc.setWordWrap(True)
-            info_layout.addWidget(desc)
-
-        layout.addLayout(info_layout)
-        layout.addStretch()
-
-        # Sezione prezzi e acquisto
-        purchase_layout = QVBoxLayout()
-        purchase_layout.setSpacing(12)
-
-        # Prezzi
-        price_layout = QVBoxLayout()
-        price_layout.setSpacing(5)
-
-        # Prezzo nuovo
-        if libro.prezzo_nuovo:
-            nuovo_price = QLabel(f"🆕 Nuovo: €{libro.prezzo_nuovo:.2f}")
-            nuovo_price.setFont(QFont('SF Pro Text', 14, QFont.Bold))
-            nuovo_price.setStyleSheet("color: #34c759;")
-            price_layout.addWidget(nuovo_price)
-
-        # Prezzo usato
-        if libro.prezzo_usato:
-            usato_price = QLabel(f"♻️ Usato: €{libro.prezzo_usato:.2f}")
-            usato_price.setFont(QFont('SF Pro Text', 14, QFont.Bold))
-            usato_price.setStyleSheet("color: #ff9500;")
-            price_layout.addWidget(usato_price)
-
-        # Prezzo base se non ci sono prezzi specifici
-        if not libro.prezzo_nuovo and not libro.prezzo_usato:
-            base_price = QLabel(f"Prezzo: €{libro.prezzo:.2f}")
-            base_price.setFont(QFont('SF Pro Text', 14, QFont.Bold))
-            base_price.setStyleSheet("color: #1d1d1f;")
-            price_layout.addWidget(base_price)
-
-        purchase_layout.addLayout(price_layout)
-
-        # Controlli acquisto
-        controls_layout = QVBoxLayout()
-        controls_layout.setSpacing(8)
-
-        # Selezione condizione
-        condition_layout = QHBoxLayout()
-        condition_layout.setSpacing(10)
-
-        condition_label = QLabel('Condizione:')
-        condition_label.setFont(QFont('SF Pro Text', 12))
-        condition_layout.addWidget(condition_label)
-
-        condition_combo = QComboBox()
-        condition_combo.setFont(QFont('SF Pro Text', 12))
-        condition_combo.setFixedWidth(100)
-
-        # Aggiungi opzioni basate sui prezzi disponibili
-        if libro.prezzo_nuovo:
-            condition_combo.addItem('Nuovo', 'nuovo')
-        if libro.prezzo_usato:
-            condition_combo.addItem('Usato', 'usato')
-
-        if condition_combo.count() == 0:
-            condition_combo.addItem('Standard', 'standard')
-
-        condition_combo.setStyleSheet("""
-            QComboBox {
-                border: 1px solid #d1d1d6;
-                border-radius: 6px;
-                padding: 4px 8px;
-                background: white;
-            }
-            QComboBox::drop-down {
-                border: none;
-            }
-            QComboBox::down-arrow {
-                image: none;
-                border-left: 4px solid transparent;
-                border-right: 4px solid transparent;
-                border-top: 4px solid #86868b;
-                margin-right: 8px;
-            }
-        """)
-        condition_layout.addWidget(condition_combo)
-
-        condition_layout.addStretch()
-        controls_layout.addLayout(condition_layout)
-
-        # Quantità e pulsante acquisto
-        action_layout = QHBoxLayout()
-        action_layout.setSpacing(10)
-
-        # Spinner quantità
-        qty_label = QLabel('Q.tà:')
-        qty_label.setFont(QFont('SF Pro Text', 12))
-        action_layout.addWidget(qty_label)
-
-        qty_spin = QSpinBox()
-        qty_spin.setMinimum(1)
-        qty_spin.setMaximum(10)
-        qty_spin.setValue(1)
-        qty_spin.setFixedWidth(60)
-        qty_spin.setStyleSheet("""
-            QSpinBox {
-                border: 1px solid #d1d1d6;
-                border-radius: 6px;
-                padding: 4px;
-                background: white;
-            }
-        """)
-        action_layout.addWidget(qty_spin)
-
-        # Pulsante aggiungi al carrello
-        add_cart_btn = QPushButton('� Aggiungi al Carrello')
-        add_cart_btn.setFont(QFont('SF Pro Text', 12, QFont.Bold))
-        add_cart_btn.setMinimumHeight(35)
-        add_cart_btn.setStyleSheet("""
-            QPushButton {
-                background: qlineargradient(x1:0, y1:0, x2:0, y2:1,
-                    stop:0 #007aff, stop:1 #0056cc);
-                color: white;
-                border: none;
-                border-radius: 17px;
-                padding: 8px 16px;
-            }
-            QPushButton:hover {
-                background: qlineargradient(x1:0, y1:0, x2:0, y2:1,
-                    stop:0 #0056cc, stop:1 #004499);
-            }
-        """)
-        add_cart_btn.clicked.connect(lambda: self.aggiungi_al_carrello(libro, condition_combo.currentData(), qty_spin.value()))
-        action_layout.addWidget(add_cart_btn)
+        Senza notifiche restano il controllo periodico del catalogo e la
+        scadenza dei dati di riferimento.
+        """
+        try:
+            conn = self.db.apri_ascolto(CANALE_CATALOGO, CANALE_RIFERIMENTO)
+        except Exception as e:
+            print(f"Notifiche del database non disponibili: {e}")
+            return
+        self.ascoltatore_notifiche = AscoltatoreNotifiche(conn, self)
+        self.ascoltatore_notifiche.notifica.connect(self.on_notifica_database)
+        self.ascoltatore_notifiche.interrotto.connect(self.on_ascolto_notifiche_interrotto)
+
+    def on_notifica_database(self, canale, contenuto):
+        if canale == CANALE_CATALOGO:
+            self.timer_notifiche_catalogo.start()
+        elif canale == CANALE_RIFERIMENTO:
+            # Le combo si riempiono dalla memoria solo dopo la rilettura
+            self.db.invalida_riferimento()
+            self.esecutore.esegui(self.db.ricarica_riferimento, chiave='riferimento',
+                                  in_errore=lambda e: print(f"Rilettura di città e strutture non riuscita: {e}"))
+
+    def on_ascolto_notifiche_interrotto(self, errore):
+        print(f"Ascolto delle notifiche del database interrotto: {errore}")
+        self.ascoltatore_notifiche = None
+
+    def carica_catalogo(self):
+        """Carica in background la copia locale del catalogo"""
+        # Se serve rileggere tutto non si sa quali ricerche in cache siano cambiate
+        if self.db.cache_ricerche is not None:
+            self.db.cache_ricerche.svuota()
+        self.esecutore.esegui(self.db.carica_catalogo, al_termine=self.catalogo.carica, chiave='catalogo',
+                              in_errore=lambda e: print(f"Catalogo locale non disponibile: {e}"))
+
+    def pota_registro_catalogo(self):
+        """Cancella in background le modifiche al catalogo ormai troppo vecchie per i delta"""
+        if self.esecutore.in_corso('potatura_catalogo'):
+            return
+        self.esecutore.esegui(self.db.pota_modifiche_catalogo, chiave='potatura_catalogo',
+                              in_errore=lambda e: print(f"Potatura del registro del catalogo non riuscita: {e}"))
+
+    def aggiorna_catalogo(self):
+        """Applica alla copia locale le modifiche successive alla sua versione"""
+        if self.esecutore.in_corso('catalogo'):
+            # Le modifiche arrivate nel frattempo si leggono al termine di questa richiesta
+            self.timer_notifiche_catalogo.start()
+            return
+        if not self.catalogo.pronta:
+            self.carica_catalogo()
+            return
+        self.esecutore.esegui(self.db.carica_catalogo_delta, self.catalogo.versione, self.catalogo.buchi(),
+                              al_termine=self.on_delta_catalogo, chiave='catalogo',
+                              in_errore=lambda e: print(f"Aggiornamento del catalogo non riuscito: {e}"))
+
+    def on_delta_catalogo(self, delta):
+        self.invalida_ricerche_delta(delta)
+        if not self.catalogo.applica_delta(delta):
+            self.carica_catalogo()
+
+    def invalida_ricerche_delta(self, delta):
+        """Scarta dalla cache delle ricerche le pagine toccate da un delta del catalogo.
+
+        Le modifiche fatte da altri processi (altre sedi) non passano da questo
+        DatabaseManager: la cache le scopre solo qui. Per ogni libro si usano il
+        testo nuovo e quello ancora nella copia locale, così si scartano sia le
+        ricerche in cui può entrare sia quelle da cui può uscire. Con un delta
+        None la cache viene svuotata da carica_catalogo.
+        """
+        cache = self.db.cache_ricerche
+        if cache is None or delta is None:
+            return
+        _, libri, rimossi = delta
+        voci = [(libro.id, testo_libro(libro)) for libro in libri]
+        for libro_id in [libro.id for libro in libri] + list(rimossi):
+            vecchio = self.catalogo.libro(libro_id) if self.catalogo.pronta else None
+            if vecchio is not None:
+                voci.append((libro_id, testo_libro(vecchio)))
+            elif libro_id in rimossi:
+                # Testo sconosciuto: si scartano le ricerche che non lo possono escludere
+                voci.append((libro_id, ''))
+        if voci:
+            cache.invalida(voci)
+
+    def mostra_suggerimenti(self, testo):
+        """Aggiorna il popup dei suggerimenti per il testo digitato"""
+        if self.motore_suggerimenti is None:
+            return
+        voci = [voce for _, voce in self.motore_suggerimenti.suggerisci(testo, NUMERO_SUGGERIMENTI)]
+        self.suggerimenti_model.setStringList(voci)
+        if voci:
+            self.completer.complete()
+        else:
+            self.completer.popup().hide()
 
-        action_layout.addStretch()
-        controls_layout.addLayout(action_layout)
+    def on_suggerimento_scelto(self, testo):
+        self.search_input.setText(testo)
+        self.perform_search()
 
-        purchase_layout.addLayout(controls_layout)
-        purchase_layout.addStretch()
+    def ricerca_mentre_scrivi(self):
+        """Aggiorna i risultati con il testo digitato finora"""
+        query = self.search_input.text().strip()
+        struttura_id = self.search_structure_combo.currentData()
+        if len(query) < MIN_CARATTERI_RICERCA or struttura_id is None:
+            return
 
-        layout.addLayout(purchase_layout)
+        # L'ultima parola è di solito incompleta: le modalità per parole diventano
+        # una ricerca per prefisso, che usa lo stesso indice GIN
+        modalita = 'fuzzy' if self.search_mode_combo.currentData() == 'fuzzy' else 'prefisso'
+        tipo_struttura = 'biblioteca' if self.search_type_combo.currentText() == '🏛️ Biblioteca' else 'libreria'
+        self.show_search_results(query, struttura_id, tipo_struttura, modalita)
+
+    def show_search_results(self, query, struttura_id, tipo_struttura='biblioteca', modalita=None, filtri=None):
+        """Mostra i risultati della ricerca limitati ai titoli della struttura selezionata"""
+        # Interrompe sul server la ricerca precedente, se è ancora in corso; la
+        # cancellazione apre una connessione di servizio, quindi non va fatta qui
+        if self.search_annullamento is not None:
+            threading.Thread(target=self.search_annullamento.annulla, daemon=True).start()
+        self.search_annullamento = Annullamento()
+
+        self.search_query = query
+        self.search_modalita = modalita or self.search_mode_combo.currentData()
+        self.search_struttura = (tipo_struttura, struttura_id)
+        self.search_filtri = filtri or {}
+        self.search_offset = 0
+        self.results_model.nuova_ricerca()
+        self.carica_pagina_risultati()
+        self.results_section.show()
 
-        return card
+    def mostra_stato_ricerca(self, testo, colore="#86868b"):
+        """Mostra un messaggio sopra i risultati; con testo vuoto lo nasconde"""
+        self.search_status_label.setText(testo)
+        self.search_status_label.setStyleSheet(f"color: {colore}; text-align: center;")
+        self.search_status_label.setVisible(bool(testo))
+
+    def carica_pagina_risultati(self):
+        """Richiede in background la pagina successiva dei risultati della ricerca"""
+        self.mostra_stato_ricerca("⏳ Ricerca in corso...")
+
+        # Chiede una riga in più per sapere se esiste una pagina successiva; una nuova
+        # ricerca con la stessa chiave rende obsoleti i risultati di quella in corso
+        # I conteggi delle faccette servono solo con la prima pagina
+        self.esecutore.esegui(self.db.cerca_libri_faccette, self.search_query, self.search_filtri,
+                              limit=RISULTATI_PER_PAGINA + 1, offset=self.search_offset,
+                              modalita=self.search_modalita, conteggi=self.search_offset == 0,
+                              tipo_struttura=self.search_struttura[0],
+                              struttura_id=self.search_struttura[1],
+                              annullamento=self.search_annullamento,
+                              al_termine=self.mostra_pagina_risultati,
+                              in_errore=self.mostra_errore_ricerca, chiave='ricerca')
+
+    def mostra_errore_ricerca(self, errore):
+        """Mostra l'errore della ricerca al posto dei risultati"""
+        if isinstance(errore, QueryAnnullata):
+            # Superata da una ricerca più recente
+            return
+        self.results_model.caricamento_fallito()
+        self.mostra_stato_ricerca(f"Errore nel caricamento dei libri: {str(errore)}", "#ff3b30")
+
+    def mostra_pagina_risultati(self, risultato):
+        """Aggiunge al modello la pagina ricevuta dal thread del database"""
+        libri, faccette = risultato
+        if faccette is not None:
+            self.aggiorna_faccette(faccette)
+        altri_risultati = len(libri) > RISULTATI_PER_PAGINA
+        libri = libri[:RISULTATI_PER_PAGINA]
+
+        prima_pagina = self.search_offset == 0
+        if not libri and prima_pagina:
+            self.mostra_stato_ricerca("Nessun libro trovato per la ricerca effettuata.")
+        else:
+            self.mostra_stato_ricerca("")
+        self.search_offset += len(libri)
+        self.results_model.aggiungi_pagina(libri, altri_risultati, sostituisci=prima_pagina)
+
+    def aggiorna_faccette(self, faccette):
+        """Riempie i filtri con i conteggi dell'ultima ricerca, mantenendo le scelte fatte"""
+        filtri = self.search_filtri
+        generi = [(f"{genere} ({n})", [genere]) for genere, n in (faccette or {}).get('generi', [])]
+        decenni = [(f"{decennio}–{decennio + 9} ({n})", (decennio, decennio + 9))
+                   for decennio, n in (faccette or {}).get('decenni', [])]
+        fasce = [(f"{FASCE_PREZZO[fascia]} ({n})", [fascia])
+                 for fascia, n in (faccette or {}).get('fasce_prezzo', [])]
+        selezioni = (
+            (self.filtro_genere_combo, 'Tutti i generi', generi, filtri.get('generi')),
+            (self.filtro_decennio_combo, 'Tutti gli anni', decenni,
+             (filtri['anno_da'], filtri['anno_a']) if 'anno_da' in filtri else None),
+            (self.filtro_prezzo_combo, 'Tutti i prezzi', fasce, filtri.get('fasce_prezzo')),
+        )
+        for combo, tutti, voci, scelta in selezioni:
+            combo.clear()
+            combo.addItem(tutti, None)
+            for etichetta, valore in voci:
+                combo.addItem(etichetta, valore)
+            if scelta is not None:
+                indice = combo.findData(scelta)
+                combo.setCurrentIndex(max(indice, 0))
+
+        disponibili = (faccette or {}).get('disponibili')
+        self.filtro_disponibili_check.setText('Disponibili ora' if disponibili is None
+                                              else f'Disponibili ora ({disponibili})')
+        self.filtro_disponibili_check.setChecked(bool(filtri.get('solo_disponibili')))
+
+    def applica_filtri_ricerca(self):
+        """Ripete l'ultima ricerca con i filtri scelti"""
+        if not self.search_query:
+            return
+        filtri = {}
+        if self.filtro_genere_combo.currentData():
+            filtri['generi'] = self.filtro_genere_combo.currentData()
+        if self.filtro_decennio_combo.currentData():
+            filtri['anno_da'], filtri['anno_a'] = self.filtro_decennio_combo.currentData()
+        if self.filtro_prezzo_combo.currentData():
+            filtri['fasce_prezzo'] = self.filtro_prezzo_combo.currentData()
+        if self.filtro_disponibili_check.isChecked():
+            filtri['solo_disponibili'] = True
+        tipo_struttura, struttura_id = self.search_struttura
+        self.show_search_results(self.search_query, struttura_id, tipo_struttura, self.search_modalita, filtri)
 
     def prenota_libro(self, titolo):
         """Gestisce la prenotazione di un libro"""
@@ -1487,13 +1747,17 @@ class BibliotecaGUI(QWidget):
         )
 
         if reply == QMessageBox.Yes:
-            success, message = self.db.prenota_libro(self.current_user['id'], titolo)
-            if success:
-                QMessageBox.information(self, 'Prenotazione Confermata', message)
-                # Aggiorna i risultati della ricerca
-                self.perform_search()
-            else:
-                QMessageBox.warning(self, 'Errore', message)
+            self.esegui_db(self.db.prenota_libro, self.current_user['id'], titolo,
+                           al_termine=self.on_prenotazione_completata)
+
+    def on_prenotazione_completata(self, esito):
+        success, message = esito
+        if success:
+            QMessageBox.information(self, 'Prenotazione Confermata', message)
+            # Aggiorna i risultati della ricerca
+            self.perform_search()
+        else:
+            QMessageBox.warning(self, 'Errore', message)
 
     def aggiungi_a_lista_attesa(self, titolo):
         """Aggiunge un libro alla lista d'attesa"""
@@ -1508,11 +1772,15 @@ class BibliotecaGUI(QWidget):
         )
 
         if reply == QMessageBox.Yes:
-            success, message = self.db.aggiungi_lista_attesa(self.current_user['id'], titolo)
-            if success:
-                QMessageBox.information(self, 'Lista d\'Attesa', message)
-            else:
-                QMessageBox.warning(self, 'Errore', message)
+            self.esegui_db(self.db.aggiungi_lista_attesa, self.current_user['id'], titolo,
+                           al_termine=self.on_lista_attesa_completata)
+
+    def on_lista_attesa_completata(self, esito):
+        success, message = esito
+        if success:
+            QMessageBox.information(self, 'Lista d\'Attesa', message)
+        else:
+            QMessageBox.warning(self, 'Errore', message)
 
     def aggiungi_al_carrello(self, libro, condizione, quantita):
         """Aggiunge un libro al carrello acquisti"""
@@ -1891,7 +2159,10 @@ class BibliotecaGUI(QWidget):
             QMessageBox.warning(self, 'Accesso richiesto', 'Devi effettuare il login per vedere i libri salvati.')
             return
 
-        libri = self.db.mostra_favoriti(self.current_user['id'])
+        self.esegui_db(self.db.mostra_favoriti, self.current_user['id'],
+                       al_termine=self.on_libri_salvati_caricati, chiave='libri_salvati')
+
+    def on_libri_salvati_caricati(self, libri):
         if libri:
             content = "I tuoi libri salvati:\n\n" + "\n".join([f"• {libro.titolo} - {libro.autore}" for libro in libri])
         else:
@@ -1906,7 +2177,10 @@ class BibliotecaGUI(QWidget):
             QMessageBox.warning(self, 'Accesso richiesto', 'Devi effettuare il login per vedere le prenotazioni.')
             return
 
-        prenotazioni = self.db.mostra_prenotazioni_utente(self.current_user['id'])
+        self.esegui_db(self.db.mostra_prenotazioni_utente, self.current_user['id'],
+                       al_termine=self.on_libri_prenotati_caricati, chiave='libri_prenotati')
+
+    def on_libri_prenotati_caricati(self, prenotazioni):
         if prenotazioni:
             content = "Le tue prenotazioni attive:\n\n"
             for p in prenotazioni:
@@ -2103,6 +2377,11 @@ class BibliotecaGUI(QWidget):
             QMessageBox.warning(self, 'Accesso richiesto', 'Devi effettuare il login per gestire gli indirizzi.')
             return
 
+        self.esegui_db(self.db.get_indirizzi_utente, self.current_user['id'],
+                       al_termine=self.mostra_dialog_indirizzi, chiave='indirizzi')
+
+    def mostra_dialog_indirizzi(self, indirizzi):
+        """Mostra il dialog degli indirizzi ricevuti dal database"""
         # Crea dialog per la gestione indirizzi
         address_dialog = QDialog(self)
         address_dialog.setWindowTitle('I Miei Indirizzi')
@@ -2123,9 +2402,6 @@ class BibliotecaGUI(QWidget):
         address_layout = QVBoxLayout(scroll_widget)
         address_layout.setSpacing(15)
 
-        # Carica indirizzi esistenti
-        indirizzi = self.db.get_indirizzi_utente(self.current_user['id'])
-
         if indirizzi:
             for indirizzo in indirizzi:
                 # Card indirizzo
@@ -2417,10 +2693,14 @@ class BibliotecaGUI(QWidget):
             QMessageBox.warning(add_dialog, 'Campi obbligatori', 'Tutti i campi sono obbligatori tranne il telefono.')
             return
 
-        success, message = self.db.salva_indirizzo(
-            self.current_user['id'], nome, cognome, indirizzo, citta, cap, provincia, telefono, is_default
-        )
+        def completato(esito):
+            self.on_indirizzo_salvato(esito, add_dialog, parent_dialog)
+
+        self.esegui_db(self.db.salva_indirizzo, self.current_user['id'], nome, cognome, indirizzo,
+                       citta, cap, provincia, telefono, is_default, al_termine=completato)
 
+    def on_indirizzo_salvato(self, esito, add_dialog, parent_dialog):
+        success, message = esito
         if success:
             QMessageBox.information(add_dialog, 'Successo', 'Indirizzo salvato con successo!')
             add_dialog.accept()
@@ -2436,6 +2716,11 @@ class BibliotecaGUI(QWidget):
             QMessageBox.warning(self, 'Accesso richiesto', 'Devi effettuare il login per gestire i metodi di pagamento.')
             return
 
+        self.esegui_db(self.db.get_metodi_pagamento_utente, self.current_user['id'],
+                       al_termine=self.mostra_dialog_metodi_pagamento, chiave='metodi_pagamento')
+
+    def mostra_dialog_metodi_pagamento(self, metodi):
+        """Mostra il dialog dei metodi di pagamento ricevuti dal database"""
         # Crea dialog principale
         payment_dialog = QDialog(self)
         payment_dialog.setWindowTitle('I Miei Metodi di Pagamento')
@@ -2456,9 +2741,6 @@ class BibliotecaGUI(QWidget):
         payment_layout = QVBoxLayout(scroll_widget)
         payment_layout.setSpacing(15)
 
-        # Carica metodi pagamento
-        metodi = self.db.get_metodi_pagamento_utente(self.current_user['id'])
-
         if metodi:
             for metodo in metodi:
                 # Card widget
@@ -2772,10 +3054,14 @@ class BibliotecaGUI(QWidget):
             QMessageBox.warning(add_dialog, 'Scadenza non valida', 'Il formato della scadenza deve essere MM/AA.')
             return
 
-        success, message = self.db.salva_metodo_pagamento(
-            self.current_user['id'], tipo, numero_clean, titolare, scadenza, is_default
-        )
+        def completato(esito):
+            self.on_metodo_pagamento_salvato(esito, add_dialog, parent_dialog)
 
+        self.esegui_db(self.db.salva_metodo_pagamento, self.current_user['id'], tipo, numero_clean,
+                       titolare, scadenza, is_default, al_termine=completato)
+
+    def on_metodo_pagamento_salvato(self, esito, add_dialog, parent_dialog):
+        success, message = esito
         if success:
             QMessageBox.information(add_dialog, 'Successo', 'Metodo di pagamento salvato con successo!')
             add_dialog.accept()
@@ -2787,21 +3073,28 @@ class BibliotecaGUI(QWidget):
 
     def imposta_metodo_predefinito(self, metodo_id, parent_dialog):
         """Imposta un metodo di pagamento come predefinito"""
-        success, message = self.db.imposta_metodo_predefinito(self.current_user['id'], metodo_id)
-        if success:
-            QMessageBox.information(parent_dialog, 'Successo', 'Metodo impostato come predefinito!')
-            parent_dialog.close()
-            self.gestisci_metodi_pagamento()
-        else:
-            QMessageBox.warning(parent_dialog, 'Errore', message)
+        def completato(esito):
+            success, message = esito
+            if success:
+                QMessageBox.information(parent_dialog, 'Successo', 'Metodo impostato come predefinito!')
+                parent_dialog.close()
+                self.gestisci_metodi_pagamento()
+            else:
+                QMessageBox.warning(parent_dialog, 'Errore', message)
+
+        self.esegui_db(self.db.imposta_metodo_predefinito, self.current_user['id'], metodo_id,
+                       al_termine=completato)
 
     def elimina_metodo_pagamento(self, metodo_id, parent_dialog):
         """Elimina un metodo di pagamento"""
         reply = QMessageBox.question(parent_dialog, 'Conferma Eliminazione',
                                    'Sei sicuro di voler eliminare questo metodo di pagamento?',
                                    QMessageBox.Yes | QMessageBox.No)
-        if reply == QMessageBox.Yes:
-            success, message = self.db.elimina_metodo_pagamento(metodo_id)
+        if reply != QMessageBox.Yes:
+            return
+
+        def completato(esito):
+            success, message = esito
             if success:
                 QMessageBox.information(parent_dialog, 'Successo', 'Metodo di pagamento eliminato!')
                 parent_dialog.close()
@@ -2809,6 +3102,8 @@ class BibliotecaGUI(QWidget):
             else:
                 QMessageBox.warning(parent_dialog, 'Errore', message)
 
+        self.esegui_db(self.db.elimina_metodo_pagamento, metodo_id, al_termine=completato)
+
     def checkout(self, cart_dialog):
         """Procedura di checkout"""
         if not self.current_user:
@@ -2820,7 +3115,12 @@ class BibliotecaGUI(QWidget):
             return
 
         # Verifica indirizzi disponibili
-        indirizzi = self.db.get_indirizzi_utente(self.current_user['id'])
+        self.esegui_db(self.db.get_indirizzi_utente, self.current_user['id'],
+                       al_termine=lambda indirizzi: self.mostra_dialog_checkout(indirizzi, cart_dialog),
+                       chiave='checkout')
+
+    def mostra_dialog_checkout(self, indirizzi, cart_dialog):
+        """Mostra il dialog di checkout con gli indirizzi ricevuti dal database"""
         if not indirizzi:
             reply = QMessageBox.question(self, 'Nessun indirizzo',
                                        'Non hai indirizzi di spedizione salvati. Vuoi aggiungerne uno ora?',
@@ -3134,7 +3434,10 @@ class BibliotecaGUI(QWidget):
         """Aggiunge indirizzo durante checkout"""
         self.aggiungi_indirizzo(checkout_dialog)
         # Ricarica indirizzi nel combo box
-        indirizzi = self.db.get_indirizzi_utente(self.current_user['id'])
+        self.esegui_db(self.db.get_indirizzi_utente, self.current_user['id'],
+                       al_termine=self.on_indirizzi_checkout_caricati, chiave='indirizzi_checkout')
+
+    def on_indirizzi_checkout_caricati(self, indirizzi):
         self.address_combo.clear()
         for indirizzo in indirizzi:
             display_text = f"{indirizzo['nome']} {indirizzo['cognome']} - {indirizzo['indirizzo']}, {indirizzo['citta']}"
@@ -3161,12 +3464,15 @@ class BibliotecaGUI(QWidget):
         else:  # Ritiro in libreria
             delivery_date = datetime.now() + timedelta(days=1)
 
+        def completato(esito):
+            self.on_ordine_creato(esito, delivery_date, checkout_dialog, cart_dialog)
+
         # Salva ordine nel database
-        success, order_id = self.db.crea_ordine(
-            self.current_user['id'], self.carrello, address_id,
-            payment_type, delivery_type, delivery_date
-        )
+        self.esegui_db(self.db.crea_ordine, self.current_user['id'], list(self.carrello), address_id,
+                       payment_type, delivery_type, delivery_date, al_termine=completato, chiave='ordine')
 
+    def on_ordine_creato(self, esito, delivery_date, checkout_dialog, cart_dialog):
+        success, order_id = esito
         if success:
             QMessageBox.information(checkout_dialog, 'Ordine Confermato',
                                   f'Il tuo ordine #{order_id} è stato confermato!\n'
@@ -3191,7 +3497,10 @@ class BibliotecaGUI(QWidget):
             QMessageBox.warning(self, 'Accesso richiesto', 'Devi effettuare il login per vedere le notifiche.')
             return
 
-        notifiche = self.db.mostra_notifiche(self.current_user['id'])
+        self.esegui_db(self.db.mostra_notifiche, self.current_user['id'],
+                       al_termine=self.on_notifiche_caricate, chiave='notifiche')
+
+    def on_notifiche_caricate(self, notifiche):
         if notifiche:
             content = "Le tue notifiche:\n\n"
             for n in notifiche:
@@ -3199,7 +3508,7 @@ class BibliotecaGUI(QWidget):
                 content += f"  {n['data']}\n\n"
 
             # Segna come lette
-            self.db.segna_notifiche_lette(self.current_user['id'])
+            self.esegui_db(self.db.segna_notifiche_lette, self.current_user['id'])
         else:
             content = "Non hai nuove notifiche."
 
@@ -3230,7 +3539,10 @@ Struttura: {user.get('biblioteca') or user.get('libreria') or 'Nessuna'}"""
             QMessageBox.warning(self, 'Accesso richiesto', 'Devi effettuare il login per vedere i tuoi ordini.')
             return
 
-        ordini = self.db.get_acquisti_utente(self.current_user['id'])
+        self.esegui_db(self.db.get_acquisti_utente, self.current_user['id'],
+                       al_termine=self.on_ordini_caricati, chiave='ordini')
+
+    def on_ordini_caricati(self, ordini):
         if ordini:
             content = "I tuoi ordini:\n\n"
             for ordine in ordini:
@@ -3467,90 +3779,139 @@ Struttura: {user.get('biblioteca') or user.get('libreria') or 'Nessuna'}"""
                 titolo, autore, genere, anno, pagine, prezzo = dialog.get_data()
                 if titolo and autore and genere and anno and pagine and prezzo:
                     libro = Libro(titolo, autore, genere, int(anno), int(pagine), float(prezzo))
-                    self.db.save_libro(libro)
-                    QMessageBox.information(self, 'Successo', f"Libro '{titolo}' aggiunto alla biblioteca.")
                 else:
                     QMessageBox.warning(self, 'Errore', 'Tutti i campi sono obbligatori.')
+                    return
             except ValueError as e:
                 QMessageBox.warning(self, 'Errore', f"Dati non validi: {str(e)}. Assicurati che anno, pagine e prezzo siano numeri.")
-            except Exception as e:
+                return
+
+            def errore(e):
                 QMessageBox.critical(self, 'Errore Database', f"Si è verificato un errore durante l'aggiunta: {str(e)}")
 
+            self.esecutore.esegui(
+                self.db.save_libro, libro, in_errore=errore,
+                al_termine=lambda _: QMessageBox.information(self, 'Successo', f"Libro '{titolo}' aggiunto alla biblioteca."))
+
     def rimuovi_libro(self):
         """Rimuove un libro"""
         titolo, ok = QInputDialog.getText(self, 'Rimuovi Libro', 'Inserisci il titolo del libro da rimuovere:')
         if ok and titolo:
-            if self.db.rimuovi_libro(titolo):
-                QMessageBox.information(self, 'Successo', f"Libro '{titolo}' rimosso dalla biblioteca.")
-            else:
-                QMessageBox.warning(self, 'Errore', f"Nessun libro trovato con il titolo '{titolo}'.")
+            def completato(rimosso):
+                if rimosso:
+                    QMessageBox.information(self, 'Successo', f"Libro '{titolo}' rimosso dalla biblioteca.")
+                else:
+                    QMessageBox.warning(self, 'Errore', f"Nessun libro trovato con il titolo '{titolo}'.")
+
+            self.esegui_db(self.db.rimuovi_libro, titolo, al_termine=completato)
 
     def cerca_titolo(self):
         """Cerca un libro per titolo"""
         titolo, ok = QInputDialog.getText(self, 'Cerca per Titolo', 'Inserisci il titolo:')
         if ok and titolo:
-            libro = self.db.cerca_titolo(titolo)
+            libro = self.catalogo.cerca_titolo(titolo) if self.catalogo.pronta else None
             if libro:
                 self.show_result_dialog("Libro trovato", str(libro))
-            else:
-                self.show_result_dialog("Risultato", f"Nessun libro trovato con il titolo '{titolo}'.")
+                return
+
+            def cerca():
+                libro = self.db.cerca_titolo(titolo)
+                return libro, "" if libro else self.suggerimenti_simili(titolo)
+
+            def completato(esito):
+                libro, suggerimenti = esito
+                if libro:
+                    self.show_result_dialog("Libro trovato", str(libro))
+                else:
+                    self.show_result_dialog("Risultato", f"Nessun libro trovato con il titolo '{titolo}'." +
+                                            suggerimenti)
+
+            self.esegui_db(cerca, al_termine=completato, chiave='admin_ricerca')
 
     def cerca_autore(self):
         """Cerca un libro per autore"""
         autore, ok = QInputDialog.getText(self, 'Cerca per Autore', 'Inserisci l\'autore:')
         if ok and autore:
-            libro = self.db.cerca_autore(autore)
-            if libro:
-                self.show_result_dialog("Libro trovato", str(libro))
-            else:
-                self.show_result_dialog("Risultato", f"Nessun libro trovato dell'autore '{autore}'.")
+            libri = self.catalogo.libri_autore(autore) if self.catalogo.pronta else None
+            if libri:
+                self.show_result_dialog(f"Libri di {autore}", libri)
+                return
+
+            def cerca():
+                libri = self.db.cerca_libri_autore(autore)
+                return libri, "" if libri else self.suggerimenti_simili(autore)
+
+            def completato(esito):
+                libri, suggerimenti = esito
+                if libri:
+                    self.show_result_dialog(f"Libri di {autore}", libri)
+                else:
+                    self.show_result_dialog("Risultato", f"Nessun libro trovato dell'autore '{autore}'." +
+                                            suggerimenti)
+
+            self.esegui_db(cerca, al_termine=completato, chiave='admin_ricerca')
+
+    def suggerimenti_simili(self, testo):
+        """Restituisce il testo "Forse cercavi" con i libri simili al testo inserito.
+
+        Esegue una query: va chiamata dal thread di lavoro, non da quello dell'interfaccia.
+        """
+        try:
+            simili = self.db.cerca_libri(testo, limit=5, modalita='fuzzy')
+        except Exception:
+            return ""
+        if not simili:
+            return ""
+        return "\n\nForse cercavi:\n" + "\n".join(f"• {libro.titolo} - {libro.autore}" for libro in simili)
 
     def presta_libro(self):
         """Presta un libro"""
         titolo, ok = QInputDialog.getText(self, 'Presta Libro', 'Inserisci il titolo del libro da prestare:')
         if ok and titolo:
-            libro = self.db.presta_libro(titolo)
-            if libro:
-                self.show_result_dialog("Successo", f"Libro '{libro.titolo}' prestato con successo.")
-            else:
-                self.show_result_dialog("Errore", f"Il libro '{titolo}' non è disponibile per il prestito.")
+            def completato(libro):
+                if libro:
+                    self.show_result_dialog("Successo", f"Libro '{libro.titolo}' prestato con successo.")
+                else:
+                    self.show_result_dialog("Errore", f"Il libro '{titolo}' non è disponibile per il prestito.")
+
+            self.esegui_db(self.db.presta_libro, titolo, al_termine=completato)
 
     def riprendi_libro(self):
         """Restituisce un libro prestato"""
         titolo, ok = QInputDialog.getText(self, 'Riprendi Libro', 'Inserisci il titolo del libro da restituire:')
         if ok and titolo:
-            libro = self.db.riprendi_libro(titolo)
-            if libro:
-                self.show_result_dialog("Successo", f"Libro '{libro.titolo}' restituito con successo.")
-            else:
-                self.show_result_dialog("Errore", f"Il libro '{titolo}' non è stato restituito con successo.")
+            def completato(libro):
+                if libro:
+                    self.show_result_dialog("Successo", f"Libro '{libro.titolo}' restituito con successo.")
+                else:
+                    self.show_result_dialog("Errore", f"Il libro '{titolo}' non è stato restituito con successo.")
+
+            self.esegui_db(self.db.riprendi_libro, titolo, al_termine=completato)
 
     def mostra_libri_prestati(self):
         """Mostra i libri prestati"""
-        try:
-            libri = self.db.mostra_libri_prestati()
+        def completato(libri):
             if libri:
                 self.show_result_dialog("Libri Prestati", "\n".join(libri))
             else:
                 self.show_result_dialog("Libri Prestati", "Nessun libro prestato.")
-        except Exception as e:
-            QMessageBox.critical(self, 'Errore', f"Si è verificato un errore: {str(e)}")
+
+        self.esecutore.esegui(lambda: self.db.mostra_libri_prestati(), al_termine=completato,
+                              in_errore=self.mostra_errore_generico, chiave='libri_prestati')
 
     def mostra_catalogo(self):
         """Mostra il catalogo completo"""
-        try:
-            libri = self.db.load_libri()
-            self.show_result_dialog("Catalogo della Biblioteca", "\n".join([str(libro) for libro in libri]))
-        except Exception as e:
-            QMessageBox.critical(self, 'Errore', f"Si è verificato un errore: {str(e)}")
+        dialog = CatalogoDialog(self.db, self.esecutore, self)
+        dialog.exec_()
 
     def mostra_autori(self):
         """Mostra la lista degli autori"""
-        try:
-            autori = self.db.mostra_autori()
-            self.show_result_dialog("Lista degli Autori", "\n".join(autori))
-        except Exception as e:
-            QMessageBox.critical(self, 'Errore', f"Si è verificato un errore: {str(e)}")
+        self.esecutore.esegui(
+            self.db.mostra_autori, chiave='autori', in_errore=self.mostra_errore_generico,
+            al_termine=lambda autori: self.show_result_dialog("Lista degli Autori", "\n".join(autori)))
+
+    def mostra_errore_generico(self, errore):
+        QMessageBox.critical(self, 'Errore', f"Si è verificato un errore: {str(errore)}")
 
     def show_result_dialog(self, title, content):
         """Mostra un dialog con i risultati"""
@@ -3561,24 +3922,40 @@ Struttura: {user.get('biblioteca') or user.get('libreria') or 'Nessuna'}"""
         """Modifica un libro esistente"""
         titolo, ok = QInputDialog.getText(self, 'Modifica Libro', 'Inserisci il titolo del libro da modificare:')
         if ok and titolo:
-            libro = self.db.cerca_titolo(titolo)
+            libro = self.catalogo.cerca_titolo(titolo) if self.catalogo.pronta else None
             if libro:
-                dialog = EditBookDialog(libro, self)
-                if dialog.exec_() == QDialog.Accepted:
-                    try:
-                        nuovo_titolo, autore, genere, anno, pagine, prezzo = dialog.get_data()
-                        if nuovo_titolo and autore and genere and anno and pagine and prezzo:
-                            nuovo_libro = Libro(nuovo_titolo, autore, genere, int(anno), int(pagine), float(prezzo))
-                            nuovo_libro.disponibile = libro.disponibile  # Mantieni lo stato di disponibilità
-                            if self.db.modifica_libro(titolo, nuovo_libro):
-                                QMessageBox.information(self, 'Successo', f"Libro '{titolo}' modificato con successo.")
-                            else:
-                                QMessageBox.warning(self, 'Errore', 'Errore nella modifica del libro.')
-                        else:
-                            QMessageBox.warning(self, 'Errore', 'Tutti i campi sono obbligatori.')
-                    except ValueError as e:
-                        QMessageBox.warning(self, 'Errore', f"Dati non validi: {str(e)}. Assicurati che anno, pagine e prezzo siano numeri.")
-                    except Exception as e:
-                        QMessageBox.critical(self, 'Errore Database', f"Si è verificato un errore durante la modifica: {str(e)}")
+                self.mostra_dialog_modifica(titolo, libro)
+                return
+            self.esegui_db(self.db.cerca_titolo, titolo, chiave='modifica_libro',
+                           al_termine=lambda libro: self.mostra_dialog_modifica(titolo, libro))
+
+    def mostra_dialog_modifica(self, titolo, libro):
+        """Apre il dialog di modifica per il libro ricevuto dal database"""
+        if not libro:
+            QMessageBox.warning(self, 'Errore', f"Nessun libro trovato con il titolo '{titolo}'.")
+            return
+
+        dialog = EditBookDialog(libro, self)
+        if dialog.exec_() != QDialog.Accepted:
+            return
+        try:
+            nuovo_titolo, autore, genere, anno, pagine, prezzo = dialog.get_data()
+            if not (nuovo_titolo and autore and genere and anno and pagine and prezzo):
+                QMessageBox.warning(self, 'Errore', 'Tutti i campi sono obbligatori.')
+                return
+            nuovo_libro = Libro(nuovo_titolo, autore, genere, int(anno), int(pagine), float(prezzo))
+            nuovo_libro.disponibile = libro.disponibile  # Mantieni lo stato di disponibilità
+        except ValueError as e:
+            QMessageBox.warning(self, 'Errore', f"Dati non validi: {str(e)}. Assicurati che anno, pagine e prezzo siano numeri.")
+            return
+
+        def completato(modificato):
+            if modificato:
+                QMessageBox.information(self, 'Successo', f"Libro '{titolo}' modificato con successo.")
             else:
-                QMessageBox.warning(self, 'Errore', f"Nessun libro trovato con il titolo '{titolo}'.")
\ No newline at end of file
+                QMessageBox.warning(self, 'Errore', 'Errore nella modifica del libro.')
+
+        def errore(e):
+            QMessageBox.critical(self, 'Errore Database', f"Si è verificato un errore durante la modifica: {str(e)}")
+
+        self.esecutore.esegui(self.db.modifica_libro, titolo, nuovo_libro, al_termine=completato, in_errore=errore)
\ No newline at end of file
@@ -0,0 +1,632 @@
+"""
+Migrazioni versionate dello schema del database.
+
+Ogni migrazione ha un numero di versione crescente e viene applicata una sola
+volta; la tabella schema_version registra quelle già eseguite. All'avvio, con
+lo schema aggiornato, basta una query per verificarlo.
+"""
+
+import hashlib
+import psycopg2
+import psycopg2.errors
+
+
+# Chiave dell'advisory lock che impedisce a due processi di migrare insieme
+LOCK_MIGRAZIONI = 7400117
+
+
+def popola_dati_esempio(cursor):
+    """Popola il database con dati di esempio solo se non ci sono utenti"""
+    cursor.execute("SELECT COUNT(*) FROM utenti")
+    if cursor.fetchone()[0] > 0:
+        print("Database già popolato con dati esistenti.")
+        return
+
+    print("Database vuoto. Popolamento con dati di esempio...")
+
+    # Aggiungi utenti di esempio (biblioteche e librerie sono create dalla migrazione 1)
+    utenti = [
+        # Bibliotecari
+        ('mario.rossi@email.com', 'mario_bib', 'Mario', 'Rossi', 'password123', 'bibliotecario', 1, None),
+        ('giulia.verdi@email.com', 'giulia_bib', 'Giulia', 'Verdi', 'password123', 'bibliotecario', 2, None),
+        ('luca.bianchi@email.com', 'luca_bib', 'Luca', 'Bianchi', 'password123', 'bibliotecario', 3, None),
+
+        # Librai
+        ('anna.neri@email.com', 'anna_lib', 'Anna', 'Neri', 'password123', 'libraio', None, 1),
+        ('franco.gallo@email.com', 'franco_lib', 'Franco', 'Gallo', 'password123', 'libraio', None, 2),
+        ('sara.moro@email.com', 'sara_lib', 'Sara', 'Moro', 'password123', 'libraio', None, 3),
+
+        # Utenti normali (studenti)
+        ('piero.amendola@email.com', 'piero_user', 'Piero', 'Amendola', 'password123', 'utente', None, None),
+        ('marco.tosi@email.com', 'marco_user', 'Marco', 'Tosi', 'password123', 'utente', None, None),
+        ('elena.fini@email.com', 'elena_user', 'Elena', 'Fini', 'password123', 'utente', None, None),
+        ('giovanni.roma@email.com', 'giovanni_user', 'Giovanni', 'Roma', 'password123', 'utente', None, None),
+        ('sofia.luna@email.com', 'sofia_user', 'Sofia', 'Luna', 'password123', 'utente', None, None)
+    ]
+
+    for email, username, nome, cognome, password, ruolo, bib_id, lib_id in utenti:
+        # Stesso hash di DatabaseManager.hash_password
+        password_hash = hashlib.sha256(password.encode()).hexdigest()
+        cursor.execute("""
+            INSERT INTO utenti (email, nome_utente, nome, cognome, password_hash, ruolo_id, biblioteca_id, libreria_id)
+            SELECT %s, %s, %s, %s, %s, r.id, %s, %s
+            FROM ruoli r WHERE r.nome = %s
+            ON CONFLICT (email) DO NOTHING
+        """, (email, username, nome, cognome, password_hash, bib_id, lib_id, ruolo))
+
+    print("Database popolato con dati di esempio per i test.")
+
+
+# Strutture create alla prima installazione: (nome, indirizzo, città)
+BIBLIOTECHE_DEFAULT = [
+    ('Biblioteca Centrale', 'Via Roma 1, Milano', 'Milano'),
+    ('Biblioteca Comunale', 'Piazza Garibaldi 2, Roma', 'Roma'),
+    ('Biblioteca Nazionale', 'Via Nazionale 1, Roma', 'Roma'),
+    ('Biblioteca Universitaria', 'Via Università 2, Milano', 'Milano'),
+    ('Biblioteca Civica', 'Piazza Dante 3, Firenze', 'Firenze'),
+    ('Biblioteca Provinciale', 'Via Garibaldi 4, Napoli', 'Napoli'),
+]
+
+LIBRERIE_DEFAULT = [
+    ('Mondadori', 'Via dei Libri 1, Roma', 'Roma'),
+    ('Feltrinelli', 'Corso Italia 2, Milano', 'Milano'),
+    ('IBS', 'Via Shopping 3, Firenze', 'Firenze'),
+    ('Libreria Universitaria', 'Via Studenti 4, Napoli', 'Napoli'),
+    ('Libreria del Centro', 'Piazza Duomo 5, Bologna', 'Bologna'),
+    ('Libreria Moderna', 'Via Moderna 6, Torino', 'Torino'),
+]
+
+
+def inserisci_strutture_default(cursor):
+    """Inserisce biblioteche e librerie di default se non esistono già"""
+    for tabella, strutture in (('biblioteche', BIBLIOTECHE_DEFAULT), ('librerie', LIBRERIE_DEFAULT)):
+        for nome, indirizzo, citta_nome in strutture:
+            # Le tabelle non hanno vincoli UNIQUE sul nome: si controlla l'esistenza
+            cursor.execute(f"""
+                INSERT INTO {tabella} (nome, indirizzo, citta_id)
+                SELECT %s, %s, c.id FROM citta c
+                WHERE c.nome = %s AND NOT EXISTS (SELECT 1 FROM {tabella} WHERE nome = %s)
+            """, (nome, indirizzo, citta_nome, nome))
+
+
+# Indici secondari per le query più frequenti di DatabaseManager. Gli indici parziali
+# contengono solo le righe interrogate davvero (notifiche non lette, prenotazioni attive...)
+INDICI_QUERY_FREQUENTI = [
+    # mostra_notifiche / segna_notifiche_lette
+    '''CREATE INDEX IF NOT EXISTS idx_notifiche_non_lette
+       ON notifiche (utente_id, data_creazione DESC) WHERE letta = FALSE''',
+    # mostra_prenotazioni_utente / prenota_libro
+    """CREATE INDEX IF NOT EXISTS idx_prenotazioni_attive
+       ON prenotazioni (utente_id, data_prenotazione DESC) WHERE stato = 'attiva'""",
+    '''CREATE INDEX IF NOT EXISTS idx_prenotazioni_libro ON prenotazioni (libro_id)''',
+    # aggiungi_lista_attesa (posizione in coda e verifica duplicati)
+    """CREATE INDEX IF NOT EXISTS idx_liste_attesa_attive
+       ON liste_attesa (libro_id, utente_id) WHERE stato = 'attiva'""",
+    '''CREATE INDEX IF NOT EXISTS idx_liste_attesa_utente ON liste_attesa (utente_id)''',
+    # libri_salvati ha già UNIQUE(utente_id, libro_id); serve l'accesso dal libro
+    '''CREATE INDEX IF NOT EXISTS idx_libri_salvati_libro ON libri_salvati (libro_id)''',
+    '''CREATE INDEX IF NOT EXISTS idx_libri_genere_id ON libri (genere_id)''',
+    '''CREATE INDEX IF NOT EXISTS idx_inventario_librerie_libro ON inventario_librerie (libro_id)''',
+    '''CREATE INDEX IF NOT EXISTS idx_inventario_biblioteche_libro ON inventario_biblioteche (libro_id)''',
+    # get_dettagli_acquisto / aggiungi_feedback
+    '''CREATE INDEX IF NOT EXISTS idx_dettagli_acquisto_acquisto ON dettagli_acquisto (acquisto_id, libro_id)''',
+    '''CREATE INDEX IF NOT EXISTS idx_dettagli_acquisto_libro ON dettagli_acquisto (libro_id)''',
+    # get_feedback_libro
+    '''CREATE INDEX IF NOT EXISTS idx_feedback_libri_libro
+       ON feedback_libri (libro_id, data_recensione DESC) WHERE moderato = FALSE''',
+    '''CREATE INDEX IF NOT EXISTS idx_feedback_libri_utente ON feedback_libri (utente_id)''',
+    # get_acquisti_utente
+    '''CREATE INDEX IF NOT EXISTS idx_acquisti_utente ON acquisti (utente_id, data_acquisto DESC)''',
+    '''CREATE INDEX IF NOT EXISTS idx_consegne_acquisto ON consegne (acquisto_id)''',
+    # get_indirizzi_utente / get_metodi_pagamento_utente
+    '''CREATE INDEX IF NOT EXISTS idx_indirizzi_utente_utente ON indirizzi_utente (utente_id)''',
+    '''CREATE INDEX IF NOT EXISTS idx_metodi_pagamento_utente ON metodi_pagamento (utente_id)''',
+    # get_richieste_bibliotecario / crea_richiesta_bibliotecario
+    '''CREATE INDEX IF NOT EXISTS idx_richieste_bibliotecario
+       ON richieste_bibliotecari (bibliotecario_id, data_creazione DESC)''',
+    '''CREATE INDEX IF NOT EXISTS idx_utenti_ruolo ON utenti (ruolo_id)''',
+]
+
+
+# Elenco ordinato delle migrazioni: (versione, descrizione, passi).
+# Un passo è un'istruzione SQL oppure una funzione che riceve il cursore.
+MIGRAZIONI = [
+    (1, "Schema iniziale", [
+        # Tabelle esistenti per l'autenticazione
+        '''CREATE TABLE IF NOT EXISTS ruoli (
+            id SERIAL PRIMARY KEY,
+            nome VARCHAR(50) UNIQUE NOT NULL
+        )''',
+
+        # Nuova tabella per le città
+        '''CREATE TABLE IF NOT EXISTS citta (
+            id SERIAL PRIMARY KEY,
+            nome VARCHAR(255) UNIQUE NOT NULL,
+            regione VARCHAR(255)
+        )''',
+
+        '''CREATE TABLE IF NOT EXISTS biblioteche (
+            id SERIAL PRIMARY KEY,
+            nome VARCHAR(255) NOT NULL,
+            indirizzo VARCHAR(255),
+            citta_id INTEGER REFERENCES citta(id)
+        )''',
+
+        '''CREATE TABLE IF NOT EXISTS librerie (
+            id SERIAL PRIMARY KEY,
+            nome VARCHAR(255) NOT NULL,
+            indirizzo VARCHAR(255),
+            citta_id INTEGER REFERENCES citta(id)
+        )''',
+
+        '''CREATE TABLE IF NOT EXISTS utenti (
+            id SERIAL PRIMARY KEY,
+            email VARCHAR(255) UNIQUE NOT NULL,
+            nome_utente VARCHAR(100) UNIQUE NOT NULL,
+            nome VARCHAR(100) NOT NULL,
+            cognome VARCHAR(100) NOT NULL,
+            password_hash VARCHAR(255) NOT NULL,
+            ruolo_id INTEGER REFERENCES ruoli(id),
+            biblioteca_id INTEGER REFERENCES biblioteche(id),
+            libreria_id INTEGER REFERENCES librerie(id),
+            data_registrazione TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )''',
+
+        # Tabelle per i libri
+        '''CREATE TABLE IF NOT EXISTS autori (
+            id SERIAL PRIMARY KEY,
+            nome VARCHAR(255) UNIQUE NOT NULL
+        )''',
+
+        '''CREATE TABLE IF NOT EXISTS generi (
+            id SERIAL PRIMARY KEY,
+            nome VARCHAR(255) UNIQUE NOT NULL
+        )''',
+
+        '''CREATE TABLE IF NOT EXISTS libri (
+            id SERIAL PRIMARY KEY,
+            titolo VARCHAR(255) NOT NULL,
+            autore_id INTEGER REFERENCES autori(id),
+            genere_id INTEGER REFERENCES generi(id),
+            anno_pubblicazione INTEGER,
+            numero_pagine INTEGER,
+            prezzo_nuovo DECIMAL(10,2),
+            prezzo_usato DECIMAL(10,2),
+            descrizione TEXT,
+            isbn VARCHAR(20) UNIQUE
+        )''',
+
+        '''CREATE TABLE IF NOT EXISTS libri_disponibili (
+            id SERIAL PRIMARY KEY,
+            libro_id INTEGER REFERENCES libri(id) UNIQUE
+        )''',
+
+        '''CREATE TABLE IF NOT EXISTS libri_prestati (
+            id SERIAL PRIMARY KEY,
+            libro_id INTEGER REFERENCES libri(id) UNIQUE
+        )''',
+
+        # Nuove tabelle per il sistema di acquisti
+        '''CREATE TABLE IF NOT EXISTS inventario_librerie (
+            id SERIAL PRIMARY KEY,
+            libreria_id INTEGER REFERENCES librerie(id),
+            libro_id INTEGER REFERENCES libri(id),
+            copie_nuove INTEGER DEFAULT 0,
+            copie_usate INTEGER DEFAULT 0,
+            copie_vendute INTEGER DEFAULT 0,
+            UNIQUE(libreria_id, libro_id)
+        )''',
+
+        '''CREATE TABLE IF NOT EXISTS indirizzi_utente (
+            id SERIAL PRIMARY KEY,
+            utente_id INTEGER REFERENCES utenti(id),
+            nome VARCHAR(100) NOT NULL,
+            cognome VARCHAR(100) NOT NULL,
+            indirizzo VARCHAR(255) NOT NULL,
+            citta VARCHAR(100) NOT NULL,
+            cap VARCHAR(10) NOT NULL,
+            provincia VARCHAR(50) NOT NULL,
+            telefono VARCHAR(20),
+            is_default BOOLEAN DEFAULT FALSE,
+            data_creazione TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )''',
+
+        '''CREATE TABLE IF NOT EXISTS metodi_pagamento (
+            id SERIAL PRIMARY KEY,
+            utente_id INTEGER REFERENCES utenti(id),
+            tipo VARCHAR(20) NOT NULL CHECK (tipo IN ('carta_credito', 'carta_debito', 'paypal')),
+            numero_carta VARCHAR(255), -- criptato
+            scadenza DATE,
+            titolare VARCHAR(100),
+            is_default BOOLEAN DEFAULT FALSE,
+            data_creazione TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )''',
+
+        '''CREATE TABLE IF NOT EXISTS acquisti (
+            id SERIAL PRIMARY KEY,
+            utente_id INTEGER REFERENCES utenti(id),
+            libreria_id INTEGER REFERENCES librerie(id),
+            indirizzo_consegna_id INTEGER REFERENCES indirizzi_utente(id),
+            metodo_pagamento_id INTEGER REFERENCES metodi_pagamento(id),
+            totale DECIMAL(10,2) NOT NULL,
+            tasse DECIMAL(10,2) DEFAULT 0,
+            sconto DECIMAL(10,2) DEFAULT 0,
+            stato VARCHAR(30) DEFAULT 'in_attesa' CHECK (stato IN ('in_attesa', 'confermato', 'in_preparazione', 'spedito', 'consegnato', 'cancellato')),
+            tipo_consegna VARCHAR(20) DEFAULT 'negozio' CHECK (tipo_consegna IN ('negozio', 'casa')),
+            note TEXT,
+            data_acquisto TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            data_consegna_prevista TIMESTAMP,
+            data_consegna_effettiva TIMESTAMP
+        )''',
+
+        '''CREATE TABLE IF NOT EXISTS dettagli_acquisto (
+            id SERIAL PRIMARY KEY,
+            acquisto_id INTEGER REFERENCES acquisti(id),
+            libro_id INTEGER REFERENCES libri(id),
+            libreria_id INTEGER REFERENCES librerie(id),
+            quantita INTEGER NOT NULL,
+            condizione VARCHAR(10) NOT NULL CHECK (condizione IN ('nuovo', 'usato')),
+            prezzo_unitario DECIMAL(10,2) NOT NULL,
+            sconto DECIMAL(10,2) DEFAULT 0,
+            totale DECIMAL(10,2) NOT NULL
+        )''',
+
+        '''CREATE TABLE IF NOT EXISTS feedback_libri (
+            id SERIAL PRIMARY KEY,
+            utente_id INTEGER REFERENCES utenti(id),
+            libro_id INTEGER REFERENCES libri(id),
+            acquisto_id INTEGER REFERENCES acquisti(id),
+            valutazione INTEGER CHECK (valutazione >= 1 AND valutazione <= 5),
+            commento TEXT,
+            utile INTEGER DEFAULT 0,
+            non_utile INTEGER DEFAULT 0,
+            data_recensione TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            moderato BOOLEAN DEFAULT FALSE
+        )''',
+
+        '''CREATE TABLE IF NOT EXISTS consegne (
+            id SERIAL PRIMARY KEY,
+            acquisto_id INTEGER REFERENCES acquisti(id),
+            corriere VARCHAR(100),
+            numero_tracking VARCHAR(100) UNIQUE,
+            stato VARCHAR(30) DEFAULT 'in_preparazione' CHECK (stato IN ('in_preparazione', 'spedito', 'in_transito', 'consegnato', 'ritornato')),
+            indirizzo_consegna TEXT,
+            data_spedizione TIMESTAMP,
+            data_consegna_prevista TIMESTAMP,
+            data_consegna_effettiva TIMESTAMP,
+            note TEXT
+        )''',
+
+        '''CREATE TABLE IF NOT EXISTS richieste_bibliotecari (
+            id SERIAL PRIMARY KEY,
+            bibliotecario_id INTEGER REFERENCES utenti(id),
+            tipo VARCHAR(30) NOT NULL CHECK (tipo IN ('prenotazione', 'lista_attesa', 'restituzione', 'altro')),
+            descrizione TEXT NOT NULL,
+            priorita VARCHAR(10) DEFAULT 'normale' CHECK (priorita IN ('bassa', 'normale', 'alta', 'urgente')),
+            stato VARCHAR(20) DEFAULT 'aperta' CHECK (stato IN ('aperta', 'in_lavorazione', 'risolta', 'chiusa')),
+            data_creazione TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            data_risoluzione TIMESTAMP
+        )''',
+
+        # Colonne aggiunte dopo la prima versione dello schema
+        '''ALTER TABLE libri ADD COLUMN IF NOT EXISTS prezzo DECIMAL(10,2)''',
+        '''ALTER TABLE libri ADD COLUMN IF NOT EXISTS prezzo_nuovo DECIMAL(10,2)''',
+        '''ALTER TABLE libri ADD COLUMN IF NOT EXISTS prezzo_usato DECIMAL(10,2)''',
+        '''ALTER TABLE libri ADD COLUMN IF NOT EXISTS descrizione TEXT''',
+        '''ALTER TABLE libri ADD COLUMN IF NOT EXISTS isbn VARCHAR(20)''',
+        '''ALTER TABLE biblioteche ADD COLUMN IF NOT EXISTS citta_id INTEGER REFERENCES citta(id)''',
+        '''ALTER TABLE librerie ADD COLUMN IF NOT EXISTS citta_id INTEGER REFERENCES citta(id)''',
+
+        # Aggiorna prezzi esistenti se NULL
+        '''UPDATE libri SET prezzo_nuovo = prezzo WHERE prezzo_nuovo IS NULL''',
+        '''UPDATE libri SET prezzo_usato = prezzo * 0.7 WHERE prezzo_usato IS NULL''',  # usato = 70% del prezzo nuovo
+
+        # Inserisci ruoli di default se non esistono
+        "INSERT INTO ruoli (nome) VALUES ('bibliotecario') ON CONFLICT (nome) DO NOTHING",
+        "INSERT INTO ruoli (nome) VALUES ('libraio') ON CONFLICT (nome) DO NOTHING",
+        "INSERT INTO ruoli (nome) VALUES ('utente') ON CONFLICT (nome) DO NOTHING",
+
+        # Inserisci città di default se non esistono
+        "INSERT INTO citta (nome, regione) VALUES ('Milano', 'Lombardia') ON CONFLICT (nome) DO NOTHING",
+        "INSERT INTO citta (nome, regione) VALUES ('Roma', 'Lazio') ON CONFLICT (nome) DO NOTHING",
+        "INSERT INTO citta (nome, regione) VALUES ('Torino', 'Piemonte') ON CONFLICT (nome) DO NOTHING",
+        "INSERT INTO citta (nome, regione) VALUES ('Firenze', 'Toscana') ON CONFLICT (nome) DO NOTHING",
+        "INSERT INTO citta (nome, regione) VALUES ('Napoli', 'Campania') ON CONFLICT (nome) DO NOTHING",
+        "INSERT INTO citta (nome, regione) VALUES ('Bologna', 'Emilia-Romagna') ON CONFLICT (nome) DO NOTHING",
+
+        # Aggiorna dati esistenti se citta_id è NULL (per database esistenti)
+        '''UPDATE biblioteche SET citta_id = (SELECT id FROM citta WHERE nome = 'Roma' LIMIT 1) WHERE citta_id IS NULL''',
+        '''UPDATE librerie SET citta_id = (SELECT id FROM citta WHERE nome = 'Roma' LIMIT 1) WHERE citta_id IS NULL''',
+
+        # Inserisci biblioteche e librerie di default se non esistono
+        inserisci_strutture_default,
+
+        # Nuove tabelle per le funzionalità utente
+        '''CREATE TABLE IF NOT EXISTS prenotazioni (
+            id SERIAL PRIMARY KEY,
+            utente_id INTEGER REFERENCES utenti(id),
+            libro_id INTEGER REFERENCES libri(id),
+            data_prenotazione TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            data_scadenza TIMESTAMP,
+            stato VARCHAR(20) DEFAULT 'attiva' CHECK (stato IN ('attiva', 'completata', 'scaduta'))
+        )''',
+
+        '''CREATE TABLE IF NOT EXISTS liste_attesa (
+            id SERIAL PRIMARY KEY,
+            utente_id INTEGER REFERENCES utenti(id),
+            libro_id INTEGER REFERENCES libri(id),
+            data_richiesta TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            posizione INTEGER,
+            stato VARCHAR(20) DEFAULT 'attiva' CHECK (stato IN ('attiva', 'notificato', 'completata'))
+        )''',
+
+        '''CREATE TABLE IF NOT EXISTS libri_salvati (
+            id SERIAL PRIMARY KEY,
+            utente_id INTEGER REFERENCES utenti(id),
+            libro_id INTEGER REFERENCES libri(id),
+            data_salvataggio TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(utente_id, libro_id)
+        )''',
+
+        '''CREATE TABLE IF NOT EXISTS notifiche (
+            id SERIAL PRIMARY KEY,
+            utente_id INTEGER REFERENCES utenti(id),
+            messaggio TEXT NOT NULL,
+            tipo VARCHAR(50) DEFAULT 'generale',
+            letta BOOLEAN DEFAULT FALSE,
+            data_creazione TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )''',
+    ]),
+
+    (2, "Ricerca full-text con stemming italiano e unaccent", [
+        "CREATE EXTENSION IF NOT EXISTS unaccent",
+        '''DO $$
+            BEGIN
+                IF NOT EXISTS (SELECT 1 FROM pg_ts_config WHERE cfgname = 'italiano_unaccent') THEN
+                    CREATE TEXT SEARCH CONFIGURATION italiano_unaccent (COPY = pg_catalog.italian);
+                    ALTER TEXT SEARCH CONFIGURATION italiano_unaccent
+                        ALTER MAPPING FOR hword, hword_part, word WITH unaccent, italian_stem;
+                END IF;
+            END $$''',
+        '''ALTER TABLE libri ADD COLUMN IF NOT EXISTS ricerca_tsv tsvector''',
+
+        # Il vettore include nome dell'autore e del genere, quindi è mantenuto da trigger
+        # (una colonna GENERATED non può leggere altre tabelle)
+        '''CREATE OR REPLACE FUNCTION aggiorna_ricerca_libro() RETURNS trigger AS $$
+            BEGIN
+                NEW.ricerca_tsv :=
+                    setweight(to_tsvector('italiano_unaccent', coalesce(NEW.titolo, '')), 'A') ||
+                    setweight(to_tsvector('italiano_unaccent',
+                        coalesce((SELECT nome FROM autori WHERE id = NEW.autore_id), '')), 'B') ||
+                    setweight(to_tsvector('italiano_unaccent',
+                        coalesce((SELECT nome FROM generi WHERE id = NEW.genere_id), '')), 'C') ||
+                    setweight(to_tsvector('italiano_unaccent', coalesce(NEW.descrizione, '')), 'D');
+                RETURN NEW;
+            END
+        $$ LANGUAGE plpgsql''',
+        '''DROP TRIGGER IF EXISTS trg_libri_ricerca ON libri''',
+        '''CREATE TRIGGER trg_libri_ricerca
+            BEFORE INSERT OR UPDATE OF titolo, autore_id, genere_id, descrizione ON libri
+            FOR EACH ROW EXECUTE PROCEDURE aggiorna_ricerca_libro()''',
+
+        # Se cambia il nome di un autore o di un genere ricalcola i vettori dei suoi libri
+        '''CREATE OR REPLACE FUNCTION propaga_ricerca_autore() RETURNS trigger AS $$
+            BEGIN
+                UPDATE libri SET autore_id = autore_id WHERE autore_id = NEW.id;
+                RETURN NULL;
+            END
+        $$ LANGUAGE plpgsql''',
+        '''CREATE OR REPLACE FUNCTION propaga_ricerca_genere() RETURNS trigger AS $$
+            BEGIN
+                UPDATE libri SET genere_id = genere_id WHERE genere_id = NEW.id;
+                RETURN NULL;
+            END
+        $$ LANGUAGE plpgsql''',
+        '''DROP TRIGGER IF EXISTS trg_autori_ricerca ON autori''',
+        '''CREATE TRIGGER trg_autori_ricerca
+            AFTER UPDATE OF nome ON autori
+            FOR EACH ROW EXECUTE PROCEDURE propaga_ricerca_autore()''',
+        '''DROP TRIGGER IF EXISTS trg_generi_ricerca ON generi''',
+        '''CREATE TRIGGER trg_generi_ricerca
+            AFTER UPDATE OF nome ON generi
+            FOR EACH ROW EXECUTE PROCEDURE propaga_ricerca_genere()''',
+
+        # Calcola il vettore per i libri inseriti prima dell'introduzione del trigger
+        '''UPDATE libri SET titolo = titolo WHERE ricerca_tsv IS NULL''',
+        '''CREATE INDEX IF NOT EXISTS idx_libri_ricerca_tsv ON libri USING GIN (ricerca_tsv)''',
+    ]),
+
+    (3, "Ricerca tollerante agli errori con indici a trigrammi", [
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        # unaccent() non è IMMUTABLE e non può essere usata negli indici: si usa un wrapper
+        '''CREATE OR REPLACE FUNCTION f_unaccent(text) RETURNS text AS
+            $$ SELECT public.unaccent('public.unaccent', $1) $$
+            LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT''',
+        '''CREATE INDEX IF NOT EXISTS idx_libri_titolo_trgm ON libri USING GIN (f_unaccent(titolo) gin_trgm_ops)''',
+        '''CREATE INDEX IF NOT EXISTS idx_autori_nome_trgm ON autori USING GIN (f_unaccent(nome) gin_trgm_ops)''',
+        '''CREATE INDEX IF NOT EXISTS idx_libri_autore_id ON libri (autore_id)''',
+    ]),
+
+    (4, "Inventario delle biblioteche e indici per la ricerca per struttura", [
+        # Copie possedute da ogni biblioteca (equivalente di inventario_librerie)
+        '''CREATE TABLE IF NOT EXISTS inventario_biblioteche (
+            id SERIAL PRIMARY KEY,
+            biblioteca_id INTEGER REFERENCES biblioteche(id),
+            libro_id INTEGER REFERENCES libri(id),
+            copie_totali INTEGER DEFAULT 0,
+            copie_disponibili INTEGER DEFAULT 0,
+            UNIQUE(biblioteca_id, libro_id)
+        )''',
+
+        # Indici per la ricerca limitata a una struttura: contengono solo i titoli
+        # presenti e includono le giacenze, così da rispondere con index-only scan
+        '''CREATE INDEX IF NOT EXISTS idx_inventario_librerie_giacenza
+            ON inventario_librerie (libreria_id, libro_id) INCLUDE (copie_nuove, copie_usate)
+            WHERE copie_nuove > 0 OR copie_usate > 0''',
+        '''CREATE INDEX IF NOT EXISTS idx_inventario_biblioteche_giacenza
+            ON inventario_biblioteche (biblioteca_id, libro_id) INCLUDE (copie_totali, copie_disponibili)
+            WHERE copie_totali > 0''',
+    ]),
+
+    (5, "Indice per le ricerche puntuali per titolo", [
+        # autori.nome e libri.isbn hanno già un indice UNIQUE
+        '''CREATE INDEX IF NOT EXISTS idx_libri_titolo ON libri (titolo)''',
+    ]),
+
+    # Verificabili con: python diagnostica.py
+    (6, "Indici per chiavi esterne e query frequenti", INDICI_QUERY_FREQUENTI),
+
+    (7, "Dati di esempio", [
+        popola_dati_esempio,
+    ]),
+
+    (8, "Indici per leggere vendite e prenotazioni recenti (suggerimenti di ricerca)", [
+        '''CREATE INDEX IF NOT EXISTS idx_acquisti_data ON acquisti (data_acquisto)''',
+        '''CREATE INDEX IF NOT EXISTS idx_prenotazioni_data ON prenotazioni (data_prenotazione)''',
+    ]),
+
+    (9, "Versione del catalogo e notifiche delle modifiche (cache dei client)", [
+        # Registro delle modifiche: versione crescente e libro toccato. libro_id NULL
+        # indica una modifica massiva dopo cui i client devono ricaricare tutto.
+        # Le righe vecchie si possono cancellare purché resti l'ultima: i client
+        # rimasti indietro se ne accorgono e ricaricano il catalogo.
+        '''CREATE TABLE IF NOT EXISTS modifiche_catalogo (
+            versione BIGSERIAL PRIMARY KEY,
+            libro_id INTEGER,
+            modificato_il TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )''',
+        # TG_ARGV[0] è la colonna con l'id del libro; la NOTIFY ha sempre lo stesso
+        # contenuto, quindi PostgreSQL ne consegna una sola per transazione
+        '''CREATE OR REPLACE FUNCTION registra_modifica_catalogo() RETURNS trigger AS $$
+            DECLARE
+                ids INTEGER[] := '{}';
+            BEGIN
+                IF TG_OP <> 'INSERT' THEN
+                    ids := ids || (to_jsonb(OLD) ->> TG_ARGV[0])::INTEGER;
+                END IF;
+                IF TG_OP <> 'DELETE' THEN
+                    ids := ids || (to_jsonb(NEW) ->> TG_ARGV[0])::INTEGER;
+                END IF;
+                INSERT INTO modifiche_catalogo (libro_id)
+                SELECT DISTINCT id FROM unnest(ids) AS id WHERE id IS NOT NULL;
+                PERFORM pg_notify('catalogo', '');
+                RETURN NULL;
+            END
+        $$ LANGUAGE plpgsql''',
+        '''DROP TRIGGER IF EXISTS trg_libri_catalogo ON libri''',
+        '''CREATE TRIGGER trg_libri_catalogo
+            AFTER INSERT OR UPDATE OR DELETE ON libri
+            FOR EACH ROW EXECUTE PROCEDURE registra_modifica_catalogo('id')''',
+        '''DROP TRIGGER IF EXISTS trg_libri_disponibili_catalogo ON libri_disponibili''',
+        '''CREATE TRIGGER trg_libri_disponibili_catalogo
+            AFTER INSERT OR UPDATE OR DELETE ON libri_disponibili
+            FOR EACH ROW EXECUTE PROCEDURE registra_modifica_catalogo('libro_id')''',
+        '''DROP TRIGGER IF EXISTS trg_libri_prestati_catalogo ON libri_prestati''',
+        '''CREATE TRIGGER trg_libri_prestati_catalogo
+            AFTER INSERT OR UPDATE OR DELETE ON libri_prestati
+            FOR EACH ROW EXECUTE PROCEDURE registra_modifica_catalogo('libro_id')''',
+        '''DROP TRIGGER IF EXISTS trg_inventario_librerie_catalogo ON inventario_librerie''',
+        '''CREATE TRIGGER trg_inventario_librerie_catalogo
+            AFTER INSERT OR UPDATE OR DELETE ON inventario_librerie
+            FOR EACH ROW EXECUTE PROCEDURE registra_modifica_catalogo('libro_id')''',
+    ]),
+
+    (10, "Notifiche delle modifiche ai dati di riferimento (città, strutture, ruoli)", [
+        # Una notifica per istruzione basta: i client rileggono comunque tutto l'albero
+        '''CREATE OR REPLACE FUNCTION notifica_riferimento() RETURNS trigger AS $$
+            BEGIN
+                PERFORM pg_notify('riferimento', TG_TABLE_NAME);
+                RETURN NULL;
+            END
+        $$ LANGUAGE plpgsql''',
+        '''DROP TRIGGER IF EXISTS trg_citta_riferimento ON citta''',
+        '''CREATE TRIGGER trg_citta_riferimento
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON citta
+            FOR EACH STATEMENT EXECUTE PROCEDURE notifica_riferimento()''',
+        '''DROP TRIGGER IF EXISTS trg_biblioteche_riferimento ON biblioteche''',
+        '''CREATE TRIGGER trg_biblioteche_riferimento
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON biblioteche
+            FOR EACH STATEMENT EXECUTE PROCEDURE notifica_riferimento()''',
+        '''DROP TRIGGER IF EXISTS trg_librerie_riferimento ON librerie''',
+        '''CREATE TRIGGER trg_librerie_riferimento
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON librerie
+            FOR EACH STATEMENT EXECUTE PROCEDURE notifica_riferimento()''',
+        '''DROP TRIGGER IF EXISTS trg_ruoli_riferimento ON ruoli''',
+        '''CREATE TRIGGER trg_ruoli_riferimento
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON ruoli
+            FOR EACH STATEMENT EXECUTE PROCEDURE notifica_riferimento()''',
+    ]),
+
+    (11, "Indice per la potatura del registro delle modifiche al catalogo", [
+        '''CREATE INDEX IF NOT EXISTS idx_modifiche_catalogo_data ON modifiche_catalogo (modificato_il)''',
+    ]),
+
+    (12, "Copie delle biblioteche per i libri già in catalogo", [
+        # La disponibilità è unica per tutto il catalogo (libri_disponibili / libri_prestati):
+        # ogni biblioteca riceve una copia di ogni libro, disponibile se lo è il libro.
+        # Solo se l'inventario è vuoto, per non toccare quelli già caricati (genera_dati.py)
+        '''INSERT INTO inventario_biblioteche (biblioteca_id, libro_id, copie_totali, copie_disponibili)
+            SELECT b.id, l.id, 1, CASE WHEN ld.libro_id IS NULL THEN 0 ELSE 1 END
+            FROM biblioteche b
+            CROSS JOIN libri l
+            LEFT JOIN libri_disponibili ld ON ld.libro_id = l.id
+            WHERE NOT EXISTS (SELECT 1 FROM inventario_biblioteche)
+            ON CONFLICT (biblioteca_id, libro_id) DO NOTHING''',
+    ]),
+]
+
+ULTIMA_VERSIONE = MIGRAZIONI[-1][0]
+
+
+def versione_corrente(conn):
+    """Restituisce la versione dello schema (0 se non è mai stata applicata una migrazione)"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT MAX(versione) FROM schema_version")
+        versione = cursor.fetchone()[0] or 0
+    except psycopg2.errors.UndefinedTable:
+        versione = 0
+    finally:
+        cursor.close()
+    conn.rollback()
+    return versione
+
+
+def applica_migrazioni(conn):
+    """Applica in ordine le migrazioni mancanti; ognuna è una transazione a sé.
+
+    Con lo schema già aggiornato esegue una sola query. Più processi avviati
+    insieme si serializzano su un advisory lock e rileggono la versione prima
+    di applicare ciascuna migrazione.
+    """
+    if versione_corrente(conn) >= ULTIMA_VERSIONE:
+        return
+
+    cursor = conn.cursor()
+    try:
+        for versione, descrizione, passi in MIGRAZIONI:
+            cursor.execute("SELECT pg_advisory_xact_lock(%s)", (LOCK_MIGRAZIONI,))
+            cursor.execute('''CREATE TABLE IF NOT EXISTS schema_version (
+                versione INTEGER PRIMARY KEY,
+                descrizione TEXT NOT NULL,
+                applicata_il TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )''')
+            cursor.execute("SELECT 1 FROM schema_version WHERE versione = %s", (versione,))
+            if cursor.fetchone():
+                conn.commit()
+                continue
+
+            print(f"Applicazione migrazione {versione}: {descrizione}...")
+            for passo in passi:
+                if callable(passo):
+                    passo(cursor)
+                else:
+                    cursor.execute(passo)
+            cursor.execute("INSERT INTO schema_version (versione, descrizione) VALUES (%s, %s)",
+                           (versione, descrizione))
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
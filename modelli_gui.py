@@ -0,0 +1,486 @@
+"""
+Modelli e delegati Qt per mostrare grandi quantità di libri senza creare un
+widget per ogni riga
+"""
+
+from PyQt5.QtWidgets import (
+    QStyledItemDelegate, QStyle, QWidget, QHBoxLayout, QLabel, QComboBox, QSpinBox
+)
+from PyQt5.QtCore import (
+    Qt, QAbstractListModel, QAbstractTableModel, QModelIndex, QRect, QEvent, QSize, pyqtSignal
+)
+from PyQt5.QtGui import QFont, QColor, QPen, QPainter, QFontMetrics, QLinearGradient
+
+
+RUOLO_LIBRO = Qt.UserRole + 1
+RUOLO_CONDIZIONE = Qt.UserRole + 2
+RUOLO_QUANTITA = Qt.UserRole + 3
+
+# Colonne delle tabelle di libri: (attributo di Libro, intestazione)
+COLONNE_LIBRI = [
+    ('titolo', 'Titolo'),
+    ('autore', 'Autore'),
+    ('genere', 'Genere'),
+    ('anno_pubblicazione', 'Anno Pubblicazione'),
+    ('numero_pagine', 'Numero Pagine'),
+    ('prezzo', 'Prezzo'),
+    ('disponibile', 'Disponibile'),
+]
+
+
+def condizioni_disponibili(libro):
+    """Condizioni acquistabili di un libro come lista di (etichetta, valore)"""
+    condizioni = []
+    if libro.prezzo_nuovo:
+        condizioni.append(('Nuovo', 'nuovo'))
+    if libro.prezzo_usato:
+        condizioni.append(('Usato', 'usato'))
+    return condizioni or [('Standard', 'standard')]
+
+
+class ModelloRisultati(QAbstractListModel):
+    """Risultati di una ricerca, caricati a pagine man mano che la vista scorre.
+
+    Il modello non interroga il database: quando la vista chiede altre righe
+    emette richiedi_pagina e chi lo usa risponde con aggiungi_pagina.
+    """
+
+    richiedi_pagina = pyqtSignal()
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._libri = []
+        self._scelte = {}  # riga -> [condizione, quantità] scelte dall'utente
+        self._altri_disponibili = False
+        self._in_caricamento = False
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._libri)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        libro = self._libri[index.row()]
+        if role == Qt.DisplayRole:
+            return libro.titolo
+        if role == Qt.ToolTipRole:
+            return libro.descrizione or None
+        if role == RUOLO_LIBRO:
+            return libro
+        if role == RUOLO_CONDIZIONE:
+            scelta = self._scelte.get(index.row())
+            return scelta[0] if scelta else condizioni_disponibili(libro)[0][1]
+        if role == RUOLO_QUANTITA:
+            scelta = self._scelte.get(index.row())
+            return scelta[1] if scelta else 1
+        return None
+
+    def setData(self, index, value, role=Qt.EditRole):
+        if not index.isValid() or role not in (RUOLO_CONDIZIONE, RUOLO_QUANTITA):
+            return False
+        scelta = self._scelte.setdefault(
+            index.row(), [self.data(index, RUOLO_CONDIZIONE), self.data(index, RUOLO_QUANTITA)])
+        scelta[0 if role == RUOLO_CONDIZIONE else 1] = value
+        self.dataChanged.emit(index, index, [role])
+        return True
+
+    def flags(self, index):
+        if not index.isValid():
+            return Qt.NoItemFlags
+        return Qt.ItemIsEnabled | Qt.ItemIsSelectable | Qt.ItemIsEditable
+
+    def nuova_ricerca(self):
+        """Sospende il caricamento a pagine in attesa dei risultati di una nuova ricerca.
+
+        Le righe della ricerca precedente restano visibili finché non arriva
+        la prima pagina di quella nuova (aggiungi_pagina con sostituisci=True).
+        """
+        self._altri_disponibili = False
+        self._in_caricamento = True
+
+    def aggiungi_pagina(self, libri, altri_disponibili, sostituisci=False):
+        """Accoda una pagina di risultati, o sostituisce quelli presenti"""
+        self._in_caricamento = False
+        self._altri_disponibili = altri_disponibili
+        if sostituisci:
+            self.beginResetModel()
+            self._libri = list(libri)
+            self._scelte = {}
+            self.endResetModel()
+        elif libri:
+            inizio = len(self._libri)
+            self.beginInsertRows(QModelIndex(), inizio, inizio + len(libri) - 1)
+            self._libri.extend(libri)
+            self.endInsertRows()
+
+    def caricamento_fallito(self):
+        """Interrompe il caricamento a pagine dopo un errore"""
+        self._in_caricamento = False
+        self._altri_disponibili = False
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self._altri_disponibili and not self._in_caricamento
+
+    def fetchMore(self, parent=QModelIndex()):
+        if self.canFetchMore(parent):
+            self._in_caricamento = True
+            self.richiedi_pagina.emit()
+
+
+class ModelloLibri(QAbstractTableModel):
+    """Tabella di sola lettura su una lista di libri già caricata"""
+
+    def __init__(self, libri=None, parent=None):
+        super().__init__(parent)
+        self._libri = list(libri or [])
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._libri)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(COLONNE_LIBRI)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        attributo = COLONNE_LIBRI[index.column()][0]
+        if role == Qt.DisplayRole:
+            valore = self._valore(index.row(), attributo)
+            if attributo == 'prezzo':
+                return f"€{valore:.2f}"
+            if attributo == 'disponibile':
+                return 'Sì' if valore else 'No'
+            return str(valore)
+        if role == Qt.TextAlignmentRole and attributo in ('anno_pubblicazione', 'numero_pagine', 'prezzo'):
+            return int(Qt.AlignRight | Qt.AlignVCenter)
+        if role == RUOLO_LIBRO:
+            return self._libro(index.row())
+        return None
+
+    def _valore(self, riga, attributo):
+        return getattr(self._libri[riga], attributo)
+
+    def _libro(self, riga):
+        return self._libri[riga]
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return COLONNE_LIBRI[section][1]
+        return super().headerData(section, orientation, role)
+
+
+class ModelloCatalogoColonnare(ModelloLibri):
+    """Tabella su un models.CatalogoColonnare: le celle si leggono dalle colonne
+    e un Libro viene creato solo quando lo chiede RUOLO_LIBRO.
+
+    Le righe mostrate sono quelle valide al momento della creazione del modello.
+    """
+
+    def __init__(self, catalogo, parent=None):
+        super().__init__(parent=parent)
+        self._catalogo = catalogo
+        self._righe = catalogo.righe_valide()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._righe)
+
+    def _valore(self, riga, attributo):
+        return self._catalogo.valore(self._righe[riga], attributo)
+
+    def _libro(self, riga):
+        return self._catalogo.libro(self._righe[riga])
+
+
+class ModelloCatalogo(ModelloLibri):
+    """Catalogo completo letto a blocchi da un CursoreCatalogo lato server.
+
+    Le righe arrivano man mano che la vista scorre (canFetchMore/fetchMore);
+    ordinamento e filtro riaprono il cursore con ORDER BY e WHERE in SQL. Ogni
+    lettura avviene nei thread dell'esecutore: i risultati di un cursore
+    superato da un nuovo ordinamento o filtro vengono ignorati.
+    """
+
+    caricamento = pyqtSignal(bool)
+    errore = pyqtSignal(object)
+
+    def __init__(self, db, esecutore, blocco=200, parent=None):
+        super().__init__(parent=parent)
+        self._db = db
+        self._esecutore = esecutore
+        self._blocco = blocco
+        self._cursore = None
+        self._generazione = 0
+        self._in_caricamento = False
+        self._ordina = 'titolo'
+        self._discendente = False
+        self._filtro = None
+
+    def apri(self):
+        """(Ri)apre il cursore con l'ordinamento e il filtro correnti"""
+        self._generazione += 1
+        generazione = self._generazione
+        ordina, discendente, filtro = self._ordina, self._discendente, self._filtro
+        self._chiudi_cursore()
+
+        self.beginResetModel()
+        self._libri = []
+        self.endResetModel()
+        self._imposta_caricamento(True)
+
+        def apri_e_leggi():
+            cursore = self._db.apri_catalogo(ordina, discendente, filtro)
+            try:
+                return cursore, cursore.leggi(self._blocco)
+            except Exception:
+                cursore.chiudi()
+                raise
+
+        self._esecutore.esegui(apri_e_leggi,
+                               al_termine=lambda esito: self._aperto(generazione, *esito),
+                               in_errore=lambda e: self._fallito(generazione, e))
+
+    def _aperto(self, generazione, cursore, libri):
+        if generazione != self._generazione:
+            # Nel frattempo è cambiato ordinamento o filtro
+            self._esecutore.esegui(cursore.chiudi)
+            return
+        self._cursore = cursore
+        self._aggiungi(generazione, libri)
+
+    def _aggiungi(self, generazione, libri):
+        if generazione != self._generazione:
+            return
+        if libri:
+            inizio = len(self._libri)
+            self.beginInsertRows(QModelIndex(), inizio, inizio + len(libri) - 1)
+            self._libri.extend(libri)
+            self.endInsertRows()
+        self._imposta_caricamento(False)
+
+    def _fallito(self, generazione, errore):
+        if generazione != self._generazione:
+            return
+        self._imposta_caricamento(False)
+        self._chiudi_cursore()
+        self.errore.emit(errore)
+
+    def _imposta_caricamento(self, attivo):
+        self._in_caricamento = attivo
+        self.caricamento.emit(attivo)
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return (not parent.isValid() and self._cursore is not None
+                and not self._cursore.finito and not self._in_caricamento)
+
+    def fetchMore(self, parent=QModelIndex()):
+        if not self.canFetchMore(parent):
+            return
+        generazione = self._generazione
+        self._imposta_caricamento(True)
+        self._esecutore.esegui(self._cursore.leggi, self._blocco,
+                               al_termine=lambda libri: self._aggiungi(generazione, libri),
+                               in_errore=lambda e: self._fallito(generazione, e))
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        self._ordina = COLONNE_LIBRI[column][0]
+        self._discendente = order == Qt.DescendingOrder
+        self.apri()
+
+    def imposta_filtro(self, testo):
+        """Filtra il catalogo per titolo, autore o genere"""
+        self._filtro = testo.strip() or None
+        self.apri()
+
+    def chiudi(self):
+        """Chiude il cursore e ignora le letture ancora in corso"""
+        self._generazione += 1
+        self._chiudi_cursore()
+
+    def _chiudi_cursore(self):
+        if self._cursore is not None:
+            self._esecutore.esegui(self._cursore.chiudi)
+            self._cursore = None
+
+
+class _ControlliAcquisto(QWidget):
+    """Condizione e quantità del libro selezionato: l'unico widget reale della lista"""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setAutoFillBackground(False)
+        layout = QHBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.setSpacing(8)
+
+        etichetta = QLabel('Condizione:')
+        etichetta.setFont(QFont('SF Pro Text', 12))
+        layout.addWidget(etichetta)
+
+        self.condizione = QComboBox()
+        self.condizione.setFont(QFont('SF Pro Text', 12))
+        self.condizione.setFixedWidth(100)
+        layout.addWidget(self.condizione)
+
+        quantita = QLabel('Q.tà:')
+        quantita.setFont(QFont('SF Pro Text', 12))
+        layout.addWidget(quantita)
+
+        self.quantita = QSpinBox()
+        self.quantita.setRange(1, 10)
+        self.quantita.setFixedWidth(60)
+        layout.addWidget(self.quantita)
+        layout.addStretch()
+
+
+class DelegatoLibro(QStyledItemDelegate):
+    """Disegna la card di acquisto di un libro direttamente sul viewport.
+
+    Solo la riga corrente ha un editor reale (condizione e quantità); il
+    pulsante del carrello è disegnato e il clic viene gestito in editorEvent.
+    """
+
+    aggiungi_al_carrello = pyqtSignal(object, str, int)
+
+    ALTEZZA = 190
+    MARGINE = 5
+    PADDING = 20
+    LARGHEZZA_ACQUISTO = 300
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._font_titolo = QFont('SF Pro Display', 18, QFont.Bold)
+        self._font_testo = QFont('SF Pro Text', 14)
+        self._font_prezzo = QFont('SF Pro Text', 14, QFont.Bold)
+        self._font_piccolo = QFont('SF Pro Text', 12)
+        self._font_icona = QFont('SF Pro Text', 40)
+        self._font_pulsante = QFont('SF Pro Text', 12, QFont.Bold)
+
+    def sizeHint(self, option, index):
+        return QSize(650, self.ALTEZZA)
+
+    def _aree(self, rect):
+        """Rettangoli delle parti della card all'interno della riga"""
+        card = rect.adjusted(self.MARGINE, self.MARGINE, -self.MARGINE, -self.MARGINE)
+        contenuto = card.adjusted(self.PADDING, self.PADDING, -self.PADDING, -self.PADDING)
+        icona = QRect(contenuto.left(), contenuto.top(), 60, 60)
+        acquisto = QRect(contenuto.right() - self.LARGHEZZA_ACQUISTO + 1, contenuto.top(),
+                         self.LARGHEZZA_ACQUISTO, contenuto.height())
+        info = QRect(icona.right() + self.PADDING, contenuto.top(),
+                     acquisto.left() - icona.right() - 2 * self.PADDING, contenuto.height())
+        pulsante = QRect(acquisto.left(), acquisto.bottom() - 35, 230, 35)
+        controlli = QRect(acquisto.left(), pulsante.top() - 38, acquisto.width(), 30)
+        return {'card': card, 'icona': icona, 'info': info, 'acquisto': acquisto,
+                'controlli': controlli, 'pulsante': pulsante}
+
+    def _riga(self, painter, font, colore, rect, y, testo):
+        """Disegna una riga di testo troncata e restituisce la y della riga successiva"""
+        metrica = QFontMetrics(font)
+        painter.setFont(font)
+        painter.setPen(QColor(colore))
+        testo = metrica.elidedText(testo, Qt.ElideRight, rect.width())
+        painter.drawText(QRect(rect.left(), y, rect.width(), metrica.height()),
+                         Qt.AlignLeft | Qt.AlignVCenter, testo)
+        return y + metrica.height() + 6
+
+    def paint(self, painter, option, index):
+        libro = index.data(RUOLO_LIBRO)
+        if libro is None:
+            return
+        aree = self._aree(option.rect)
+        painter.save()
+        painter.setRenderHint(QPainter.Antialiasing)
+
+        # Sfondo della card
+        evidenziata = option.state & (QStyle.State_MouseOver | QStyle.State_Selected)
+        painter.setPen(QPen(QColor('#007aff' if evidenziata else '#e5e5e7'), 1))
+        painter.setBrush(QColor('#f8f9fa' if evidenziata else 'white'))
+        painter.drawRoundedRect(aree['card'], 12, 12)
+
+        painter.setFont(self._font_icona)
+        painter.setPen(QColor('#1d1d1f'))
+        painter.drawText(aree['icona'], Qt.AlignCenter, '📖')
+
+        # Informazioni libro
+        info = aree['info']
+        y = info.top()
+        y = self._riga(painter, self._font_titolo, '#1d1d1f', info, y, libro.titolo)
+        y = self._riga(painter, self._font_testo, '#86868b', info, y, f"di {libro.autore} • {libro.genere}")
+        y = self._riga(painter, self._font_testo, '#1d1d1f', info, y,
+                       f"{libro.anno_pubblicazione} • {libro.numero_pagine} pagine")
+
+        # Copie presenti nella struttura in cui si sta cercando
+        giacenza = getattr(libro, 'giacenza', None)
+        if giacenza:
+            if 'copie_nuove' in giacenza:
+                testo_giacenza = f"📦 In negozio: {giacenza['copie_nuove']} nuove • {giacenza['copie_usate']} usate"
+            else:
+                testo_giacenza = f"📦 In biblioteca: {giacenza['copie_disponibili']} disponibili su {giacenza['copie_totali']}"
+            y = self._riga(painter, self._font_testo, '#007aff', info, y, testo_giacenza)
+
+        if libro.descrizione:
+            self._riga(painter, self._font_piccolo, '#86868b', info, y, libro.descrizione)
+
+        # Prezzi
+        acquisto = aree['acquisto']
+        y = acquisto.top()
+        if libro.prezzo_nuovo:
+            y = self._riga(painter, self._font_prezzo, '#34c759', acquisto, y, f"🆕 Nuovo: €{libro.prezzo_nuovo:.2f}")
+        if libro.prezzo_usato:
+            y = self._riga(painter, self._font_prezzo, '#ff9500', acquisto, y, f"♻️ Usato: €{libro.prezzo_usato:.2f}")
+        if not libro.prezzo_nuovo and not libro.prezzo_usato:
+            self._riga(painter, self._font_prezzo, '#1d1d1f', acquisto, y, f"Prezzo: €{libro.prezzo:.2f}")
+
+        # Riepilogo della scelta, se la riga non ha l'editor aperto al suo posto
+        vista = option.widget
+        if vista is None or vista.indexWidget(index) is None:
+            condizione = index.data(RUOLO_CONDIZIONE)
+            etichetta = dict((v, e) for e, v in condizioni_disponibili(libro)).get(condizione, condizione)
+            controlli = aree['controlli']
+            self._riga(painter, self._font_piccolo, '#1d1d1f', controlli,
+                       controlli.top() + (controlli.height() - QFontMetrics(self._font_piccolo).height()) // 2,
+                       f"Condizione: {etichetta}    Q.tà: {index.data(RUOLO_QUANTITA)}")
+
+        # Pulsante aggiungi al carrello
+        pulsante = aree['pulsante']
+        gradiente = QLinearGradient(pulsante.topLeft(), pulsante.bottomLeft())
+        gradiente.setColorAt(0, QColor('#007aff'))
+        gradiente.setColorAt(1, QColor('#0056cc'))
+        painter.setPen(Qt.NoPen)
+        painter.setBrush(gradiente)
+        painter.drawRoundedRect(pulsante, 17, 17)
+        painter.setFont(self._font_pulsante)
+        painter.setPen(QColor('white'))
+        painter.drawText(pulsante, Qt.AlignCenter, '🛒 Aggiungi al Carrello')
+
+        painter.restore()
+
+    def editorEvent(self, event, model, option, index):
+        if event.type() == QEvent.MouseButtonRelease and event.button() == Qt.LeftButton:
+            if self._aree(option.rect)['pulsante'].contains(event.pos()):
+                self.aggiungi_al_carrello.emit(index.data(RUOLO_LIBRO), index.data(RUOLO_CONDIZIONE),
+                                               index.data(RUOLO_QUANTITA))
+                return True
+        return super().editorEvent(event, model, option, index)
+
+    def createEditor(self, parent, option, index):
+        editor = _ControlliAcquisto(parent)
+        for etichetta, valore in condizioni_disponibili(index.data(RUOLO_LIBRO)):
+            editor.condizione.addItem(etichetta, valore)
+        editor.condizione.currentIndexChanged.connect(lambda _: self.commitData.emit(editor))
+        editor.quantita.valueChanged.connect(lambda _: self.commitData.emit(editor))
+        return editor
+
+    def setEditorData(self, editor, index):
+        editor.condizione.blockSignals(True)
+        editor.quantita.blockSignals(True)
+        editor.condizione.setCurrentIndex(max(editor.condizione.findData(index.data(RUOLO_CONDIZIONE)), 0))
+        editor.quantita.setValue(index.data(RUOLO_QUANTITA))
+        editor.condizione.blockSignals(False)
+        editor.quantita.blockSignals(False)
+
+    def setModelData(self, editor, model, index):
+        model.setData(index, editor.condizione.currentData(), RUOLO_CONDIZIONE)
+        model.setData(index, editor.quantita.value(), RUOLO_QUANTITA)
+
+    def updateEditorGeometry(self, editor, option, index):
+        editor.setGeometry(self._aree(option.rect)['controlli'])
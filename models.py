@@ -2,8 +2,18 @@
 Modello dati per il sistema di gestione biblioteca
 """
 
+from array import array
+from bisect import bisect_left
+import math
+
+
 class Libro:
     """Classe che rappresenta un libro"""
+
+    # Niente __dict__ per istanza: circa 50 byte in meno per libro
+    __slots__ = ('titolo', 'autore', 'genere', 'anno_pubblicazione', 'numero_pagine', 'prezzo',
+                 'prezzo_nuovo', 'prezzo_usato', 'descrizione', 'isbn', 'disponibile', 'id', 'giacenza')
+
     def __init__(self, titolo, autore, genere, anno_pubblicazione, numero_pagine, prezzo, prezzo_nuovo=None, prezzo_usato=None, descrizione="", isbn=""):
         self.titolo = titolo
         self.autore = autore
@@ -16,6 +26,8 @@ class Libro:
         self.descrizione = descrizione
         self.isbn = isbn
         self.disponibile = True
+        self.id = None  # Assegnato quando il libro viene letto dal database
+        self.giacenza = None  # Copie nella struttura, solo per i risultati delle ricerche per struttura
 
     def __str__(self):
         prezzo_info = f"€{self.prezzo:.2f}"
@@ -57,4 +69,228 @@ class Libro:
             data.get('isbn', '')
         )
         libro.disponibile = data.get('disponibile', True)
-        return libro
\ No newline at end of file
+        return libro
+
+
+# Valore degli interi mancanti (anno o pagine NULL) nelle colonne di CatalogoColonnare
+INTERO_MANCANTE = -2 ** 31
+
+
+class CatalogoColonnare:
+    """Catalogo in memoria organizzato per colonne invece che per oggetti.
+
+    Id, anni, pagine e prezzi stanno in array tipizzati (i prezzi mancanti sono
+    NaN), autori e generi sono codici in una tabella di nomi unici, titoli,
+    descrizioni e ISBN in liste. Le viste leggono i campi con
+    valore(riga, attributo); libro(riga) crea un Libro solo quando serve un
+    oggetto intero.
+
+    Le modifiche non spostano le righe: un libro modificato viene riscritto al
+    suo posto, uno nuovo si aggiunge in fondo e uno rimosso lascia una riga non
+    valida fino al prossimo caricamento completo. Le righe caricate sono
+    ordinate per id (ricerca binaria); quelle aggiunte dopo con id non crescente
+    si ritrovano con un piccolo dizionario. Due indici accanto alle colonne,
+    titolo -> righe e codice autore -> righe, rendono le ricerche esatte
+    indipendenti dalla dimensione del catalogo.
+    """
+
+    def __init__(self):
+        self.ids = array('q')
+        self.anni = array('i')
+        self.pagine = array('i')
+        self.prezzi = array('d')
+        self.prezzi_nuovi = array('d')
+        self.prezzi_usati = array('d')
+        self.disponibili = bytearray()
+        self.valide = bytearray()
+        self.codici_autore = array('I')
+        self.codici_genere = array('I')
+        self.titoli = []
+        self.descrizioni = []
+        self.isbn = []
+        self.autori = []  # codice -> nome
+        self.generi = []
+        self.rimosse = 0
+        self._codice_autore = {}  # nome -> codice
+        self._codice_genere = {}
+        self._ordinate = 0  # le prime righe, con id crescenti
+        self._righe_coda = {}  # id -> riga per le righe successive
+        self._righe_titolo = {}  # titolo -> riga, o array di righe se il titolo si ripete
+        self._righe_autore = []  # codice autore -> array di righe
+
+    @classmethod
+    def da_righe(cls, righe):
+        """Costruisce il catalogo da righe (id, titolo, autore, genere, anno, pagine,
+        prezzo, prezzo_nuovo, prezzo_usato, descrizione, isbn, disponibile),
+        preferibilmente ordinate per id"""
+        catalogo = cls()
+        for riga in righe:
+            catalogo._aggiungi(riga)
+        return catalogo
+
+    def __len__(self):
+        """Numero di libri (le righe non valide sono escluse)"""
+        return len(self.ids) - self.rimosse
+
+    def righe_valide(self):
+        """Numeri delle righe con un libro, nell'ordine delle righe"""
+        return array('I', (riga for riga, valida in enumerate(self.valide) if valida))
+
+    def _codice(self, nomi, codici, nome):
+        codice = codici.get(nome)
+        if codice is None:
+            codice = codici[nome] = len(nomi)
+            nomi.append(nome)
+            if nomi is self.autori:
+                self._righe_autore.append(array('I'))
+        return codice
+
+    def _aggiungi(self, dati):
+        """Aggiunge una riga in fondo e la registra negli indici"""
+        libro_id, titolo, autore, genere, anno, pagine, prezzo, prezzo_nuovo, prezzo_usato, descrizione, isbn, disponibile = dati
+        riga = len(self.ids)
+        if self._ordinate == riga and (riga == 0 or libro_id > self.ids[riga - 1]):
+            self._ordinate += 1
+        else:
+            self._righe_coda[libro_id] = riga
+        self.ids.append(libro_id)
+        self.anni.append(INTERO_MANCANTE if anno is None else anno)
+        self.pagine.append(INTERO_MANCANTE if pagine is None else pagine)
+        self.prezzi.append(math.nan if prezzo is None else float(prezzo))
+        self.prezzi_nuovi.append(math.nan if prezzo_nuovo is None else float(prezzo_nuovo))
+        self.prezzi_usati.append(math.nan if prezzo_usato is None else float(prezzo_usato))
+        self.disponibili.append(1 if disponibile else 0)
+        self.valide.append(1)
+        codice_autore = self._codice(self.autori, self._codice_autore, autore)
+        self.codici_autore.append(codice_autore)
+        self.codici_genere.append(self._codice(self.generi, self._codice_genere, genere))
+        self.titoli.append(titolo)
+        self.descrizioni.append(descrizione)
+        self.isbn.append(isbn)
+        self._indicizza(riga, titolo, codice_autore)
+
+    def _indicizza(self, riga, titolo, codice_autore):
+        righe = self._righe_titolo.get(titolo)
+        if righe is None:
+            self._righe_titolo[titolo] = riga
+        elif isinstance(righe, int):
+            self._righe_titolo[titolo] = array('I', (righe, riga))
+        else:
+            righe.append(riga)
+        self._righe_autore[codice_autore].append(riga)
+
+    def _deindicizza(self, riga):
+        titolo = self.titoli[riga]
+        righe = self._righe_titolo[titolo]
+        if isinstance(righe, int):
+            del self._righe_titolo[titolo]
+        else:
+            righe.remove(riga)
+            if len(righe) == 1:
+                self._righe_titolo[titolo] = righe[0]
+        self._righe_autore[self.codici_autore[riga]].remove(riga)
+
+    def _riga(self, libro_id):
+        """Riga con questo id, valida o no; None se non c'è"""
+        riga = self._righe_coda.get(libro_id)
+        if riga is not None:
+            return riga
+        riga = bisect_left(self.ids, libro_id, 0, self._ordinate)
+        if riga < self._ordinate and self.ids[riga] == libro_id:
+            return riga
+        return None
+
+    def riga_di(self, libro_id):
+        """Riga del libro con questo id, None se non c'è"""
+        riga = self._riga(libro_id)
+        return riga if riga is not None and self.valide[riga] else None
+
+    def aggiorna(self, libro):
+        """Inserisce il libro o ne riscrive i dati nella sua riga"""
+        dati = (libro.id, libro.titolo, libro.autore, libro.genere, libro.anno_pubblicazione, libro.numero_pagine,
+                libro.prezzo, libro.prezzo_nuovo, libro.prezzo_usato, libro.descrizione, libro.isbn, libro.disponibile)
+        riga = self._riga(libro.id)
+        if riga is None:
+            self._aggiungi(dati)
+            return
+        if self.valide[riga]:
+            self._deindicizza(riga)
+        else:
+            self.valide[riga] = 1
+            self.rimosse -= 1
+        self.anni[riga] = INTERO_MANCANTE if libro.anno_pubblicazione is None else libro.anno_pubblicazione
+        self.pagine[riga] = INTERO_MANCANTE if libro.numero_pagine is None else libro.numero_pagine
+        self.prezzi[riga] = math.nan if libro.prezzo is None else float(libro.prezzo)
+        self.prezzi_nuovi[riga] = math.nan if libro.prezzo_nuovo is None else float(libro.prezzo_nuovo)
+        self.prezzi_usati[riga] = math.nan if libro.prezzo_usato is None else float(libro.prezzo_usato)
+        self.disponibili[riga] = 1 if libro.disponibile else 0
+        codice_autore = self._codice(self.autori, self._codice_autore, libro.autore)
+        self.codici_autore[riga] = codice_autore
+        self.codici_genere[riga] = self._codice(self.generi, self._codice_genere, libro.genere)
+        self.titoli[riga] = libro.titolo
+        self.descrizioni[riga] = libro.descrizione
+        self.isbn[riga] = libro.isbn
+        self._indicizza(riga, libro.titolo, codice_autore)
+
+    def rimuovi(self, libro_id):
+        """Toglie il libro lasciandone la riga non valida; restituisce False se non c'era"""
+        riga = self.riga_di(libro_id)
+        if riga is None:
+            return False
+        self._deindicizza(riga)
+        self.valide[riga] = 0
+        self.rimosse += 1
+        # I testi non servono più: si liberano subito
+        self.titoli[riga] = self.descrizioni[riga] = self.isbn[riga] = None
+        return True
+
+    def valore(self, riga, attributo):
+        """Campo di una riga con il nome dell'attributo di Libro corrispondente"""
+        if attributo == 'titolo':
+            return self.titoli[riga]
+        if attributo == 'autore':
+            return self.autori[self.codici_autore[riga]]
+        if attributo == 'genere':
+            return self.generi[self.codici_genere[riga]]
+        if attributo in ('anno_pubblicazione', 'numero_pagine'):
+            valore = (self.anni if attributo == 'anno_pubblicazione' else self.pagine)[riga]
+            return None if valore == INTERO_MANCANTE else valore
+        if attributo in ('prezzo', 'prezzo_nuovo', 'prezzo_usato'):
+            colonna = {'prezzo': self.prezzi, 'prezzo_nuovo': self.prezzi_nuovi, 'prezzo_usato': self.prezzi_usati}
+            valore = colonna[attributo][riga]
+            return None if math.isnan(valore) else valore
+        if attributo == 'disponibile':
+            return bool(self.disponibili[riga])
+        if attributo == 'descrizione':
+            return self.descrizioni[riga]
+        if attributo == 'isbn':
+            return self.isbn[riga]
+        if attributo == 'id':
+            return self.ids[riga]
+        raise AttributeError(attributo)
+
+    def libro(self, riga):
+        """Crea il Libro della riga"""
+        anno, pagine = self.anni[riga], self.pagine[riga]
+        prezzi = [colonna[riga] for colonna in (self.prezzi, self.prezzi_nuovi, self.prezzi_usati)]
+        prezzo, prezzo_nuovo, prezzo_usato = [None if math.isnan(prezzo) else prezzo for prezzo in prezzi]
+        libro = Libro(self.titoli[riga], self.autori[self.codici_autore[riga]], self.generi[self.codici_genere[riga]],
+                      None if anno == INTERO_MANCANTE else anno, None if pagine == INTERO_MANCANTE else pagine,
+                      prezzo, prezzo_nuovo, prezzo_usato, self.descrizioni[riga], self.isbn[riga])
+        libro.id = self.ids[riga]
+        libro.disponibile = bool(self.disponibili[riga])
+        return libro
+
+    def cerca_titolo(self, titolo):
+        """Riga del primo libro (per id) con il titolo esatto, None se non c'è"""
+        righe = self._righe_titolo.get(titolo)
+        if righe is None or isinstance(righe, int):
+            return righe
+        return min(righe, key=self.ids.__getitem__)
+
+    def righe_autore(self, autore):
+        """Righe dei libri dell'autore, in ordine di id"""
+        codice = self._codice_autore.get(autore)
+        if codice is None:
+            return []
+        return sorted(self._righe_autore[codice], key=self.ids.__getitem__)
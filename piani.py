@@ -0,0 +1,226 @@
+"""
+Cattura dei piani di esecuzione delle query di DatabaseManager e confronto tra
+due catture per individuare regressioni di piano.
+
+La cattura esegue gli scenari di benchmark.py registrando ogni statement
+emesso, poi ne ottiene EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) in una
+transazione annullata, così anche INSERT e UPDATE non lasciano tracce.
+Per ogni forma di query si salvano l'impronta del piano (tipi di nodo,
+tabelle e indici, senza costi né stime), le scansioni e i buffer letti.
+
+Uso:
+    python piani.py cattura --scala 1 --output piani_base.json
+    python piani.py confronta piani_base.json piani_nuovi.json
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import sys
+from datetime import datetime
+
+import psycopg2
+
+import benchmark
+import genera_dati
+from database import DatabaseManager
+from diagnostica import COMANDI_SPIEGABILI, TABELLE_PICCOLE
+from strumentazione import strumentazione
+
+
+# Nodi che leggono una tabella senza indice
+SCANSIONI_SEQUENZIALI = ('Seq Scan', 'Parallel Seq Scan')
+
+# I buffer sono considerati in crescita oltre questo fattore e questo minimo assoluto
+FATTORE_BUFFER = 2.0
+MINIMO_BUFFER = 100
+
+# Chiamate per scenario durante la cattura: basta vedere ogni statement almeno una volta
+CHIAMATE_PER_SCENARIO = 3
+
+
+def struttura_piano(nodo):
+    """Descrizione del piano senza costi e stime: cambia solo se cambia la strategia"""
+    etichetta = nodo['Node Type']
+    dettagli = [nodo[k] for k in ('Relation Name', 'Index Name', 'Join Type', 'Strategy') if k in nodo]
+    if dettagli:
+        etichetta += '(' + ','.join(dettagli) + ')'
+    figli = [struttura_piano(f) for f in nodo.get('Plans', [])]
+    return etichetta + ('[' + ';'.join(figli) + ']' if figli else '')
+
+
+def scansioni(nodo):
+    """Elenco (tipo di nodo, tabella, indice) delle letture di tabelle nel piano"""
+    risultato = []
+    if 'Relation Name' in nodo:
+        risultato.append((nodo['Node Type'], nodo['Relation Name'], nodo.get('Index Name')))
+    for figlio in nodo.get('Plans', []):
+        risultato.extend(scansioni(figlio))
+    return risultato
+
+
+def spiega(conn, query, parametri):
+    """EXPLAIN ANALYZE di uno statement in una transazione annullata"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + query, parametri)
+        radice = cursor.fetchone()[0][0]
+    finally:
+        conn.rollback()
+        cursor.close()
+
+    piano = radice['Plan']
+    struttura = struttura_piano(piano)
+    return {
+        'impronta': hashlib.sha1(struttura.encode()).hexdigest()[:16],
+        'struttura': struttura,
+        'scansioni': [list(s) for s in scansioni(piano)],
+        'buffer': piano.get('Shared Hit Blocks', 0) + piano.get('Shared Read Blocks', 0),
+        'tempo_ms': radice.get('Execution Time'),
+    }
+
+
+def cattura_statement(db, dati, seme):
+    """Esegue gli scenari e restituisce {forma: (query, parametri)} del primo esempio di ogni forma"""
+    statement = {}
+
+    def osserva(forma, query, parametri):
+        if query.lstrip().upper().startswith(COMANDI_SPIEGABILI):
+            statement.setdefault(forma, (query, parametri))
+
+    strumentazione.osservatore = osserva
+    strumentazione.abilita()
+    try:
+        rng = random.Random(seme)
+        for funzione in benchmark.scenari(dati).values():
+            for _ in range(CHIAMATE_PER_SCENARIO):
+                funzione(db, rng)
+    finally:
+        strumentazione.disabilita()
+        strumentazione.osservatore = None
+    return statement
+
+
+def cattura(dsn, args):
+    """Cattura i piani di tutti gli statement degli scenari"""
+    db = DatabaseManager(dsn=dsn, cache_ricerche=False)
+    with db.connessione() as conn:
+        dati = benchmark.campioni(conn, args.seme)
+    statement = cattura_statement(db, dati, args.seme)
+
+    piani = {}
+    conn = psycopg2.connect(dsn)
+    try:
+        for forma, (query, parametri) in sorted(statement.items()):
+            try:
+                piani[forma] = spiega(conn, query, parametri)
+            except psycopg2.Error as e:
+                piani[forma] = {'errore': str(e).strip()}
+            stato = piani[forma].get('impronta', 'errore')
+            print(f"{stato:<16} {forma[:100]}", file=sys.stderr)
+    finally:
+        conn.close()
+
+    return {
+        'meta': {
+            'commit': benchmark.commit_corrente(),
+            'data': datetime.now().isoformat(timespec='seconds'),
+            'scala': args.scala,
+            'seme': args.seme,
+        },
+        'piani': piani,
+    }
+
+
+def confronta(base, nuovo, fattore_buffer=FATTORE_BUFFER):
+    """Restituisce (regressioni, piani cambiati) confrontando due catture"""
+    regressioni = []
+    cambiati = []
+    for forma, dopo in nuovo['piani'].items():
+        prima = base['piani'].get(forma)
+        if not prima or 'errore' in prima or 'errore' in dopo:
+            continue
+        if prima['impronta'] != dopo['impronta']:
+            cambiati.append(forma)
+
+        # Tabelle che prima avevano un accesso tramite indice e ora sono lette per intero
+        con_indice = {tabella for tipo, tabella, _ in prima['scansioni'] if tipo not in SCANSIONI_SEQUENZIALI}
+        sequenziali_prima = {tabella for tipo, tabella, _ in prima['scansioni'] if tipo in SCANSIONI_SEQUENZIALI}
+        for tipo, tabella, _ in dopo['scansioni']:
+            nuova_tabella = tabella not in sequenziali_prima and tabella not in TABELLE_PICCOLE
+            if tipo in SCANSIONI_SEQUENZIALI and (tabella in con_indice or nuova_tabella):
+                regressioni.append(f"Seq Scan su {tabella}: {forma[:100]}")
+
+        if dopo['buffer'] - prima['buffer'] > MINIMO_BUFFER and dopo['buffer'] > prima['buffer'] * fattore_buffer:
+            regressioni.append(f"buffer {prima['buffer']} -> {dopo['buffer']}: {forma[:100]}")
+    return sorted(set(regressioni)), cambiati
+
+
+def comando_cattura(args):
+    if args.dsn:
+        if not args.salta_caricamento:
+            genera_dati.genera(args.dsn, args.scala, args.seme, args.processi)
+        report = cattura(args.dsn, args)
+    else:
+        with benchmark.ClusterTemporaneo(args.bin_dir) as dsn:
+            genera_dati.genera(dsn, args.scala, args.seme, args.processi)
+            report = cattura(dsn, args)
+
+    testo = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(testo + "\n")
+    else:
+        print(testo)
+    return 0
+
+
+def comando_confronta(args):
+    with open(args.base, encoding='utf-8') as f:
+        base = json.load(f)
+    with open(args.nuovo, encoding='utf-8') as f:
+        nuovo = json.load(f)
+
+    print(f"Confronto piani {base['meta'].get('commit')} -> {nuovo['meta'].get('commit')}")
+    regressioni, cambiati = confronta(base, nuovo, args.fattore_buffer)
+    for forma in cambiati:
+        print(f"~ piano cambiato: {forma[:100]}")
+        print(f"    prima: {base['piani'][forma]['struttura']}")
+        print(f"    dopo:  {nuovo['piani'][forma]['struttura']}")
+
+    if regressioni:
+        print("\n✗ Regressioni di piano:")
+        for riga in regressioni:
+            print(f"  {riga}")
+        return 1
+    print(f"\n✓ Nessuna regressione ({len(nuovo['piani'])} statement, {len(cambiati)} piani cambiati)")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cattura e confronto dei piani di esecuzione")
+    comandi = parser.add_subparsers(dest='comando', required=True)
+
+    cattura_parser = comandi.add_parser('cattura', help="cattura i piani degli statement di DatabaseManager")
+    cattura_parser.add_argument('--scala', type=float, default=1)
+    cattura_parser.add_argument('--seme', type=int, default=42)
+    cattura_parser.add_argument('--processi', type=int, default=None)
+    cattura_parser.add_argument('--output', help="file JSON di destinazione (default: stdout)")
+    cattura_parser.add_argument('--bin-dir', help="cartella con initdb e pg_ctl")
+    cattura_parser.add_argument('--dsn', help="usa un database esistente invece di un cluster temporaneo")
+    cattura_parser.add_argument('--salta-caricamento', action='store_true', help="con --dsn, non genera i dati")
+    cattura_parser.set_defaults(funzione=comando_cattura)
+
+    confronto = comandi.add_parser('confronta', help="confronta due catture e segnala le regressioni")
+    confronto.add_argument('base')
+    confronto.add_argument('nuovo')
+    confronto.add_argument('--fattore-buffer', type=float, default=FATTORE_BUFFER)
+    confronto.set_defaults(funzione=comando_confronta)
+
+    args = parser.parse_args()
+    return args.funzione(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
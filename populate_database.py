@@ -5,6 +5,7 @@ Script per popolare il database con dati di esempio
 import random
 from datetime import datetime, timedelta
 from database import DatabaseManager
+from models import Libro
 
 
 class DatabasePopulator:
@@ -129,6 +130,7 @@ class DatabasePopulator:
         print("Creazione della collezione di libri...")
 
         libri_creati = 0
+        libri = []
         target_libri = 1200  # Oltre 1000 libri
 
         # Combinazioni autore-genere per creare libri realistici
@@ -183,27 +185,20 @@ class DatabasePopulator:
             # Genera ISBN fittizio
             isbn = f"978-{random.randint(10,99)}-{random.randint(100000,999999)}-{random.randint(0,9)}"
 
-            try:
-                # Salva il libro
-                from models import Libro
-                libro = Libro(titolo, autore, genere, anno_pubblicazione, numero_pagine,
-                            prezzo_nuovo, prezzo_nuovo, prezzo_usato, descrizione, isbn)
-                self.db.save_libro(libro)
-                libri_creati += 1
-
-                if libri_creati % 50 == 0:
-                    print(f"Creati {libri_creati} libri...")
+            libri.append(Libro(titolo, autore, genere, anno_pubblicazione, numero_pagine,
+                               prezzo_nuovo, prezzo_nuovo, prezzo_usato, descrizione, isbn))
 
-            except Exception as e:
-                print(f"Errore nella creazione del libro '{titolo}': {e}")
-                # Continua con il prossimo libro invece di fermarsi
-                continue
+        # Un solo COPY e poche query set-based invece di una transazione per libro
+        success, message = self.db.importa_libri(libri)
+        print(message)
+        if success:
+            libri_creati = len(libri)
 
         print(f"Collezione di {libri_creati} libri creata con successo!")
 
     def populate_inventory(self):
-        """Popola l'inventario delle librerie con copie dei libri"""
-        print("Popolamento dell'inventario delle librerie...")
+        """Popola l'inventario delle librerie e delle biblioteche con copie dei libri"""
+        print("Popolamento dell'inventario delle librerie e delle biblioteche...")
 
         try:
             cursor = self.db.conn.cursor()
@@ -212,14 +207,20 @@ class DatabasePopulator:
             cursor.execute("SELECT id, nome FROM librerie")
             librerie = cursor.fetchall()
 
+            cursor.execute("SELECT id FROM biblioteche")
+            biblioteche = [row[0] for row in cursor.fetchall()]
+
             # Ottieni tutti i libri
             cursor.execute("SELECT id, titolo FROM libri")
             libri = cursor.fetchall()
 
-            cursor.close()
+            # La disponibilità di un libro vale per tutte le biblioteche
+            cursor.execute("SELECT libro_id FROM libri_disponibili")
+            disponibili = {row[0] for row in cursor.fetchall()}
 
-            inventario_creato = 0
+            cursor.close()
 
+            voci = []
             for libreria_id, libreria_nome in librerie:
                 # Per ogni libreria, aggiungi inventario per alcuni libri casuali
                 libri_per_libreria = random.sample(libri, min(len(libri), random.randint(50, 200)))
@@ -230,29 +231,28 @@ class DatabasePopulator:
                     copie_usate = random.randint(0, 5)
 
                     if copie_nuove > 0 or copie_usate > 0:
-                        try:
-                            success, message = self.db.aggiorna_inventario_libreria(
-                                libreria_id, libro_id, copie_nuove, copie_usate)
-                            if success:
-                                inventario_creato += 1
-                            else:
-                                print(f"Errore inventario {libreria_nome} - {libro_titolo}: {message}")
-                        except Exception as e:
-                            print(f"Errore nell'aggiornamento inventario per {libreria_nome}: {e}")
-                            continue
-
-                # Commit ogni 10 librerie per evitare problemi di transazione
-                if librerie.index((libreria_id, libreria_nome)) % 10 == 0:
-                    try:
-                        self.db.conn.commit()
-                    except Exception as e:
-                        print(f"Errore commit parziale: {e}")
-
-            # Commit finale
-            try:
-                self.db.conn.commit()
-            except Exception as e:
-                print(f"Errore commit finale: {e}")
+                        voci.append((libreria_id, libro_id, copie_nuove, copie_usate))
+
+            # Tutte le voci con un solo COPY e un'unica INSERT ... ON CONFLICT
+            success, message = self.db.importa_inventario_librerie(voci)
+            if not success:
+                print(message)
+            inventario_creato = len(voci) if success else 0
+
+            voci = []
+            for biblioteca_id in biblioteche:
+                # Ogni biblioteca possiede alcuni libri casuali, in una o più copie
+                libri_per_biblioteca = random.sample(libri, min(len(libri), random.randint(200, 500)))
+
+                for libro_id, libro_titolo in libri_per_biblioteca:
+                    copie_totali = random.randint(1, 3)
+                    copie_disponibili = copie_totali if libro_id in disponibili else 0
+                    voci.append((biblioteca_id, libro_id, copie_totali, copie_disponibili))
+
+            success, message = self.db.importa_inventario_biblioteche(voci)
+            if not success:
+                print(message)
+            inventario_creato += len(voci) if success else 0
 
             print(f"Inventario popolato per {inventario_creato} voci!")
 
@@ -276,7 +276,7 @@ class DatabasePopulator:
             print("Il database ora contiene:")
             print("- Città italiane con biblioteche e librerie")
             print("- Oltre 1000 libri di autori italiani e internazionali")
-            print("- Inventario distribuito nelle librerie")
+            print("- Inventario distribuito nelle librerie e nelle biblioteche")
 
         except Exception as e:
             print(f"Errore durante il popolamento: {e}")
@@ -0,0 +1,288 @@
+"""
+Strumentazione delle query: latenza per forma di query, righe restituite,
+round trip per metodo di DatabaseManager e log delle query lente.
+
+Disattivata per impostazione predefinita: in quel caso ogni execute costa un
+solo controllo di un attributo. Si attiva da codice con strumentazione.abilita()
+oppure avviando il programma con BIBLIOTECA_STRUMENTAZIONE=1; con
+BIBLIOTECA_STRUMENTAZIONE_FILE=percorso.json le statistiche vengono salvate
+all'uscita e si leggono con:
+
+    python strumentazione.py percorso.json [--ordina tempo|chiamate|righe] [--limite 20]
+"""
+
+import argparse
+import atexit
+import bisect
+import json
+import os
+import re
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+import psycopg2.extensions
+
+
+# Limiti superiori (ms) dei bucket degli istogrammi di latenza; l'ultimo bucket è "oltre"
+LIMITI_ISTOGRAMMA_MS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500]
+
+# Letterali sostituiti da ? per raggruppare query che differiscono solo nei valori
+_LETTERALI = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_SPAZI = re.compile(r"\s+")
+
+_NESSUNA_OPERAZIONE = nullcontext()
+
+
+class _Statistica:
+    """Contatori di una forma di query o di un metodo"""
+
+    __slots__ = ('chiamate', 'tempo_ms', 'righe', 'round_trip', 'istogramma')
+
+    def __init__(self):
+        self.chiamate = 0
+        self.tempo_ms = 0.0
+        self.righe = 0
+        self.round_trip = 0
+        self.istogramma = [0] * (len(LIMITI_ISTOGRAMMA_MS) + 1)
+
+    def aggiungi(self, durata_ms, righe=0, round_trip=0):
+        self.chiamate += 1
+        self.tempo_ms += durata_ms
+        self.righe += max(righe, 0)
+        self.round_trip += round_trip
+        self.istogramma[bisect.bisect_left(LIMITI_ISTOGRAMMA_MS, durata_ms)] += 1
+
+    def percentile(self, p):
+        """Stima del percentile (ms) dal limite superiore del bucket"""
+        obiettivo = p / 100 * self.chiamate
+        cumulato = 0
+        for indice, conteggio in enumerate(self.istogramma):
+            cumulato += conteggio
+            if conteggio and cumulato >= obiettivo:
+                return LIMITI_ISTOGRAMMA_MS[indice] if indice < len(LIMITI_ISTOGRAMMA_MS) else None
+        return None
+
+    def to_dict(self):
+        return {
+            'chiamate': self.chiamate,
+            'tempo_ms': round(self.tempo_ms, 3),
+            'media_ms': round(self.tempo_ms / self.chiamate, 3) if self.chiamate else 0,
+            'p50_ms': self.percentile(50),
+            'p95_ms': self.percentile(95),
+            'p99_ms': self.percentile(99),
+            'righe': self.righe,
+            'round_trip': self.round_trip,
+            'istogramma': self.istogramma,
+        }
+
+
+class Strumentazione:
+    """Raccoglie le statistiche di tutte le connessioni del processo"""
+
+    def __init__(self):
+        self.attiva = False
+        self.soglia_lenta_ms = None
+        self._lock = threading.Lock()
+        self._locale = threading.local()
+        self._forme = {}
+        self._query = {}
+        self._metodi = {}
+        # Funzione opzionale chiamata con (forma, query, parametri) per ogni statement
+        self.osservatore = None
+
+    def abilita(self, soglia_lenta_ms=None):
+        """Attiva la raccolta; le query più lente di soglia_lenta_ms vengono stampate su stderr"""
+        self.soglia_lenta_ms = soglia_lenta_ms
+        self.attiva = True
+
+    def disabilita(self):
+        self.attiva = False
+
+    def azzera(self):
+        with self._lock:
+            self._query.clear()
+            self._metodi.clear()
+
+    def forma(self, query):
+        """Forma normalizzata della query (letterali sostituiti, spazi compressi)"""
+        forma = self._forme.get(query)
+        if forma is None:
+            if len(self._forme) > 10000:
+                # Query composte dinamicamente: evita che la cache cresca senza limite
+                self._forme.clear()
+            forma = _SPAZI.sub(' ', _LETTERALI.sub('?', query)).strip()
+            self._forme[query] = forma
+        return forma
+
+    def operazione(self, nome):
+        """Contesto che attribuisce al metodo indicato le query eseguite al suo interno"""
+        if not self.attiva:
+            return _NESSUNA_OPERAZIONE
+        return self._operazione(nome)
+
+    @contextmanager
+    def _operazione(self, nome):
+        locale = self._locale
+        if getattr(locale, 'metodo', None) is not None:
+            # Chiamata annidata: le query vanno al metodo chiamato dall'esterno
+            yield
+            return
+        locale.metodo = nome
+        locale.round_trip = 0
+        locale.righe = 0
+        inizio = time.perf_counter()
+        try:
+            yield
+        finally:
+            durata_ms = (time.perf_counter() - inizio) * 1000
+            locale.metodo = None
+            with self._lock:
+                self._metodi.setdefault(nome, _Statistica()).aggiungi(durata_ms, locale.righe, locale.round_trip)
+
+    def registra(self, query, durata_s, righe, parametri=None):
+        """Registra un round trip verso il server"""
+        durata_ms = durata_s * 1000
+        forma = self.forma(query)
+        if self.osservatore is not None:
+            self.osservatore(forma, query, parametri)
+        locale = self._locale
+        metodo = getattr(locale, 'metodo', None)
+        if metodo is not None:
+            locale.round_trip += 1
+            locale.righe += max(righe, 0)
+        with self._lock:
+            self._query.setdefault(forma, _Statistica()).aggiungi(durata_ms, righe, 1)
+
+        if self.soglia_lenta_ms is not None and durata_ms >= self.soglia_lenta_ms:
+            print(f"[query lenta] {durata_ms:.1f} ms in {metodo or '-'}: {forma}", file=sys.stderr)
+
+    def statistiche(self):
+        """Istantanea delle statistiche come dizionario serializzabile in JSON"""
+        with self._lock:
+            return {
+                'limiti_istogramma_ms': LIMITI_ISTOGRAMMA_MS,
+                'query': {forma: s.to_dict() for forma, s in self._query.items()},
+                'metodi': {nome: s.to_dict() for nome, s in self._metodi.items()},
+            }
+
+    def salva(self, percorso):
+        with open(percorso, 'w', encoding='utf-8') as f:
+            json.dump(self.statistiche(), f, indent=2, ensure_ascii=False)
+
+
+strumentazione = Strumentazione()
+
+
+def _testo(query, cursor):
+    if isinstance(query, bytes):
+        return query.decode('utf-8', 'replace')
+    if hasattr(query, 'as_string'):
+        return query.as_string(cursor)
+    return query
+
+
+class CursoreStrumentato(psycopg2.extensions.cursor):
+    """Cursore che misura ogni round trip quando la strumentazione è attiva"""
+
+    def execute(self, query, vars=None):
+        if not strumentazione.attiva:
+            return super().execute(query, vars)
+        inizio = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            strumentazione.registra(_testo(query, self), time.perf_counter() - inizio, self.rowcount, vars)
+
+    def executemany(self, query, vars_list):
+        if not strumentazione.attiva:
+            return super().executemany(query, vars_list)
+        inizio = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            strumentazione.registra(_testo(query, self), time.perf_counter() - inizio, self.rowcount)
+
+    def copy_expert(self, sql, file, size=8192):
+        if not strumentazione.attiva:
+            return super().copy_expert(sql, file, size)
+        inizio = time.perf_counter()
+        try:
+            return super().copy_expert(sql, file, size)
+        finally:
+            strumentazione.registra(_testo(sql, self), time.perf_counter() - inizio, self.rowcount)
+
+
+class ConnessioneStrumentata(psycopg2.extensions.connection):
+    """Connessione che crea cursori strumentati e misura commit e rollback"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cursor_factory = CursoreStrumentato
+
+    def commit(self):
+        if not strumentazione.attiva:
+            return super().commit()
+        inizio = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            strumentazione.registra('COMMIT', time.perf_counter() - inizio, 0)
+
+    def rollback(self):
+        if not strumentazione.attiva:
+            return super().rollback()
+        inizio = time.perf_counter()
+        try:
+            return super().rollback()
+        finally:
+            strumentazione.registra('ROLLBACK', time.perf_counter() - inizio, 0)
+
+
+def _abilita_da_ambiente():
+    if os.environ.get('BIBLIOTECA_STRUMENTAZIONE') != '1':
+        return
+    soglia = os.environ.get('BIBLIOTECA_QUERY_LENTE_MS')
+    strumentazione.abilita(float(soglia) if soglia else None)
+    percorso = os.environ.get('BIBLIOTECA_STRUMENTAZIONE_FILE')
+    if percorso:
+        atexit.register(strumentazione.salva, percorso)
+
+
+_abilita_da_ambiente()
+
+
+def stampa_report(statistiche, ordina='tempo', limite=20):
+    """Stampa metodi e forme di query ordinati per tempo totale, chiamate o righe"""
+    chiave = {'tempo': 'tempo_ms', 'chiamate': 'chiamate', 'righe': 'righe'}[ordina]
+
+    print("=== METODI ===")
+    print(f"{'metodo':<32} {'chiamate':>9} {'media ms':>10} {'p95 ms':>8} {'round trip/chiamata':>20}")
+    metodi = sorted(statistiche['metodi'].items(), key=lambda v: v[1][chiave], reverse=True)
+    for nome, s in metodi[:limite]:
+        p95 = f"{s['p95_ms']:g}" if s['p95_ms'] is not None else "oltre"
+        print(f"{nome:<32} {s['chiamate']:>9} {s['media_ms']:>10.2f} {p95:>8} "
+              f"{s['round_trip'] / s['chiamate']:>20.1f}")
+
+    print("\n=== QUERY ===")
+    query = sorted(statistiche['query'].items(), key=lambda v: v[1][chiave], reverse=True)
+    for forma, s in query[:limite]:
+        print(f"{s['chiamate']:>9}x {s['tempo_ms']:>11.1f} ms totali {s['media_ms']:>9.2f} ms medi "
+              f"{s['righe']:>9} righe  {forma[:120]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mostra le statistiche salvate dalla strumentazione")
+    parser.add_argument('file')
+    parser.add_argument('--ordina', choices=['tempo', 'chiamate', 'righe'], default='tempo')
+    parser.add_argument('--limite', type=int, default=20)
+    args = parser.parse_args()
+
+    with open(args.file, encoding='utf-8') as f:
+        stampa_report(json.load(f), args.ordina, args.limite)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,148 @@
+"""
+Suggerimenti per la casella di ricerca: titoli popolari, autori e generi che
+iniziano con il testo digitato, ordinati per popolarità (copie vendute,
+prenotazioni e prestiti).
+
+L'indice è tutto in memoria: un array ordinato di chiavi normalizzate in cui
+si cerca il prefisso con bisect, più le classifiche già pronte per i prefissi
+di uno, due o tre caratteri, che coprono troppe voci per essere ordinate a ogni
+tasto. Nessuna query viene eseguita mentre si digita; i pesi si aggiornano
+con i delta letti periodicamente da DatabaseManager.carica_suggerimenti_delta.
+"""
+
+import bisect
+import heapq
+import unicodedata
+
+
+# Numero massimo di suggerimenti restituiti e conservati nelle classifiche
+K_MASSIMO = 20
+
+# I prefissi fino a questa lunghezza hanno la classifica precalcolata
+LUNGHEZZA_PRECALCOLATA = 3
+
+# Etichette dei tipi di voce, nell'ordine usato a parità di peso
+TIPI = ('autore', 'titolo', 'genere')
+
+
+def normalizza(testo):
+    """Minuscolo, senza accenti e con gli spazi compressi"""
+    scomposto = unicodedata.normalize('NFKD', testo)
+    senza_accenti = ''.join(c for c in scomposto if not unicodedata.combining(c))
+    return ' '.join(senza_accenti.lower().split())
+
+
+def chiavi(testo):
+    """Chiavi di ricerca di una voce: il testo intero e ogni sua parte che inizia
+    con una parola, così il prefisso "ross" trova anche l'autore Mario Rossi"""
+    parole = normalizza(testo).split()
+    return [' '.join(parole[i:]) for i in range(len(parole))]
+
+
+class MotoreSuggerimenti:
+    """Indice dei suggerimenti; va costruito fuori dal thread dell'interfaccia e
+    non viene più modificato (con_delta ne crea uno nuovo).
+
+    voci sono tuple (tipo, testo, peso); istante e ultimo_libro_id indicano
+    da dove devono partire i delta successivi.
+    """
+
+    def __init__(self, voci=(), istante=None, ultimo_libro_id=0):
+        self.istante = istante
+        self.ultimo_libro_id = ultimo_libro_id
+        self._voci = []     # id -> (tipo, testo)
+        self._pesi = []     # id -> peso
+        self._ids = {}      # (tipo, testo) -> id
+        self._chiavi = []   # (chiave, id) ordinate per chiave
+        self._migliori = {}  # prefisso corto -> id ordinati per peso decrescente
+
+        for tipo, testo, peso in voci:
+            id_voce, nuova = self._voce(tipo, testo)
+            self._pesi[id_voce] += peso
+            if nuova:
+                self._chiavi.extend((chiave, id_voce) for chiave in chiavi(testo))
+        self._chiavi.sort()
+        self._precalcola()
+
+    def __len__(self):
+        return len(self._voci)
+
+    def _voce(self, tipo, testo):
+        """Restituisce (id, nuova) della voce, creandola con peso 0 se manca"""
+        id_voce = self._ids.get((tipo, testo))
+        if id_voce is not None:
+            return id_voce, False
+        id_voce = len(self._voci)
+        self._ids[(tipo, testo)] = id_voce
+        self._voci.append((tipo, testo))
+        self._pesi.append(0)
+        return id_voce, True
+
+    def _ordine(self, id_voce):
+        tipo, testo = self._voci[id_voce]
+        return (-self._pesi[id_voce], TIPI.index(tipo), testo)
+
+    def _precalcola(self):
+        # Scorrendo le voci dalla più popolare, ogni classifica si riempie già ordinata
+        prefissi = [[] for _ in self._voci]
+        for chiave, id_voce in self._chiavi:
+            prefissi[id_voce].extend(chiave[:lunghezza] for lunghezza in
+                                     range(1, min(len(chiave), LUNGHEZZA_PRECALCOLATA) + 1))
+        self._migliori = {}
+        for id_voce in sorted(range(len(self._voci)), key=self._ordine):
+            for prefisso in prefissi[id_voce]:
+                classifica = self._migliori.setdefault(prefisso, [])
+                if len(classifica) < K_MASSIMO and (not classifica or classifica[-1] != id_voce):
+                    classifica.append(id_voce)
+
+    def suggerisci(self, testo, k=10):
+        """Le k voci più popolari con una chiave che inizia con il testo, come (tipo, testo)"""
+        prefisso = normalizza(testo)
+        if not prefisso:
+            return []
+        if len(prefisso) <= LUNGHEZZA_PRECALCOLATA:
+            ids = self._migliori.get(prefisso, [])[:k]
+        else:
+            inizio = bisect.bisect_left(self._chiavi, (prefisso,))
+            fine = bisect.bisect_left(self._chiavi, (prefisso + '\uffff',), inizio)
+            candidati = {self._chiavi[i][1] for i in range(inizio, fine)}
+            ids = heapq.nsmallest(k, candidati, key=self._ordine)
+        return [self._voci[id_voce] for id_voce in ids]
+
+    def con_delta(self, delta):
+        """Nuovo motore con i pesi letti da carica_suggerimenti_delta; questo resta invariato.
+
+        delta è (righe, istante, ultimo_libro_id) con righe (titolo, autore,
+        genere, peso). Va chiamato fuori dal thread dell'interfaccia, che nel
+        frattempo continua a usare il motore attuale e poi lo sostituisce. Le
+        chiavi nuove si uniscono all'array ordinato con un solo ordinamento; i
+        pesi possono solo crescere, quindi ogni classifica toccata si ricalcola
+        una volta dalla vecchia più le voci modificate.
+        """
+        righe, istante, ultimo_libro_id = delta
+        motore = MotoreSuggerimenti.__new__(MotoreSuggerimenti)
+        motore.istante = istante
+        motore.ultimo_libro_id = ultimo_libro_id
+        motore._voci = list(self._voci)
+        motore._pesi = list(self._pesi)
+        motore._ids = dict(self._ids)
+
+        nuove_chiavi = []
+        toccate = {}  # prefisso corto -> id delle voci modificate
+        for titolo, autore, genere, peso in righe:
+            for tipo, testo in (('titolo', titolo), ('autore', autore), ('genere', genere)):
+                id_voce, nuova = motore._voce(tipo, testo)
+                motore._pesi[id_voce] += peso
+                for chiave in chiavi(testo):
+                    if nuova:
+                        nuove_chiavi.append((chiave, id_voce))
+                    for lunghezza in range(1, min(len(chiave), LUNGHEZZA_PRECALCOLATA) + 1):
+                        toccate.setdefault(chiave[:lunghezza], set()).add(id_voce)
+
+        # Timsort riconosce la parte già ordinata: il costo è quasi lineare
+        motore._chiavi = sorted(self._chiavi + nuove_chiavi) if nuove_chiavi else self._chiavi
+        motore._migliori = dict(self._migliori)
+        for prefisso, ids in toccate.items():
+            candidati = ids.union(self._migliori.get(prefisso, ()))
+            motore._migliori[prefisso] = heapq.nsmallest(K_MASSIMO, candidati, key=motore._ordine)
+        return motore